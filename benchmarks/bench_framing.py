@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+#
+#    Copyright (c) 2012+ Anton Tyurin <noxiouz@yandex.ru>
+#    Copyright (c) 2013+ Evgeny Safronov <division494@gmail.com>
+#    Copyright (c) 2011-2014 Other contributors as noted in the AUTHORS file.
+#
+#    This file is part of Cocaine.
+#
+#    Cocaine is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Cocaine is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Peak memory of sending a big chunk with `packv1` and with `packv1_buffers`.
+
+The pipe is emulated with a bytearray write buffer, as IOStream does.
+Requires python 3 for tracemalloc.
+
+Usage: python benchmarks/bench_framing.py [payload size in MB]
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+import tracemalloc
+
+from cocaine.detail.util import write_buffers
+from cocaine.worker.message import packv1
+from cocaine.worker.message import packv1_buffers
+
+
+class Pipe(object):
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+
+
+def measure(name, send, payload):
+    pipe = Pipe()
+    tracemalloc.start()
+    start = time.time()
+    send(pipe, payload)
+    elapsed = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("%-16s payload: %6.1fMB  peak: %7.1fMB  elapsed: %.3fs" % (
+        name, len(payload) / 2.0 ** 20, peak / 2.0 ** 20, elapsed))
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    payload = b"x" * (size * 2 ** 20)
+
+    measure("packv1", lambda pipe, data: pipe.write(packv1(2, 0, data)), payload)
+    measure("packv1_buffers", lambda pipe, data: write_buffers(pipe, packv1_buffers(2, 0, data)), payload)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#
+#    Copyright (c) 2012+ Anton Tyurin <noxiouz@yandex.ru>
+#    Copyright (c) 2013+ Evgeny Safronov <division494@gmail.com>
+#    Copyright (c) 2011-2014 Other contributors as noted in the AUTHORS file.
+#
+#    This file is part of Cocaine.
+#
+#    Cocaine is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Cocaine is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Requests per second of unpacking a request of the `http` decorator.
+
+A typical browser request with a dozen headers, cookies and a form body is used.
+Access patterns:
+  minimal - the handler looks at the path and a single header
+  typical - the handler reads meta and the arguments as well
+  full    - everything is parsed including files and cookies
+
+Usage: python benchmarks/bench_http_request.py [number of requests]
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+import msgpack
+
+from cocaine.decorators.http_dec import _HTTPRequest
+
+
+HEADERS = [
+    ("Host", "example.com"),
+    ("User-Agent", "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko)"),
+    ("Accept", "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"),
+    ("Accept-Language", "en-US,en;q=0.5"),
+    ("Accept-Encoding", "gzip, deflate, br"),
+    ("Referer", "https://example.com/index"),
+    ("Content-Type", "application/x-www-form-urlencoded"),
+    ("Cookie", "session=0123456789abcdef; theme=dark; lang=en; tracking=a1b2c3d4"),
+    ("Connection", "keep-alive"),
+    ("X-Real-IP", "192.0.2.1"),
+    ("X-Forwarded-For", "192.0.2.1"),
+    ("X-Request-Id", "5f2b6c1e-8d3a-4e4b-9a7c-0e1f2a3b4c5d"),
+]
+
+BODY = b"name=user&email=user%40example.com&comment=" + b"lorem+ipsum+" * 20
+
+
+def minimal(req):
+    return req.path, req.headers.get("X-Request-Id")
+
+
+def typical(req):
+    return req.path, req.meta["method"], req.meta["remote_addr"], req.request
+
+
+def full(req):
+    return req.headers, req.meta, req.request, req.files
+
+
+def measure(name, access, data, count):
+    start = time.time()
+    for _ in range(count):
+        access(_HTTPRequest(None, data))
+    elapsed = time.time() - start
+    print("%-8s %8.0f requests/s" % (name, count / elapsed))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    data = msgpack.packb(["POST", "/api/v1/comments?page=2&sort=desc", "1.1", HEADERS, BODY])
+    for name, access in (("minimal", minimal), ("typical", typical), ("full", full)):
+        measure(name, access, data, count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+#
+#    Copyright (c) 2012+ Anton Tyurin <noxiouz@yandex.ru>
+#    Copyright (c) 2013+ Evgeny Safronov <division494@gmail.com>
+#    Copyright (c) 2011-2014 Other contributors as noted in the AUTHORS file.
+#
+#    This file is part of Cocaine.
+#
+#    Cocaine is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Cocaine is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Lookups per second of Router against a chain of regexes with 500 routes.
+
+Routes look like a REST API of 100 resources with 5 templates each:
+  /api/v1/<resource>, /api/v1/<resource>/{id:int}, /api/v1/<resource>/{id:int}/<sub>, ...
+The regex chain is what the handlers of a single event used to do by hand, it's
+scanned in the order of declaration until the first match.
+
+Usage: python benchmarks/bench_router.py [number of lookups]
+"""
+
+from __future__ import print_function
+
+import random
+import re
+import sys
+import time
+
+from cocaine.decorators.router import Router
+
+
+RESOURCES = ["resource%d" % i for i in range(100)]
+
+
+def templates():
+    for resource in RESOURCES:
+        yield "/api/v1/%s" % resource
+        yield "/api/v1/%s/{id:int}" % resource
+        yield "/api/v1/%s/{id:int}/history" % resource
+        yield "/api/v1/%s/{id:int}/tags/{tag}" % resource
+        yield "/api/v1/%s/search/{query}" % resource
+
+
+def compile_regex(template):
+    pattern = re.sub(r"{(\w+):int}", r"(?P<\1>\\d+)", template)
+    pattern = re.sub(r"{(\w+)}", r"(?P<\1>[^/]+)", pattern)
+    return re.compile("^%s$" % pattern)
+
+
+def paths(count):
+    rnd = random.Random(0)
+    result = list()
+    for _ in range(count):
+        resource = rnd.choice(RESOURCES)
+        result.append(rnd.choice([
+            "/api/v1/%s" % resource,
+            "/api/v1/%s/%d" % (resource, rnd.randint(1, 10 ** 6)),
+            "/api/v1/%s/%d/history" % (resource, rnd.randint(1, 10 ** 6)),
+            "/api/v1/%s/%d/tags/red" % (resource, rnd.randint(1, 10 ** 6)),
+            "/api/v1/%s/search/term" % resource,
+        ]))
+    return result
+
+
+def measure(name, lookup, samples):
+    start = time.time()
+    for path in samples:
+        if lookup(path) is None:
+            raise AssertionError("%s has not matched" % path)
+    elapsed = time.time() - start
+    print("%-8s %10.0f lookups/s" % (name, len(samples) / elapsed))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    router = Router()
+    chain = list()
+    for template in templates():
+        router.add(template, lambda request, response: None)
+        chain.append(compile_regex(template))
+    print("%d routes" % len(router))
+
+    def regex_lookup(path):
+        for regex in chain:
+            match = regex.match(path)
+            if match is not None:
+                return match.groupdict()
+        return None
+
+    samples = paths(count)
+    measure("regex", regex_lookup, samples)
+    measure("router", lambda path: router.match(path)[0], samples)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+#
+#    Copyright (c) 2012+ Anton Tyurin <noxiouz@yandex.ru>
+#    Copyright (c) 2013+ Evgeny Safronov <division494@gmail.com>
+#    Copyright (c) 2011-2014 Other contributors as noted in the AUTHORS file.
+#
+#    This file is part of Cocaine.
+#
+#    Cocaine is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Cocaine is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Worker startup time: from the interpreter start to the handshake received by the runtime.
+
+The runtime is emulated with a unix socket which accepts a single connection per run.
+Interpreter startup and `import cocaine.worker` alone are measured as well.
+With `--threshold` the script exits with 1 if the median time to handshake exceeds it,
+so it can guard against import time regressions.
+
+Usage: python benchmarks/bench_startup.py [--runs N] [--threshold SECONDS]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER = """
+import sys
+from cocaine.worker import Worker
+Worker(app="bench", uuid="bench", endpoint=sys.argv[1]).run()
+"""
+
+
+def child_env():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    return env
+
+
+def run_python(code, *args):
+    start = time.time()
+    subprocess.check_call([sys.executable, "-c", code] + list(args), env=child_env())
+    return time.time() - start
+
+
+def time_to_handshake(path):
+    server = socket.socket(socket.AF_UNIX)
+    server.bind(path)
+    server.listen(1)
+    server.settimeout(30)
+    try:
+        start = time.time()
+        process = subprocess.Popen([sys.executable, "-c", WORKER, path], env=child_env())
+        try:
+            conn, _ = server.accept()
+            conn.settimeout(30)
+            # the handshake is the first frame sent by the worker
+            if not conn.recv(4096):
+                raise RuntimeError("worker has closed the connection without handshake")
+            elapsed = time.time() - start
+            # the worker stops when the connection is lost
+            conn.close()
+            process.wait()
+            return elapsed
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+    finally:
+        server.close()
+        os.unlink(path)
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def report(name, values):
+    print("%-22s min: %.3fs  median: %.3fs  max: %.3fs" % (name, min(values), median(values), max(values)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--threshold", type=float, default=None,
+                        help="maximum median time to handshake in seconds")
+    args = parser.parse_args()
+
+    interpreter = [run_python("pass") for _ in range(args.runs)]
+    imports = [run_python("import cocaine.worker") for _ in range(args.runs)]
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "runtime.sock")
+        handshakes = [time_to_handshake(path) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(directory)
+
+    report("interpreter", interpreter)
+    report("import cocaine.worker", imports)
+    report("handshake", handshakes)
+
+    if args.threshold is not None and median(handshakes) > args.threshold:
+        print("median time to handshake %.3fs exceeds the threshold %.3fs" % (median(handshakes), args.threshold))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
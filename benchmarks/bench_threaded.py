@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#
+#    Copyright (c) 2012+ Anton Tyurin <noxiouz@yandex.ru>
+#    Copyright (c) 2013+ Evgeny Safronov <division494@gmail.com>
+#    Copyright (c) 2011-2014 Other contributors as noted in the AUTHORS file.
+#
+#    This file is part of Cocaine.
+#
+#    Cocaine is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Cocaine is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Compares `threaded` backed by the shared pool with the former thread-per-call scheme.
+
+Usage: python benchmarks/bench_threaded.py [calls] [pool size]
+"""
+
+from __future__ import print_function
+
+import sys
+import threading
+import time
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+from cocaine.futures import ThreadPoolExecutor
+from cocaine.futures import set_default_executor
+from cocaine.futures import threaded
+
+
+def short_call():
+    time.sleep(0.001)
+    return 1
+
+
+def thread_per_call(func):
+    # the behaviour of `threaded` before it was backed by the pool
+    def wrapper():
+        io_loop = IOLoop.current()
+        future = Future()
+
+        def run():
+            io_loop.add_callback(future.set_result, func())
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return future
+    return wrapper
+
+
+def measure(name, func, calls):
+    @gen.coroutine
+    def main():
+        peak = 0
+        futures = []
+        for _ in range(calls):
+            futures.append(func())
+            peak = max(peak, threading.active_count())
+        yield futures
+        raise gen.Return(peak)
+
+    start = time.time()
+    peak = IOLoop.current().run_sync(main)
+    elapsed = time.time() - start
+    print("%-16s calls: %6d  elapsed: %7.3fs  calls/s: %9.1f  peak threads: %d" % (
+        name, calls, elapsed, calls / elapsed, peak))
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    pool_size = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+
+    measure("thread-per-call", thread_per_call(short_call), calls)
+
+    set_default_executor(ThreadPoolExecutor(max_workers=pool_size))
+    measure("pool(%d)" % pool_size, threaded(short_call), calls)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+#
+#    Copyright (c) 2012+ Anton Tyurin <noxiouz@yandex.ru>
+#    Copyright (c) 2013+ Evgeny Safronov <division494@gmail.com>
+#    Copyright (c) 2011-2014 Other contributors as noted in the AUTHORS file.
+#
+#    This file is part of Cocaine.
+#
+#    Cocaine is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Cocaine is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Concurrent sessions of a slow WSGI application served by the `wsgi` decorator.
+
+Every view blocks for `--delay` seconds, e.g. on a database. The application used to be
+called right on the IOLoop, so the sessions were served one by one and the loop stalled
+for the whole view. Now it runs in the thread pool and the loop only sends the chunks.
+Both modes are run, the longest IOLoop stall is reported alongside the throughput.
+
+Usage: python benchmarks/bench_wsgi.py [--sessions N] [--delay SECONDS] [--workers N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+from cocaine.decorators.wsgi import _ThreadedResponse, _run_application
+from cocaine.futures.threadpool import ThreadPoolExecutor
+
+
+class Stream(object):
+    def __init__(self):
+        self.size = 0
+
+    def write_head(self, code, headers):
+        pass
+
+    def write(self, data):
+        self.size += len(data)
+        future = Future()
+        IOLoop.current().add_callback(future.set_result, None)
+        return future
+
+
+def make_application(delay):
+    def application(environ, start_response):
+        time.sleep(delay)
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return [b"x" * 1024] * 16
+    return application
+
+
+class StallMeter(object):
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.max_stall = 0.0
+        self._last = None
+
+    def start(self):
+        self._last = time.time()
+        IOLoop.current().call_later(self.interval, self._tick)
+
+    def _tick(self):
+        now = time.time()
+        self.max_stall = max(self.max_stall, now - self._last - self.interval)
+        self._last = now
+        IOLoop.current().call_later(self.interval, self._tick)
+
+
+@gen.coroutine
+def inline(application, sessions, executor):
+    for _ in range(sessions):
+        stream = Stream()
+        for data in application({}, lambda status, headers: stream.write):
+            yield stream.write(data)
+
+
+@gen.coroutine
+def threaded(application, sessions, executor):
+    io_loop = IOLoop.current()
+    yield [executor.submit(_run_application, application, {}, _ThreadedResponse(io_loop, Stream(), 4))
+           for _ in range(sessions)]
+
+
+def measure(name, mode, application, sessions, executor):
+    io_loop = IOLoop()
+    io_loop.make_current()
+    meter = StallMeter()
+
+    @gen.coroutine
+    def main():
+        meter.start()
+        start = time.time()
+        yield mode(application, sessions, executor)
+        raise gen.Return(time.time() - start)
+
+    elapsed = io_loop.run_sync(main)
+    io_loop.close(all_fds=True)
+    print("%-8s %8.1f sessions/s  %7.3fs total  %7.3fs max IOLoop stall" % (
+        name, sessions / elapsed, elapsed, meter.max_stall))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=64)
+    parser.add_argument("--delay", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, default=16)
+    args = parser.parse_args()
+
+    application = make_application(args.delay)
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    for name, mode in (("inline", inline), ("threaded", threaded)):
+        measure(name, mode, application, args.sessions, executor)
+    executor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
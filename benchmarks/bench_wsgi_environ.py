@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+#
+#    Copyright (c) 2012+ Anton Tyurin <noxiouz@yandex.ru>
+#    Copyright (c) 2013+ Evgeny Safronov <division494@gmail.com>
+#    Copyright (c) 2011-2014 Other contributors as noted in the AUTHORS file.
+#
+#    This file is part of Cocaine.
+#
+#    Cocaine is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Cocaine is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Requests per second of building the WSGI environ of the `wsgi` decorator.
+
+  tornado - the former path: HTTPServerRequest and then WSGIContainer.environ
+  direct  - wsgi_environ over the unpacked request
+
+Both include unpacking of the request and reading of wsgi.input.
+
+Usage: python benchmarks/bench_wsgi_environ.py [number of requests] [body size]
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+import msgpack
+from tornado.httputil import HTTPHeaders, HTTPServerRequest
+from tornado.wsgi import WSGIContainer
+
+from cocaine.decorators.wsgi import wsgi_environ
+
+
+HEADERS = [
+    ("Host", "example.com"),
+    ("User-Agent", "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko)"),
+    ("Accept", "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"),
+    ("Accept-Language", "en-US,en;q=0.5"),
+    ("Accept-Encoding", "gzip, deflate, br"),
+    ("Referer", "https://example.com/index"),
+    ("Content-Type", "application/x-www-form-urlencoded"),
+    ("Cookie", "session=0123456789abcdef; theme=dark; lang=en; tracking=a1b2c3d4"),
+    ("Connection", "keep-alive"),
+    ("X-Real-IP", "192.0.2.1"),
+    ("X-Forwarded-For", "192.0.2.1"),
+    ("X-Request-Id", "5f2b6c1e-8d3a-4e4b-9a7c-0e1f2a3b4c5d"),
+]
+
+
+def tornado(data):
+    # the old path expects native strings, that's what msgpack gives with raw=False
+    method, uri, version, headers, body = msgpack.unpackb(data, raw=False)
+    request = HTTPServerRequest(method, uri, "HTTP/" + version, HTTPHeaders(headers), body)
+    environ = WSGIContainer.environ(request)
+    return environ["wsgi.input"].read()
+
+
+def direct(data):
+    environ = wsgi_environ(*msgpack.unpackb(data))
+    return environ["wsgi.input"].read()
+
+
+def measure(name, build, data, count):
+    start = time.time()
+    for _ in range(count):
+        build(data)
+    elapsed = time.time() - start
+    print("%-8s %8.0f requests/s" % (name, count / elapsed))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+    data = msgpack.packb(["POST", "/api/v1/comments?page=2&sort=desc", "1.1", HEADERS, b"x" * size],
+                         use_bin_type=True)
+    for name, build in (("tornado", tornado), ("direct", direct)):
+        measure(name, build, data, count)
+
+
+if __name__ == '__main__':
+    main()
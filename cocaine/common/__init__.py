@@ -33,6 +33,10 @@ class CocaineErrno(object):
     INVALIDAPIVERSION = 230
     # message type is out of protocol
     INVALIDMESSAGETYPE = 240
+    # worker is shutting down
+    ESHUTDOWN = 250
+    # handler has not finished in time
+    ETIMEOUT = 260
     # uncaught exception
     EUNCAUGHTEXCEPTION = 100
 
@@ -20,9 +20,33 @@
 #    along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
+import importlib
+import sys
+
 from tornado.gen import coroutine
 
-from .http_dec import http, tornado_http
+from .asgi import asgi
+from .cache import http_cache
+from .router import Router
 from .wsgi import wsgi
 
-__all__ = ["coroutine", "http", "tornado_http", "wsgi"]
+__all__ = ["Router", "asgi", "coroutine", "http", "http_cache", "tornado_http", "wsgi"]
+
+# HTTP decorators pull in tornado.httputil and the email package, most of apps don't need them
+_LAZY_ATTRIBUTES = {
+    "http": ".http_dec",
+    "tornado_http": ".http_dec",
+}
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        module = _LAZY_ATTRIBUTES.get(name)
+        if module is None:
+            raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+        value = getattr(importlib.import_module(module, __name__), name)
+        globals()[name] = value
+        return value
+else:  # pragma: no cover
+    # module __getattr__ is not supported
+    from .http_dec import http, tornado_http  # noqa: F401
@@ -0,0 +1,275 @@
+#
+#    Copyright (c) 2011-2012 Andrey Sibiryov <me@kobology.ru>
+#    Copyright (c) 2012+ Anton Tyurin <noxiouz@yandex.ru>
+#    Copyright (c) 2013+ Evgeny Safronov <division494@gmail.com>
+#    Copyright (c) 2011-2014 Other contributors as noted in the AUTHORS file.
+#
+#    This file is part of Cocaine.
+#
+#    Cocaine is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Cocaine is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import functools
+import logging
+
+import six
+from six.moves.urllib import parse as urlparse
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from tornado.queues import Queue
+
+from ..detail.util import msgpack_unpackb
+from ..exceptions import ChokeEvent
+
+
+log = logging.getLogger("cocaine.asgi")
+
+ASGI_VERSION = {"version": "3.0", "spec_version": "2.1"}
+
+
+def _bytes(value):
+    if isinstance(value, six.text_type):
+        return value.encode("latin-1")
+    return value
+
+
+def _native(value):
+    if isinstance(value, six.binary_type) and not six.PY2:
+        return value.decode("latin-1")
+    return value
+
+
+def _resolved(result=None):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def asgi_scope(method, uri, version, headers, state=None):
+    """Builds the connection scope of an ASGI application from the unpacked request of the http proxy"""
+    raw_path, _, query = _bytes(uri).partition(b"?")
+    if six.PY2:
+        path = urlparse.unquote(raw_path)
+    else:
+        path = urlparse.unquote_to_bytes(raw_path)
+    version = _native(version)
+    if version.startswith("HTTP/"):
+        version = version[len("HTTP/"):]
+
+    headers = [(_bytes(name).lower(), _bytes(value)) for name, value in headers]
+    remote_addr = None
+    for name, value in headers:
+        if name in (b"x-real-ip", b"x-forwarded-for"):
+            remote_addr = value.split(b",")[0].strip().decode("latin-1")
+            if name == b"x-real-ip":
+                break
+
+    scope = {
+        "type": "http",
+        "asgi": dict(ASGI_VERSION),
+        "http_version": version,
+        "method": _native(method).upper(),
+        "scheme": "http",
+        "path": path.decode("utf-8", "replace"),
+        "raw_path": raw_path,
+        "query_string": query,
+        "root_path": "",
+        "headers": headers,
+        "client": (remote_addr, 0) if remote_addr else None,
+        "server": None,
+    }
+    if state is not None:
+        scope["state"] = dict(state)
+    return scope
+
+
+class _HTTPSession(object):
+    """Maps an invoke session to the receive and send callables of an ASGI application.
+
+    Request body chunks are read from the RequestStream as the application asks for them.
+    Response bodies are written to the response and `send` resolves when the chunk is
+    passed to the pipe, so a streaming application is paused by the backpressure.
+    """
+
+    def __init__(self, request, response, body):
+        self._request = request
+        self._response = response
+        self._body = body
+        self._more_body = True
+        self._started = False
+        self._closed = False
+        self._disconnected = Future()
+
+    @gen.coroutine
+    def receive(self):
+        if self._body is not None:
+            # the body part packed along with the headers
+            body, self._body = self._body, None
+            raise gen.Return({"type": "http.request", "body": body, "more_body": True})
+
+        if self._more_body:
+            try:
+                chunk = yield self._request.read()
+            except ChokeEvent:
+                self._more_body = False
+                raise gen.Return({"type": "http.request", "body": b"", "more_body": False})
+            raise gen.Return({"type": "http.request", "body": chunk, "more_body": True})
+
+        yield self._disconnected
+        raise gen.Return({"type": "http.disconnect"})
+
+    @gen.coroutine
+    def send(self, message):
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            if self._started:
+                raise RuntimeError("http.response.start has already been sent")
+            self._started = True
+            headers = [(_native(name), _native(value)) for name, value in message.get("headers", ())]
+            self._response.write_head(message["status"], headers)
+        elif message_type == "http.response.body":
+            if not self._started:
+                raise RuntimeError("http.response.start must be sent before http.response.body")
+            if self._closed:
+                return
+            body = message.get("body", b"")
+            if body:
+                future = self._response.write(body)
+                if future is not None:
+                    yield future
+            if not message.get("more_body", False):
+                self.close()
+        else:
+            raise RuntimeError("unexpected ASGI message %s" % message_type)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._response.close()
+        self.disconnect()
+
+    def disconnect(self):
+        # wakes up the application waiting for http.disconnect
+        if not self._disconnected.done():
+            self._disconnected.set_result(None)
+
+    @property
+    def started(self):
+        return self._started
+
+
+class Lifespan(object):
+    """Runs the lifespan protocol of an ASGI application.
+
+    The worker calls `startup` of the handlers along with the warmup before the handshake.
+    Applications which raise instead of completing the startup don't support lifespan,
+    they are served anyway. If the application reports lifespan.startup.failed, the error
+    is kept in `startup_error` and the worker stops instead of serving.
+    """
+
+    def __init__(self, application):
+        self._application = application
+        self._queue = Queue()
+        self._task = None
+        self._startup = Future()
+        self._shutdown = Future()
+        self._stopping = False
+        self.supported = True
+        self.startup_error = None
+        self.state = {}
+
+    def startup(self):
+        if self._task is None:
+            scope = {"type": "lifespan", "asgi": dict(ASGI_VERSION), "state": self.state}
+            self._queue.put_nowait({"type": "lifespan.startup"})
+            try:
+                self._task = gen.convert_yielded(self._application(scope, self._queue.get, self._send))
+            except Exception as err:
+                self._task = Future()
+                self._task.set_exception(err)
+            IOLoop.current().add_future(self._task, self._on_done)
+        return self._startup
+
+    def shutdown(self):
+        if self._task is None or self._task.done():
+            return _resolved()
+        if not self._stopping:
+            self._stopping = True
+            self._queue.put_nowait({"type": "lifespan.shutdown"})
+        return self._shutdown
+
+    def _send(self, message):
+        message_type = message["type"]
+        if message_type == "lifespan.startup.complete":
+            self._startup.set_result(None)
+        elif message_type == "lifespan.startup.failed":
+            self.startup_error = RuntimeError("startup has failed: %s" % message.get("message", ""))
+            self._startup.set_exception(self.startup_error)
+        elif message_type == "lifespan.shutdown.complete":
+            self._shutdown.set_result(None)
+        elif message_type == "lifespan.shutdown.failed":
+            self._shutdown.set_exception(RuntimeError("shutdown has failed: %s" % message.get("message", "")))
+        else:
+            raise RuntimeError("unexpected ASGI message %s" % message_type)
+        return _resolved()
+
+    def _on_done(self, future):
+        err = future.exception()
+        if not self._startup.done():
+            self.supported = False
+            log.info("ASGI application doesn't support lifespan: %s", err)
+            self._startup.set_result(None)
+        elif self._shutdown.done():
+            pass
+        elif err is not None and self._stopping:
+            self._shutdown.set_exception(err)
+        elif err is not None:
+            log.error("ASGI application lifespan has failed: %s", err)
+        else:
+            self._shutdown.set_result(None)
+
+
+def asgi(application=None, lifespan=True):
+    """Runs an ASGI 3 application as a handler of HTTP requests.
+
+    Native coroutines are run by the IOLoop of the worker, so applications relying
+    on asyncio need the worker to run on the asyncio IOLoop. With `lifespan=True`
+    the startup is run before the worker handshake, see `Lifespan`.
+    Options are given as `@asgi(lifespan=False)`.
+    """
+    if application is None:
+        return functools.partial(asgi, lifespan=lifespan)
+
+    # http_dec pulls in tornado.httputil, it's imported when the decorator is used
+    from .http_dec import _HTTPResponse
+
+    def wrapper(request, response):
+        data = yield request.read()
+        method, uri, version, headers, body = msgpack_unpackb(data)
+        state = wrapper.lifespan.state if wrapper.lifespan is not None else None
+        scope = asgi_scope(method, uri, version, headers, state)
+        session = _HTTPSession(request, _HTTPResponse(response), body)
+        try:
+            yield gen.convert_yielded(application(scope, session.receive, session.send))
+        finally:
+            session.disconnect()
+
+        if not session.started:
+            raise RuntimeError("ASGI application has returned without a response")
+        session.close()
+
+    wrapper.lifespan = Lifespan(application) if lifespan else None
+    return wrapper
@@ -0,0 +1,286 @@
+#
+#    Copyright (c) 2011-2012 Andrey Sibiryov <me@kobology.ru>
+#    Copyright (c) 2012+ Anton Tyurin <noxiouz@yandex.ru>
+#    Copyright (c) 2013+ Evgeny Safronov <division494@gmail.com>
+#    Copyright (c) 2011-2014 Other contributors as noted in the AUTHORS file.
+#
+#    This file is part of Cocaine.
+#
+#    Cocaine is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Cocaine is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import collections
+import functools
+import hashlib
+import time
+
+import six
+
+from tornado import gen
+
+from .replay import ReplayedRequest
+
+
+__all__ = ["http_cache", "ResponseCache"]
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+_CACHEABLE_METHODS = ("GET", "HEAD")
+# responses to requests with credentials may be personal
+_PRIVATE_HEADERS = ("Authorization", "Cookie")
+
+
+def parse_cache_control(value):
+    """Returns a dict of Cache-Control directives, values of directives without them are None"""
+    directives = {}
+    for item in value.split(","):
+        name, _, argument = item.strip().partition("=")
+        if name:
+            directives[name.lower()] = argument.strip('"') if argument else None
+    return directives
+
+
+def _header(headers, name):
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _native(value):
+    if isinstance(value, six.binary_type) and not six.PY2:
+        return value.decode("latin-1")
+    return value
+
+
+class _Entry(object):
+    __slots__ = ("code", "headers", "chunks", "size", "etag", "expires")
+
+    def __init__(self, code, headers, chunks, size, etag, expires):
+        self.code = code
+        self.headers = headers
+        self.chunks = chunks
+        self.size = size
+        self.etag = etag
+        self.expires = expires
+
+
+class ResponseCache(object):
+    """LRU cache of complete HTTP responses limited by the number of entries and their size"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def get(self, key, now=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if entry.expires <= (now or time.time()):
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        # move the entry to the end as the most recently used one
+        del self._entries[key]
+        self._entries[key] = entry
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        if entry.size > self.max_bytes:
+            return False
+
+        self._remove(key)
+        self._entries[key] = entry
+        self.size += entry.size
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+        return True
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+
+class _CapturingResponse(object):
+    """Passes the response through and records it up to `limit` bytes"""
+
+    def __init__(self, response, limit):
+        self._response = response
+        self._limit = limit
+        self.code = None
+        self.headers = None
+        self.chunks = []
+        self.size = 0
+        self.complete = False
+
+    def write_head(self, code, headers):
+        if isinstance(headers, dict):
+            headers = headers.items()
+        headers = [(_native(key), _native(value)) for key, value in headers]
+        self.code, self.headers = code, headers
+        self._response.write_head(code, headers)
+
+    def write(self, body):
+        if self.chunks is not None:
+            chunk = body.encode("utf-8") if isinstance(body, six.text_type) else bytes(body)
+            self.size += len(chunk)
+            if self.size > self._limit:
+                # it's too big to be cached
+                self.chunks = None
+            else:
+                self.chunks.append(chunk)
+        self._response.write(body)
+
+    def close(self):
+        self.complete = True
+        self._response.close()
+
+    def error(self, *args, **kwargs):
+        self.chunks = None
+        return self._response.error(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+
+def http_cache(func=None, ttl=60, vary=(), max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+    """Caches complete responses of an `http` or `tornado_http` handler in memory.
+
+    It's applied under the HTTP decorator:
+
+        @http
+        @http_cache(ttl=30, vary=("Accept-Language",))
+        def handler(request, response):
+            ...
+
+    Responses to GET and HEAD requests are keyed by the method, path, query and values of
+    `vary` request headers. Only complete 200 responses are stored, for `max-age` seconds
+    of their Cache-Control header or `ttl` seconds by default. Responses with `no-store`,
+    `no-cache` or `private` directives or with Set-Cookie headers are not stored, requests
+    with `no-cache` or with Authorization or Cookie headers bypass the cache.
+
+    Stored responses get an ETag header unless the handler has set one, hits with a matching
+    If-None-Match are answered with 304. The cache is available as `handler.cache`.
+    """
+    if func is None:
+        return functools.partial(http_cache, ttl=ttl, vary=vary, max_entries=max_entries, max_bytes=max_bytes)
+
+    cache = ResponseCache(max_entries, max_bytes)
+    func = gen.coroutine(func)
+
+    def wrapper(request, response):
+        head = yield request.read()
+        request = ReplayedRequest(request, head)
+
+        method = _native(head.method)
+        headers = head.headers
+        request_directives = parse_cache_control(headers.get("Cache-Control", ""))
+        if method not in _CACHEABLE_METHODS or any(name in headers for name in _PRIVATE_HEADERS):
+            yield func(request, response)
+            return
+
+        key = (method, _native(head.path), _native(head.query)) + tuple(headers.get(name, "") for name in vary)
+        if "no-cache" not in request_directives:
+            entry = cache.get(key)
+            if entry is not None:
+                _replay(entry, headers, response)
+                return
+
+        capture = _CapturingResponse(response, max_bytes)
+        yield func(request, capture)
+        # the response is closed after the handler returns if it hasn't been yet
+        capture.complete = True
+        _store(cache, key, capture, ttl)
+
+    wrapper.cache = cache
+    return wrapper
+
+
+def _store(cache, key, capture, ttl):
+    if not capture.complete or capture.code != 200 or capture.chunks is None:
+        return
+
+    directives = parse_cache_control(_header(capture.headers, "Cache-Control") or "")
+    if "no-store" in directives or "no-cache" in directives or "private" in directives:
+        return
+    # a cookie set for one client must not be replayed to the others
+    if _header(capture.headers, "Set-Cookie") is not None:
+        return
+
+    max_age = directives.get("max-age")
+    if max_age is not None:
+        try:
+            ttl = int(max_age)
+        except ValueError:
+            return
+    if ttl <= 0:
+        return
+
+    headers = list(capture.headers)
+    etag = _header(headers, "ETag")
+    if etag is None:
+        digest = hashlib.sha1()
+        for chunk in capture.chunks:
+            digest.update(chunk)
+        etag = '"%s"' % digest.hexdigest()
+        headers.append(("ETag", etag))
+
+    cache.put(key, _Entry(capture.code, headers, capture.chunks, capture.size, etag, time.time() + ttl))
+
+
+def _strip_weak(etag):
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def _replay(entry, request_headers, response):
+    if_none_match = request_headers.get("If-None-Match")
+    if if_none_match is not None:
+        # the weak comparison is used for If-None-Match
+        tags = [_strip_weak(tag.strip()) for tag in if_none_match.split(",")]
+        if _strip_weak(entry.etag) in tags or "*" in tags:
+            response.write_head(304, [(key, value) for key, value in entry.headers
+                                      if key.lower() in ("etag", "cache-control", "vary", "expires")])
+            response.close()
+            return
+
+    response.write_head(entry.code, entry.headers)
+    for chunk in entry.chunks:
+        response.write(chunk)
+    response.close()
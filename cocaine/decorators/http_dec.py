@@ -19,23 +19,42 @@
 #    You should have received a copy of the GNU Lesser General Public License
 #    along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
+import functools
+import zlib
+
 import six
 from six.moves import http_cookies as Cookie  # noqa: N812 lowercase imported as non lowercase
 from six.moves.urllib import parse as urlparse
 
 from tornado import gen
 from tornado.escape import native_str
+from tornado.escape import parse_qs_bytes
 from tornado.httputil import (
     HTTPHeaders,
     HTTPServerRequest,
+    _parse_header,
     parse_body_arguments)
 
+from .multipart import DEFAULT_SPOOL_THRESHOLD
+from .multipart import MultipartParser
 from ..detail.util import msgpack_packb
 from ..detail.util import msgpack_unpackb
+from ..exceptions import ChokeEvent
 
 
 __all__ = ["http", "tornado_http"]
 
+# smaller bodies are sent uncompressed, compression would hardly save anything
+DEFAULT_COMPRESS_MIN_SIZE = 1024
+DEFAULT_COMPRESS_LEVEL = 6
+
+_WBITS = {
+    "gzip": 16 + zlib.MAX_WBITS,
+    "deflate": zlib.MAX_WBITS,
+}
+# responses with these codes have no body
+_NO_BODY_CODES = (204, 304)
+
 
 def dict_list_to_single(inp):
     return dict((k, v[0]) for k, v in six.iteritems(inp) if len(v) > 0)
@@ -54,32 +73,38 @@ def http_parse_cookies(headers):
 
 
 class _HTTPRequest(object):
+    """HTTP request unpacked from the first chunk of the `http` decorator.
+
+    Only the envelope is unpacked up front. Headers, meta, arguments, files and cookies
+    are parsed on first access and cached, so handlers don't pay for what they don't use.
+    """
+
     def __init__(self, request, data):
         self._underlying_request = request
-        method, url, version, headers, self._body = msgpack_unpackb(data)
+        method, url, version, self._raw_headers, self._body = msgpack_unpackb(data)
         if six.PY3:
             method = method.decode()
             url = url.decode()
             version = version.decode()
-            headers = [(k.decode(), v.decode()) for k, v in headers]
-
-        self._headers = HTTPHeaders(headers)
-        self._meta = {
-            'method': method,
-            'version': version,
-            'host': self._headers.get('Host', ''),
-            'remote_addr': self._headers.get('X-Real-IP') or self._headers.get('X-Forwarded-For', ''),
-            'query_string': urlparse.urlparse(url).query,
-            'cookies': dict(),
-            'parsed_cookies': http_parse_cookies(self._headers),
-        }
-        args = urlparse.parse_qs(urlparse.urlparse(url).query)
-        self._files = dict()
-        parse_body_arguments(self._headers.get("Content-Type", ""), self._body, args, self._files)
-        self._request = dict_list_to_single(args)
+
+        self._method = method
+        self._url = url
+        self._version = version
+        self._split_url = None
+        self._headers = None
+        self._meta = None
+        self._request = None
+        self._files = None
+        # parameters of the path template matched by Router
+        self.path_params = {}
 
     @property
     def headers(self):
+        if self._headers is None:
+            headers = self._raw_headers
+            if six.PY3:
+                headers = [(k.decode(), v.decode()) for k, v in headers]
+            self._headers = HTTPHeaders(headers)
         return self._headers
 
     def hpack_headers(self):
@@ -90,33 +115,179 @@ class _HTTPRequest(object):
         """Return request body"""
         return self._body
 
+    @property
+    def method(self):
+        return self._method
+
+    @property
+    def url(self):
+        return self._url
+
+    @property
+    def path(self):
+        return self._urlsplit().path
+
+    @property
+    def query(self):
+        return self._urlsplit().query
+
     @property
     def meta(self):
+        if self._meta is None:
+            headers = self.headers
+            self._meta = {
+                'method': self._method,
+                'version': self._version,
+                'host': headers.get('Host', ''),
+                'remote_addr': headers.get('X-Real-IP') or headers.get('X-Forwarded-For', ''),
+                'query_string': self._urlsplit().query,
+                'cookies': dict(),
+                'parsed_cookies': http_parse_cookies(headers),
+            }
         return self._meta
 
     @property
     def request(self):
+        if self._request is None:
+            self._parse_arguments()
         return self._request
 
     @property
     def files(self):
+        if self._files is None:
+            self._parse_arguments()
         return self._files
 
+    def _urlsplit(self):
+        if self._split_url is None:
+            self._split_url = urlparse.urlsplit(self._url)
+        return self._split_url
+
+    def _parse_arguments(self):
+        args = urlparse.parse_qs(self._urlsplit().query)
+        files = dict()
+        parse_body_arguments(self.headers.get("Content-Type", ""), self._body, args, files)
+        self._request = dict_list_to_single(args)
+        self._files = files
+
+
+def choose_encoding(accept_encoding):
+    """Returns "gzip", "deflate" or None for the value of Accept-Encoding header"""
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+
+        if coding == "*":
+            for candidate in _WBITS:
+                qualities.setdefault(candidate, quality)
+        elif coding in _WBITS:
+            qualities[coding] = quality
+
+    # gzip is preferred when qualities are equal
+    ranked = [(quality, coding == "gzip", coding) for coding, quality in six.iteritems(qualities) if quality > 0]
+    if not ranked:
+        return None
+    return max(ranked)[2]
+
+
+def _find_header(headers, name):
+    name = name.lower()
+    for i, (key, value) in enumerate(headers):
+        if key.lower() == name:
+            return i, value
+    return None, None
+
 
 class _HTTPResponse(object):
-    def __init__(self, stream):
+    """Response of the `http` decorator.
+
+    With `compress` the body is compressed by gzip or deflate according to Accept-Encoding
+    header of `request`. Each write is compressed and flushed right away, so streaming
+    responses keep streaming. Bodies shorter than `compress_min_size` are sent as is:
+    if Content-Length isn't set, the head is held back until that many bytes are written
+    or the response is closed.
+    """
+
+    def __init__(self, stream, request=None, compress=False,
+                 compress_min_size=DEFAULT_COMPRESS_MIN_SIZE, compress_level=DEFAULT_COMPRESS_LEVEL):
         self._stream = stream
         self.event = self._stream.event
 
+        self._request = request
+        self._compress = compress
+        self._compress_min_size = compress_min_size
+        self._compress_level = compress_level
+        self._compressor = None
+        # (code, headers, encoding) of the head which waits for the body size to be known
+        self._deferred_head = None
+        self._pending = []
+        self._pending_size = 0
+
     def write(self, body):
-        self._stream.write(body)
+        if self._compressor is not None:
+            return self._write_compressed(body)
+        elif self._deferred_head is not None:
+            if isinstance(body, six.text_type):
+                body = body.encode("utf-8")
+            self._pending.append(body)
+            self._pending_size += len(body)
+            if self._pending_size >= self._compress_min_size:
+                self._start_compression()
+        else:
+            return self._stream.write(body)
 
     def write_head(self, code, headers):
         if isinstance(headers, dict):
             headers = headers.items()
-        self._stream.write(msgpack_packb((code, headers)))
+
+        if not self._compressible(code, headers):
+            self._stream.write(msgpack_packb((code, headers)))
+            return
+
+        # the body depends on Accept-Encoding even if it's sent uncompressed
+        headers = [list(header) for header in headers]
+        index, vary = _find_header(headers, "Vary")
+        if index is None:
+            headers.append(["Vary", "Accept-Encoding"])
+        elif "accept-encoding" not in vary.lower():
+            headers[index][1] = vary + ", Accept-Encoding"
+
+        encoding = choose_encoding(self._request.head.headers.get("Accept-Encoding", ""))
+        if encoding is None:
+            self._stream.write(msgpack_packb((code, headers)))
+            return
+
+        _, length = _find_header(headers, "Content-Length")
+        if length is not None and int(length) < self._compress_min_size:
+            self._stream.write(msgpack_packb((code, headers)))
+            return
+
+        self._deferred_head = (code, headers, encoding)
+        if length is not None:
+            self._start_compression()
 
     def close(self):
+        if self._deferred_head is not None:
+            # the body is too small to be compressed
+            code, headers, _ = self._deferred_head
+            self._deferred_head = None
+            self._stream.write(msgpack_packb((code, headers)))
+            for chunk in self._pending:
+                self._stream.write(chunk)
+            self._pending = []
+        elif self._compressor is not None:
+            tail = self._compressor.flush()
+            self._compressor = None
+            if tail:
+                self._stream.write(tail)
         self._stream.close()
 
     def error(self, *args, **kwargs):
@@ -126,6 +297,35 @@ class _HTTPResponse(object):
     def closed(self):
         return self._stream.closed
 
+    def _compressible(self, code, headers):
+        if not self._compress or self._request is None or self._request.head is None:
+            return False
+        # the answer to HEAD has no body to compress, its Content-Length is the one of GET
+        if self._request.head.method == "HEAD" or 100 <= code < 200:
+            return False
+        return code not in _NO_BODY_CODES and _find_header(headers, "Content-Encoding")[0] is None
+
+    def _start_compression(self):
+        code, headers, encoding = self._deferred_head
+        self._deferred_head = None
+
+        index, _ = _find_header(headers, "Content-Length")
+        if index is not None:
+            del headers[index]
+        headers.append(["Content-Encoding", encoding])
+        self._stream.write(msgpack_packb((code, headers)))
+
+        self._compressor = zlib.compressobj(self._compress_level, zlib.DEFLATED, _WBITS[encoding])
+        pending, self._pending = self._pending, []
+        if pending:
+            self._write_compressed(b"".join(pending))
+
+    def _write_compressed(self, body):
+        if isinstance(body, six.text_type):
+            body = body.encode("utf-8")
+        data = self._compressor.compress(body) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return self._stream.write(data)
+
 
 # Note: there's inconsistency between
 # native-proxy and torando-proxy in version.
@@ -151,13 +351,16 @@ class PatchedWebRequest(object):
     def __init__(self, request):
         self.request = request
         self.first = True
+        # the request returned by the first read
+        self.head = None
 
     @gen.coroutine
     def read(self):
         data = yield self.request.read()
         if self.first:
             self.first = False
-            raise gen.Return(self.handle(data))
+            self.head = self.handle(data)
+            raise gen.Return(self.head)
         raise gen.Return(data)
 
     def handle(self, data):
@@ -169,22 +372,123 @@ class HTTPPatchedRequest(PatchedWebRequest):
         return _HTTPRequest(self.request, data)
 
 
+class StreamingHTTPRequest(PatchedWebRequest):
+    """Request of the streaming `http` decorator.
+
+    The first `read` returns the request without the body. The next ones return body
+    chunks as they arrive: the part packed along with the headers, if any, and then
+    the following chunks of the session. ChokeEvent is raised when the body is over.
+    """
+
+    def __init__(self, request, spool_threshold=DEFAULT_SPOOL_THRESHOLD):
+        super(StreamingHTTPRequest, self).__init__(request)
+        self.spool_threshold = spool_threshold
+        self._pending = None
+
+    @gen.coroutine
+    def read(self):
+        if self._pending:
+            chunk, self._pending = self._pending, None
+            raise gen.Return(chunk)
+        data = yield super(StreamingHTTPRequest, self).read()
+        raise gen.Return(data)
+
+    def handle(self, data):
+        head = _HTTPRequest(self.request, data)
+        # a body part sent along with the headers is the first body chunk
+        self._pending, head._body = head._body, b""
+        return head
+
+    @gen.coroutine
+    def read_form(self):
+        """Reads the rest of the body and parses it as a form.
+
+        Returns a tuple of arguments and files like `request` and `files` of the request.
+        Files of a multipart/form-data body are `UploadedFile` objects, big ones are spooled
+        to temporary files while the body is being read. Bodies of other types are skipped.
+        """
+        if self.head is None:
+            yield self.read()
+
+        args = urlparse.parse_qs(self.head._urlsplit().query)
+        files = dict()
+        content_type, params = _parse_header(self.head.headers.get("Content-Type", ""))
+
+        parser, form = None, None
+        if content_type == "multipart/form-data":
+            if "boundary" not in params:
+                raise ValueError("multipart/form-data boundary is missing")
+            parser = MultipartParser(params["boundary"], self.spool_threshold)
+        elif content_type == "application/x-www-form-urlencoded":
+            form = bytearray()
+
+        while True:
+            try:
+                chunk = yield self.read()
+            except ChokeEvent:
+                break
+            if parser is not None:
+                parser.feed(chunk)
+            elif form is not None:
+                form += chunk
+
+        if parser is not None:
+            parser.close()
+            for name, values in six.iteritems(parser.arguments):
+                args.setdefault(name, []).extend(values)
+            files = parser.files
+        elif form:
+            for name, values in six.iteritems(parse_qs_bytes(native_str(bytes(form)), keep_blank_values=True)):
+                args.setdefault(name, []).extend(values)
+
+        raise gen.Return((dict_list_to_single(args), files))
+
+
 class TornadoPatchedRequest(PatchedWebRequest):
     def handle(self, data):
         return tornado_request_handler(self.request, data)
 
 
+def _finish(response):
+    # the worker would close the underlying stream of a handler which hasn't done it,
+    # bypassing the deferred head and the tail of the compressed body
+    if not response.closed:
+        response.close()
+
+
 def tornado_http(func):
     func = gen.coroutine(func)
 
     def wrapper(request, response):
-        yield func(TornadoPatchedRequest(request), _HTTPResponse(response))
+        response = _HTTPResponse(response)
+        yield func(TornadoPatchedRequest(request), response)
+        _finish(response)
     return wrapper
 
 
-def http(func):
+def http(func=None, streaming=False, spool_threshold=DEFAULT_SPOOL_THRESHOLD,
+         compress=False, compress_min_size=DEFAULT_COMPRESS_MIN_SIZE, compress_level=DEFAULT_COMPRESS_LEVEL):
+    """Passes the request to the handler as `_HTTPRequest`.
+
+    With `streaming=True` the request body isn't buffered, see `StreamingHTTPRequest`.
+    With `compress=True` the response body is compressed, see `_HTTPResponse`.
+    Options are given as `@http(streaming=True)`.
+    """
+    if func is None:
+        return functools.partial(http, streaming=streaming, spool_threshold=spool_threshold,
+                                 compress=compress, compress_min_size=compress_min_size,
+                                 compress_level=compress_level)
+
     func = gen.coroutine(func)
 
+    def make_request(request):
+        if streaming:
+            return StreamingHTTPRequest(request, spool_threshold)
+        return HTTPPatchedRequest(request)
+
     def wrapper(request, response):
-        yield func(HTTPPatchedRequest(request), _HTTPResponse(response))
+        request = make_request(request)
+        response = _HTTPResponse(response, request, compress, compress_min_size, compress_level)
+        yield func(request, response)
+        _finish(response)
     return wrapper
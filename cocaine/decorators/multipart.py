@@ -0,0 +1,201 @@
+#
+#    Copyright (c) 2011-2012 Andrey Sibiryov <me@kobology.ru>
+#    Copyright (c) 2012+ Anton Tyurin <noxiouz@yandex.ru>
+#    Copyright (c) 2013+ Evgeny Safronov <division494@gmail.com>
+#    Copyright (c) 2011-2014 Other contributors as noted in the AUTHORS file.
+#
+#    This file is part of Cocaine.
+#
+#    Cocaine is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Cocaine is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import tempfile
+
+from tornado.httputil import HTTPHeaders
+from tornado.httputil import _parse_header
+
+
+__all__ = ["MultipartParser", "UploadedFile"]
+
+# file parts bigger than this are moved from memory to a temporary file
+DEFAULT_SPOOL_THRESHOLD = 1024 * 1024
+MAX_PART_HEADERS_SIZE = 16 * 1024
+
+_PREAMBLE, _DELIMITER, _HEADERS, _BODY, _EPILOGUE = range(5)
+
+
+class UploadedFile(object):
+    """File part of a multipart/form-data body.
+
+    `file` is a `SpooledTemporaryFile` positioned at the beginning, it's kept in memory
+    until it grows bigger than the spool threshold.
+    """
+
+    def __init__(self, filename, content_type, spool_threshold=DEFAULT_SPOOL_THRESHOLD):
+        self.filename = filename
+        self.content_type = content_type
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_threshold)
+        self.size = 0
+
+    def write(self, data):
+        self.file.write(data)
+        self.size += len(data)
+
+    def read(self, *args):
+        return self.file.read(*args)
+
+    def close(self):
+        self.file.close()
+
+    def __repr__(self):
+        return "<UploadedFile %s %s %d bytes>" % (self.filename, self.content_type, self.size)
+
+
+class MultipartParser(object):
+    """Incremental multipart/form-data parser.
+
+    The body is fed by chunks of any size. Values of plain fields are collected into
+    `arguments`, file parts are written into `UploadedFile` objects in `files` as they
+    arrive. Both are dicts of lists by field name, like the ones filled by
+    `tornado.httputil.parse_body_arguments`. Malformed bodies raise ValueError.
+    """
+
+    def __init__(self, boundary, spool_threshold=DEFAULT_SPOOL_THRESHOLD):
+        if isinstance(boundary, bytearray):
+            boundary = bytes(boundary)
+        elif not isinstance(boundary, bytes):
+            boundary = boundary.encode("latin-1")
+        if boundary.startswith(b'"') and boundary.endswith(b'"'):
+            boundary = boundary[1:-1]
+        if not boundary:
+            raise ValueError("multipart boundary is empty")
+
+        self.arguments = {}
+        self.files = {}
+        self._spool_threshold = spool_threshold
+        # the first delimiter may be not preceded by CRLF, so it's prepended
+        self._delimiter = b"\r\n--" + boundary
+        self._buffer = bytearray(b"\r\n")
+        self._state = _PREAMBLE
+        self._part = None
+        self._part_name = None
+
+    @property
+    def finished(self):
+        return self._state == _EPILOGUE
+
+    def feed(self, data):
+        if self._state == _EPILOGUE:
+            return
+
+        self._buffer += data
+        while self._step():
+            pass
+
+    def close(self):
+        """Checks that the body has been complete"""
+        if self._state != _EPILOGUE:
+            raise ValueError("multipart body is incomplete")
+
+    def _step(self):
+        buf = self._buffer
+        if self._state == _PREAMBLE:
+            index = buf.find(self._delimiter)
+            if index < 0:
+                del buf[:max(len(buf) - len(self._delimiter) + 1, 0)]
+                return False
+            del buf[:index + len(self._delimiter)]
+            self._state = _DELIMITER
+            return True
+
+        if self._state == _DELIMITER:
+            if len(buf) < 2:
+                return False
+            if buf[:2] == b"--":
+                self._state = _EPILOGUE
+                del buf[:]
+                return False
+            # transport padding is allowed after the delimiter
+            end = buf.find(b"\r\n")
+            if end < 0:
+                if len(buf) > MAX_PART_HEADERS_SIZE:
+                    raise ValueError("malformed multipart delimiter")
+                return False
+            if buf[:end].strip(b" \t"):
+                raise ValueError("malformed multipart delimiter")
+            del buf[:end + 2]
+            self._state = _HEADERS
+            return True
+
+        if self._state == _HEADERS:
+            end = buf.find(b"\r\n\r\n")
+            if end < 0:
+                if len(buf) > MAX_PART_HEADERS_SIZE:
+                    raise ValueError("multipart part headers are too big")
+                return False
+            self._start_part(bytes(buf[:end]))
+            del buf[:end + 4]
+            self._state = _BODY
+            return True
+
+        if self._state == _BODY:
+            index = buf.find(self._delimiter)
+            if index < 0:
+                # the tail may be the beginning of the delimiter
+                safe = len(buf) - len(self._delimiter) + 1
+                if safe > 0:
+                    self._part_data(buf[:safe])
+                    del buf[:safe]
+                return False
+            self._part_data(buf[:index])
+            self._finish_part()
+            del buf[:index + len(self._delimiter)]
+            self._state = _DELIMITER
+            return True
+
+        return False
+
+    def _start_part(self, raw_headers):
+        headers = HTTPHeaders.parse(raw_headers.decode("utf-8"))
+        disposition, params = _parse_header(headers.get("Content-Disposition", ""))
+        if disposition != "form-data" or not params.get("name"):
+            raise ValueError("invalid multipart part disposition")
+
+        name = params["name"]
+        if params.get("filename"):
+            part = UploadedFile(params["filename"], headers.get("Content-Type", "application/unknown"),
+                                self._spool_threshold)
+            self.files.setdefault(name, []).append(part)
+        else:
+            part = bytearray()
+            self.arguments.setdefault(name, []).append(part)
+        self._part = part
+        self._part_name = name
+
+    def _part_data(self, data):
+        if not data:
+            return
+
+        if isinstance(self._part, UploadedFile):
+            self._part.write(bytes(data))
+        else:
+            self._part += data
+
+    def _finish_part(self):
+        part, self._part = self._part, None
+        if isinstance(part, UploadedFile):
+            part.file.seek(0)
+            return
+
+        self.arguments[self._part_name][-1] = bytes(part)
@@ -0,0 +1,48 @@
+#
+#    Copyright (c) 2011-2012 Andrey Sibiryov <me@kobology.ru>
+#    Copyright (c) 2012+ Anton Tyurin <noxiouz@yandex.ru>
+#    Copyright (c) 2013+ Evgeny Safronov <division494@gmail.com>
+#    Copyright (c) 2011-2014 Other contributors as noted in the AUTHORS file.
+#
+#    This file is part of Cocaine.
+#
+#    Cocaine is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Cocaine is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from tornado import gen
+
+
+__all__ = ["ReplayedRequest"]
+
+
+class ReplayedRequest(object):
+    """Returns the already read head on the first read and delegates the rest.
+
+    It's passed on by decorators which look at the request before the handler does.
+    """
+
+    def __init__(self, request, head):
+        self._request = request
+        self._head = head
+
+    @gen.coroutine
+    def read(self):
+        if self._head is not None:
+            head, self._head = self._head, None
+            raise gen.Return(head)
+        data = yield self._request.read()
+        raise gen.Return(data)
+
+    def __getattr__(self, name):
+        return getattr(self._request, name)
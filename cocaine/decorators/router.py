@@ -0,0 +1,240 @@
+#
+#    Copyright (c) 2011-2012 Andrey Sibiryov <me@kobology.ru>
+#    Copyright (c) 2012+ Anton Tyurin <noxiouz@yandex.ru>
+#    Copyright (c) 2013+ Evgeny Safronov <division494@gmail.com>
+#    Copyright (c) 2011-2014 Other contributors as noted in the AUTHORS file.
+#
+#    This file is part of Cocaine.
+#
+#    Cocaine is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Cocaine is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import collections
+import re
+
+from six.moves.urllib import parse as urlparse
+
+from tornado import gen
+
+from .replay import ReplayedRequest
+
+
+__all__ = ["Router"]
+
+_PARAMETER = re.compile(r"^{(\w+)(?::(\w+))?}$")
+
+
+def _to_int(value):
+    if not value.isdigit():
+        raise ValueError(value)
+    return int(value)
+
+
+# converters of path parameters, the earlier ones are tried first.
+# A converter raises ValueError if the segment doesn't fit.
+_CONVERTERS = collections.OrderedDict([
+    ("int", _to_int),
+    ("str", lambda value: value),
+])
+_PRIORITY = list(_CONVERTERS)
+
+
+class _Node(object):
+    __slots__ = ("static", "params", "rest", "handlers")
+
+    def __init__(self):
+        # segment -> node
+        self.static = {}
+        # [(converter name, parameter name, node)] by converter priority
+        self.params = []
+        # (parameter name, handlers) of a trailing {name:path} parameter
+        self.rest = None
+        # method -> handler, None stands for any method
+        self.handlers = None
+
+
+class Router(object):
+    """Dispatches requests of a single `http` event to handlers by path templates.
+
+    Templates are compiled into a trie of path segments, so lookup doesn't scan the
+    list of routes. A segment of a template is either a literal or a parameter:
+      {name}       - any segment
+      {name:int}   - a segment of digits, passed as int
+      {name:path}  - the rest of the path, allowed as the last segment only
+    Literals win over parameters and int over str. If the preferred branch doesn't lead
+    to a route, the next one is tried, so "/users/me/posts" still reaches "/users/{name}/posts"
+    when "/users/me" is a route too. Lookup visits one node per segment when there is no
+    such dead end and at most every node of the templates sharing a prefix with the path
+    otherwise. Parameters of the same kind at the same position of different templates
+    must have the same name. They are put into `path_params` of the request.
+
+        router = Router()
+
+        @router.route("/users/{id:int}", methods=("GET",))
+        def user(request, response):
+            req = yield request.read()
+            uid = req.path_params["id"]
+
+        w.run({"http": http(router.dispatch)})
+
+    Unknown paths are answered with 404, known paths with another method with 405.
+    HEAD requests fall back to the GET handler of a route.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._routes = []
+
+    def add(self, template, handler, methods=None):
+        if not template.startswith("/"):
+            raise ValueError("path template must start with /: %s" % template)
+
+        node = self._root
+        segments = template[1:].split("/")
+        rest = None
+        for index, segment in enumerate(segments):
+            match = _PARAMETER.match(segment)
+            if match is None:
+                node = node.static.setdefault(segment, _Node())
+                continue
+
+            name, converter = match.group(1), match.group(2) or "str"
+            if converter == "path":
+                if index != len(segments) - 1:
+                    raise ValueError("{%s:path} must be the last segment of %s" % (name, template))
+                rest = name
+                break
+            if converter not in _CONVERTERS:
+                raise ValueError("unknown converter %s in %s" % (converter, template))
+            node = self._param_node(node, converter, name, template)
+
+        if rest is not None:
+            if node.rest is None:
+                node.rest = (rest, {})
+            elif node.rest[0] != rest:
+                raise ValueError("conflicting parameter names in %s" % template)
+            handlers = node.rest[1]
+        else:
+            if node.handlers is None:
+                node.handlers = {}
+            handlers = node.handlers
+
+        handler = gen.coroutine(handler)
+        for method in (methods or (None,)):
+            method = method.upper() if method else None
+            if method in handlers:
+                raise ValueError("route %s %s is already defined" % (method or "*", template))
+            handlers[method] = handler
+        self._routes.append((template, methods))
+
+    def route(self, template, methods=None):
+        def decorator(handler):
+            self.add(template, handler, methods)
+            return handler
+        return decorator
+
+    @staticmethod
+    def _param_node(node, converter, name, template):
+        for other_converter, other_name, child in node.params:
+            if other_converter == converter:
+                if other_name != name:
+                    raise ValueError("conflicting parameter names %s and %s in %s" % (other_name, name, template))
+                return child
+        child = _Node()
+        node.params.append((converter, name, child))
+        node.params.sort(key=lambda param: _PRIORITY.index(param[0]))
+        return child
+
+    def match(self, path):
+        """Returns a tuple of handlers by method and path parameters or (None, None)"""
+        params = {}
+        handlers = self._match(self._root, path[1:].split("/"), 0, params)
+        if handlers is None:
+            return None, None
+        return handlers, params
+
+    def _match(self, node, segments, index, params):
+        if index == len(segments):
+            if node.handlers:
+                return node.handlers
+            return None
+
+        segment = segments[index]
+        child = node.static.get(segment)
+        if child is not None:
+            handlers = self._match(child, segments, index + 1, params)
+            if handlers is not None:
+                return handlers
+
+        if segment:
+            value = urlparse.unquote(segment)
+            for converter, name, child in node.params:
+                try:
+                    params[name] = _CONVERTERS[converter](value)
+                except ValueError:
+                    continue
+                handlers = self._match(child, segments, index + 1, params)
+                if handlers is not None:
+                    return handlers
+                del params[name]
+
+        if node.rest is not None:
+            name, handlers = node.rest
+            params[name] = urlparse.unquote("/".join(segments[index:]))
+            return handlers
+        return None
+
+    def dispatch(self, request, response):
+        head = yield request.read()
+        handlers, params = self.match(head.path)
+        if handlers is None:
+            yield self.not_found(head, response)
+            return
+
+        handler = self._handler(handlers, head.method)
+        if handler is None:
+            allowed = set(method for method in handlers if method)
+            if "GET" in allowed:
+                allowed.add("HEAD")
+            yield self.method_not_allowed(head, response, sorted(allowed))
+            return
+
+        head.path_params = params
+        yield handler(ReplayedRequest(request, head), response)
+
+    @staticmethod
+    def _handler(handlers, method):
+        handler = handlers.get(method) or handlers.get(None)
+        if handler is None and method == "HEAD":
+            handler = handlers.get("GET")
+        return handler
+
+    @gen.coroutine
+    def not_found(self, request, response):
+        response.write_head(404, [("Content-Type", "text/plain")])
+        response.write(b"Not Found")
+        response.close()
+
+    @gen.coroutine
+    def method_not_allowed(self, request, response, allowed):
+        response.write_head(405, [("Content-Type", "text/plain"), ("Allow", ", ".join(allowed))])
+        response.write(b"Method Not Allowed")
+        response.close()
+
+    @property
+    def routes(self):
+        return list(self._routes)
+
+    def __len__(self):
+        return len(self._routes)
@@ -21,10 +21,81 @@
 #
 
 import functools
+import io
+import sys
+import threading
 
-from tornado.wsgi import WSGIContainer
+import six
+from six.moves.urllib import parse as urlparse
 
-from .http_dec import tornado_http
+from tornado.ioloop import IOLoop
+
+from ..detail.util import msgpack_unpackb
+
+
+# chunks of a response iterable which may wait to be sent before the application is paused
+DEFAULT_MAX_PENDING_CHUNKS = 4
+
+
+def _wsgi_str(value):
+    # PEP 3333 "native strings": bytes on Python 2, latin-1 decoded text on Python 3
+    if six.PY2:
+        return value.encode("utf-8") if isinstance(value, six.text_type) else value
+    if isinstance(value, six.binary_type):
+        return value.decode("latin-1")
+    return value
+
+
+def _unquote_path(path):
+    if six.PY2:
+        return urlparse.unquote(path)
+    return urlparse.unquote_to_bytes(path).decode("latin-1")
+
+
+def wsgi_environ(method, uri, version, headers, body):
+    """Builds a WSGI environ right from the unpacked request of the http proxy.
+
+    The body isn't copied, `wsgi.input` is a BytesIO over it.
+    """
+    path, _, query = _wsgi_str(uri).partition("?")
+    version = _wsgi_str(version)
+    environ = {
+        "REQUEST_METHOD": _wsgi_str(method),
+        "SCRIPT_NAME": "",
+        "PATH_INFO": _unquote_path(path),
+        "QUERY_STRING": query,
+        "REMOTE_ADDR": "",
+        "SERVER_NAME": "127.0.0.1",
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": version if version.startswith("HTTP") else "HTTP/" + version,
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": "http",
+        "wsgi.input": io.BytesIO(body if isinstance(body, six.binary_type) else six.b(body)),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+
+    for name, value in headers:
+        name, value = _wsgi_str(name), _wsgi_str(value)
+        key = name.upper().replace("-", "_")
+        if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            key = "HTTP_" + key
+        if key in environ:
+            # repeated headers are folded like HTTPHeaders does
+            value = environ[key] + "," + value
+        environ[key] = value
+
+    host = environ.get("HTTP_HOST")
+    if host:
+        name, sep, port = host.rpartition(":")
+        if sep and port.isdigit():
+            environ["SERVER_NAME"], environ["SERVER_PORT"] = name, port
+        else:
+            environ["SERVER_NAME"] = host
+    environ["REMOTE_ADDR"] = environ.get("HTTP_X_REAL_IP") or environ.get("HTTP_X_FORWARDED_FOR", "")
+    return environ
 
 
 def start_response(func, status, response_headers, exc_info=None):
@@ -37,11 +108,78 @@ def start_response(func, status, response_headers, exc_info=None):
     return func.write_head(int(status.split(' ')[0]), response_headers)
 
 
-def wsgi(application):
-    @tornado_http
-    def wrapper(request, response):
-        req = yield request.read()
-        for data in application(WSGIContainer.environ(req), functools.partial(start_response, response)):
+class _ThreadedResponse(object):
+    """Passes calls of a WSGI application running in a pool thread to the response on the IOLoop.
+
+    `write` blocks the calling thread while `max_pending` chunks are not sent to the pipe yet.
+    """
+
+    def __init__(self, io_loop, response, max_pending):
+        self._io_loop = io_loop
+        self._response = response
+        self._slots = threading.Semaphore(max_pending)
+
+    def start_response(self, status, response_headers, exc_info=None):
+        if exc_info:  # pragma: no cover
+            try:  # pragma: no cover
+                raise exc_info[0]
+            finally:
+                exc_info = None  # Avoid circular ref.
+
+        self._io_loop.add_callback(self._response.write_head, int(status.split(' ')[0]), response_headers)
+        return self.write
+
+    def write(self, data):
+        if not data:
+            return
+        self._slots.acquire()
+        self._io_loop.add_callback(self._write, data)
+
+    def _write(self, data):
+        try:
+            future = self._response.write(data)
+        except Exception:
+            self._slots.release()
+            raise
+
+        if future is None:
+            self._slots.release()
+        else:
+            self._io_loop.add_future(future, lambda _: self._slots.release())
+
+
+def _run_application(application, environ, response):
+    result = application(environ, response.start_response)
+    try:
+        for data in result:
             response.write(data)
+    finally:
+        close = getattr(result, "close", None)
+        if close is not None:
+            close()
+
+
+def wsgi(application=None, executor=None, max_pending=DEFAULT_MAX_PENDING_CHUNKS):
+    """Runs a WSGI application as a handler of HTTP requests.
+
+    The application and the iteration over its response run in `executor`, the shared
+    thread pool of `cocaine.futures` by default, so slow views don't block the IOLoop.
+    Chunks are sent from the IOLoop, the application is paused while `max_pending` of them
+    are waiting to be flushed to the pipe. Options are given as `@wsgi(executor=...)`.
+    """
+    if application is None:
+        return functools.partial(wsgi, executor=executor, max_pending=max_pending)
+
+    # http_dec pulls in tornado.httputil, it's imported when the decorator is used
+    from .http_dec import _HTTPResponse
+    from ..futures.threadpool import get_default_executor
+
+    def wrapper(request, response):
+        data = yield request.read()
+        environ = wsgi_environ(*msgpack_unpackb(data))
+        response = _HTTPResponse(response)
+        threaded_response = _ThreadedResponse(IOLoop.current(), response, max_pending)
+        pool = executor or get_default_executor()
+        yield pool.submit(_run_application, application, environ, threaded_response)
         response.close()
     return wrapper
@@ -38,10 +38,14 @@ from .channel import Tx
 from .channel import manage_headers
 from .headers import CocaineHeaders
 from .log import servicelog
+from .metrics import service_metrics
+from .reaper import SessionReaper
 from .trace import get_trace_adapter, update_dict_with_trace
-from .util import generate_service_id, msgpack_packb, msgpack_unpacker
+from .util import DEFAULT_MAX_BUFFER_SIZE, FrameUnpacker, UNPACK_ERRORS
+from .util import generate_service_id, msgpack_packv, write_buffers
+from ..common import CocaineErrno
 from ..decorators import coroutine
-from ..exceptions import DisconnectionError, ServiceConnectionError
+from ..exceptions import DisconnectionError, ServiceConnectionError, ServiceError
 
 
 def weak_wrapper(weak_service, method_name, *args, **kwargs):
@@ -76,7 +80,9 @@ def set_keep_alive(sock, idle=10, interval=5, fails=5):
 
 
 class BaseService(object):
-    def __init__(self, name, endpoints, io_loop=None):
+    def __init__(self, name, endpoints, io_loop=None,
+                 max_buffer_size=DEFAULT_MAX_BUFFER_SIZE, zero_copy_threshold=0,
+                 session_idle_timeout=None):
         if io_loop:
             warnings.warn('io_loop argument is deprecated.', DeprecationWarning)
         # If it's not the main thread
@@ -90,9 +96,17 @@ class BaseService(object):
         self.id = generate_service_id(self)
 
         self.log = servicelog
+        # shared by all clients of the service
+        self.metrics = service_metrics(name)
 
         self.sessions = {}
         self.counter = itertools.count(1)
+        # the reaper must not keep the service alive
+        self._reaper = SessionReaper(self.sessions,
+                                     functools.partial(weak_wrapper, weakref.ref(self), "_on_session_reaped"),
+                                     idle_timeout=session_idle_timeout,
+                                     io_loop=self.io_loop)
+        self._reaper.start()
         self.api = {}
 
         self._lock = Lock()
@@ -105,7 +119,12 @@ class BaseService(object):
         # from closing wrong connection, each new pipe has its epoch,
         # as id for on_close
         self.pipe_epoch = 0
-        self.buffer = msgpack_unpacker()
+        # metrics are shared by clients, so reconnects are told apart per client
+        self._connected_before = False
+        # big payloads of responses are handed out as memoryview, see FrameUnpacker
+        self._max_buffer_size = max_buffer_size
+        self._zero_copy_threshold = zero_copy_threshold
+        self.buffer = FrameUnpacker(max_buffer_size, zero_copy_threshold)
 
         self._header_table = {
             'tx': CocaineHeaders(),
@@ -141,9 +160,13 @@ class BaseService(object):
                                                streaming_callback=functools.partial(weak_wrapper, weakref.ref(self), "on_read"))
                 except Exception as err:
                     log.error("connection error %s", err)
+                    self.metrics.connect_errors += 1
                     conn_statuses.append((host, port, err))
                 else:
                     self.address = (host, port)
+                    self.metrics.on_connect(reconnect=self._connected_before)
+                    self._connected_before = True
+                    self.buffer = FrameUnpacker(self._max_buffer_size, self._zero_copy_threshold)
                     self._header_table = {
                         'tx': CocaineHeaders(),
                         'rx': CocaineHeaders(),
@@ -180,8 +203,16 @@ class BaseService(object):
 
     def on_read(self, read_bytes):
         self.log.debug("read %.300s", read_bytes)
-        self.buffer.feed(read_bytes)
-        for msg in self.buffer:
+        self.metrics.bytes_received += len(read_bytes)
+        try:
+            self.buffer.feed(read_bytes)
+            messages = list(self.buffer)
+        except UNPACK_ERRORS as err:
+            self.log.error("`%s` unable to unpack incoming message: %s", self.name, err)
+            self.disconnect()
+            return
+
+        for msg in messages:
             self.log.debug("unpacked: %.300s", msg)
             try:
                 session, message_type, payload = msg[:3]  # skip extra fields
@@ -200,6 +231,21 @@ class BaseService(object):
             if rx.closed():
                 del self.sessions[session]
 
+    def _on_session_reaped(self, session, rx):
+        rx.error(ServiceError(self.name, "session has been idle for more than %.3fs" % self._reaper.idle_timeout,
+                              CocaineErrno.ETIMEOUT))
+
+    def session_stats(self):
+        """Returns the number of sessions, their age distribution and the number of reaped ones"""
+        return self._reaper.stats()
+
+    def call_stats(self):
+        """Returns connection counters and latency histograms, errors and traffic by method name.
+
+        The figures are shared by all clients of the service in this process.
+        """
+        return self.metrics.snapshot()
+
     @coroutine
     def _invoke(self, method_name, *args, **kwargs):
         # Pop the Trace object, because it's not real header.
@@ -224,17 +270,14 @@ class BaseService(object):
                 # Manage headers using header table.
                 headers = manage_headers(kwargs, self._header_table['tx'])
 
-                packed_data = msgpack_packb([session, method_id, args, headers])
-                trace_logger.info(
-                    'send message to `%s`: channel id: %s, type: %s, length: %s bytes',
-                    self.name,
-                    session,
-                    method_name,
-                    len(packed_data)
-                )
+                packed_data = msgpack_packv([session, method_id, args, headers])
                 trace_logger.debug('send message: %.300s', [session, method_id, args, kwargs])
 
-                self.pipe.write(packed_data)
+                metrics = self.metrics.method(method_name)
+                metrics.calls += 1
+                for buff in packed_data:
+                    metrics.bytes_sent += len(buff)
+                write_buffers(self.pipe, packed_data)
                 trace_logger.debug("RX TREE %s", rx_tree)
                 trace_logger.debug("TX TREE %s", tx_tree)
 
@@ -243,13 +286,16 @@ class BaseService(object):
                         header_table=self._header_table['rx'],
                         io_loop=self.io_loop,
                         service_name=self.name,
-                        trace_id=trace_id)
+                        trace_id=trace_id,
+                        metrics=metrics)
                 tx = Tx(tx_tree=tx_tree,
                         pipe=self.pipe,
                         session_id=session,
                         header_table=self._header_table['tx'],
                         service_name=self.name,
-                        trace_id=trace_id)
+                        trace_id=trace_id,
+                        metrics=metrics,
+                        activity=rx.touch)
                 self.sessions[session] = rx
                 channel = Channel(rx=rx, tx=tx)
                 raise Return(channel)
@@ -267,6 +313,7 @@ class BaseService(object):
     def __del__(self):
         # we have to close owned connection
         # otherwise it would be a fd-leak
+        self._reaper.stop()
         self.disconnect()
 
     def __str__(self):
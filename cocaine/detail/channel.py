@@ -20,6 +20,7 @@
 
 import datetime
 import logging
+import time
 import warnings
 
 import six
@@ -31,12 +32,14 @@ from tornado.queues import Queue
 
 from .headers import CocaineHeaders, pack_value
 from .trace import get_trace_adapter, update_dict_with_trace
-from .util import msgpack_packb
+from .util import msgpack_packv
+from .util import write_buffers
 from ..common import CocaineErrno
 from ..decorators import coroutine
 from ..exceptions import ChokeEvent
 from ..exceptions import CocaineError
 from ..exceptions import InvalidMessageType
+from ..exceptions import ServiceConnectionError
 from ..exceptions import ServiceError
 
 log = logging.getLogger("cocaine.channel")
@@ -84,6 +87,22 @@ def detect_protocol_type(rx_tree):
     return null_protocol
 
 
+def payload_size(payload):
+    """Returns the number of bytes in binary and string arguments of a message"""
+    size = 0
+    for arg in payload:
+        if isinstance(arg, (six.binary_type, six.text_type, bytearray, memoryview)):
+            size += len(arg)
+    return size
+
+
+def error_code(err):
+    code = getattr(err, "code", None)
+    if code is None and isinstance(err, ServiceConnectionError):
+        return CocaineErrno.ESRVDISCON
+    return code
+
+
 def manage_headers(headers, table):
     result = []
     for k, v in six.iteritems(headers):
@@ -120,7 +139,7 @@ class PrettyPrintable(object):
 
 class Rx(PrettyPrintable):
     def __init__(self, rx_tree, session_id, header_table=None, io_loop=None, service_name=None,
-                 raw_headers=None, trace_id=None):
+                 raw_headers=None, trace_id=None, metrics=None):
         if header_table is None:
             header_table = CocaineHeaders()
 
@@ -139,6 +158,12 @@ class Rx(PrettyPrintable):
         self._headers = header_table
         self._current_headers = self._headers.merge(raw_headers)
         self.log = get_trace_adapter(log, trace_id)
+        self.created = self.last_activity = time.time()
+        # MethodMetrics of the call which has opened the session
+        self._metrics = metrics
+        self._first_response = True
+        if metrics is not None:
+            metrics.inflight += 1
 
     @coroutine
     def get(self, timeout=0, protocol=None):
@@ -167,7 +192,19 @@ class Rx(PrettyPrintable):
             raise Return(res)
 
     def done(self):
-        self._done = True
+        if not self._done:
+            self._done = True
+            self._finish()
+
+    def _finish(self, code=None):
+        metrics, self._metrics = self._metrics, None
+        if metrics is None:
+            return
+
+        metrics.inflight -= 1
+        metrics.latency.observe(time.time() - self.created)
+        if code is not None:
+            metrics.errors[code] += 1
 
     def push(self, msg_type, payload, raw_headers):
         dispatch = self.rx_tree.get(msg_type)
@@ -176,12 +213,25 @@ class Rx(PrettyPrintable):
             raise InvalidMessageType(self.service_name, CocaineErrno.INVALIDMESSAGETYPE,
                                      "unexpected message type %s" % msg_type)
         name, rx = dispatch
+        self.last_activity = time.time()
         self.log.info(
             "got message from `%s`: channel id: %s, type: %s",
             self.service_name,
             self.session_id,
             name
         )
+        metrics = self._metrics
+        if metrics is not None:
+            if self._first_response:
+                self._first_response = False
+                metrics.first_response.observe(self.last_activity - self.created)
+            metrics.bytes_received += payload_size(payload)
+            if name == b"error":
+                try:
+                    metrics.errors[payload[0][1]] += 1
+                except (IndexError, TypeError):
+                    pass
+
         self._queue.put_nowait((name, payload, raw_headers))
         if rx == {}:  # the last transition
             self.done()
@@ -190,6 +240,11 @@ class Rx(PrettyPrintable):
 
     def error(self, err):
         self._queue.put_nowait(err)
+        self._finish(error_code(err))
+
+    def touch(self):
+        """Marks the session active, e.g. when a request is streamed through its Tx"""
+        self.last_activity = time.time()
 
     def closed(self):
         return self._done
@@ -203,7 +258,8 @@ class Rx(PrettyPrintable):
 
 
 class Tx(PrettyPrintable):
-    def __init__(self, tx_tree, pipe, session_id, header_table, service_name, trace_id=None):
+    def __init__(self, tx_tree, pipe, session_id, header_table, service_name, trace_id=None,
+                 metrics=None, activity=None):
         self.tx_tree = tx_tree
         self.session_id = session_id
         self.service_name = service_name
@@ -212,6 +268,9 @@ class Tx(PrettyPrintable):
         self._header_table = header_table
         self.trace_id = trace_id
         self.log = get_trace_adapter(log, trace_id)
+        self._metrics = metrics
+        # called on every write, so the session isn't taken for idle while a request is sent
+        self._activity = activity
 
     @coroutine
     def _invoke(self, method_name, *args, **kwargs):
@@ -242,15 +301,13 @@ class Tx(PrettyPrintable):
                 self.log.debug("method `%s` has been found in API map", method_name)
                 headers = manage_headers(kwargs, self._header_table)
 
-                packed_data = msgpack_packb([self.session_id, method_id, args, headers])
-                self.log.info(
-                    'send message to `%s`: channel id: %s, type: %s, length: %s bytes',
-                    self.service_name,
-                    self.session_id,
-                    method_name,
-                    len(packed_data)
-                )
-                self.pipe.write(packed_data)
+                packed_data = msgpack_packv([self.session_id, method_id, args, headers])
+                if self._metrics is not None:
+                    for buff in packed_data:
+                        self._metrics.bytes_sent += len(buff)
+                write_buffers(self.pipe, packed_data)
+                if self._activity is not None:
+                    self._activity()
 
                 if tx_tree == {}:  # last transition
                     self.done()
@@ -19,6 +19,7 @@
 #    along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
+import collections
 import functools
 import itertools
 import json
@@ -27,7 +28,6 @@ import threading
 import warnings
 
 import six
-from six.moves import cStringIO as BytesIO
 
 from tornado import gen
 from tornado import queues
@@ -39,7 +39,7 @@ from tornado.tcpclient import TCPClient
 from .api import API
 from .defaults import Defaults
 from .defaults import GetOptError
-from .util import msgpack_pack, msgpack_packb, msgpack_unpacker
+from .util import msgpack_packb, msgpack_unpacker
 
 
 __all__ = ["Logger", "CocaineHandler"]
@@ -60,15 +60,22 @@ assert API.Locator[RESOLVE][0] == b"resolve"
 
 ATTRS_TYPES = six.string_types + six.integer_types + (float, bool)
 
+# a batch is written as soon as it grows to this size
+DEFAULT_MAX_BATCH_BYTES = 64 * 1024
+# time in seconds the first message of a batch may wait for the others
+DEFAULT_MAX_BATCH_DELAY = 0.01
+
 
 def thread_once(class_init):
+    # instances are per thread unless the logger is process-wide,
+    # an instance is initialized once either way
     @functools.wraps(class_init)
     def wrapper(self, *args, **kwargs):
-        if getattr(self._current, "initialized", False):
+        if getattr(self, "_initialized", False):
             return
 
         class_init(self, *args, **kwargs)
-        self._current.initialized = True
+        self._initialized = True
     return wrapper
 
 
@@ -80,19 +87,36 @@ fallback_logger.setLevel(logging.DEBUG)
 class Logger(object):
     _name = "logging"
     _current = threading.local()
+    # the instance shared by all threads, see enable_process_wide
+    _shared = None
+    _shared_lock = threading.Lock()
 
     def __new__(cls, *args, **kwargs):
+        shared = cls._shared
+        if shared is not None:
+            return shared
         if not getattr(cls._current, "instance", None):
-            cls._current.instance = object.__new__(cls, *args, **kwargs)
+            cls._current.instance = object.__new__(cls)
         return cls._current.instance
 
     @thread_once
-    def __init__(self, endpoints=LOCATOR_DEFAULT_ENDPOINTS, io_loop=None):
+    def __init__(self, endpoints=LOCATOR_DEFAULT_ENDPOINTS, io_loop=None,
+                 max_batch_bytes=DEFAULT_MAX_BATCH_BYTES, max_batch_delay=DEFAULT_MAX_BATCH_DELAY):
         if io_loop:
             warnings.warn('io_loop argument is deprecated.', DeprecationWarning)
         self.io_loop = io_loop or IOLoop.current()
         self.endpoints = endpoints
+        self.max_batch_bytes = max_batch_bytes
+        self.max_batch_delay = max_batch_delay
         self._lock = Lock()
+        self._stats = {
+            "batches": 0,
+            "messages": 0,
+            "bytes": 0,
+            "max_batch_messages": 0,
+            "max_batch_bytes": 0,
+            "failed_batches": 0,
+        }
 
         self.counter = itertools.count(1)
 
@@ -100,6 +124,12 @@ class Logger(object):
         self.target = Defaults.app
         self.verbosity = DEBUG_LEVEL
         self.queue = queues.Queue(10000)
+        # messages of other threads in the process-wide mode
+        self._pending = None
+        self._drain_scheduled = False
+        # ident of the thread running io_loop in the process-wide mode
+        self._loop_thread = None
+        self._closed = False
 
         # level could be reset from update_verbosity in the future
         if not fallback_logger.handlers:
@@ -115,6 +145,38 @@ class Logger(object):
         except GetOptError:
             self._defaultattrs = []
 
+    @classmethod
+    def enable_process_wide(cls, *args, **kwargs):
+        """Makes every thread log through a single Logger owned by the current IOLoop.
+
+        It must be called in the thread which runs the IOLoop, e.g. before `Worker.run`.
+        Messages of the IOLoop thread go to the queue of the Logger directly. Other
+        threads, like the ones of `threaded` calls or WSGI applications, append
+        messages to a deque and the IOLoop moves them to the queue, so there is one
+        connection to the logging service per process. Arguments are the ones of
+        `Logger`. The shared instance is returned.
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                logger = object.__new__(cls)
+                logger.__init__(*args, **kwargs)
+                logger._loop_thread = threading.current_thread().ident
+                logger._pending = collections.deque()
+                cls._shared = logger
+            return cls._shared
+
+    @classmethod
+    def disable_process_wide(cls):
+        """Returns to per-thread instances. The shared one is closed and returned, if any.
+
+        It must be called in the thread which runs the IOLoop of the shared instance.
+        """
+        with cls._shared_lock:
+            shared, cls._shared = cls._shared, None
+        if shared is not None:
+            shared.close()
+        return shared
+
     def prepare_message_args(self, level, message, *args, **kwargs):
         if args:
             try:
@@ -136,6 +198,14 @@ class Logger(object):
 
     def emit(self, level, message, *args, **kwargs):
         msg = self.prepare_message_args(level, message, *args, **kwargs)
+        if self._closed:
+            self._log_to_fallback(msg)
+            return
+
+        if self._pending is not None and threading.current_thread().ident != self._loop_thread:
+            self._emit_threadsafe(msg)
+            return
+
         # if the queue is full log new messages to the fallback Logger
         # to make most recent errors be printed at least to stderr
         try:
@@ -143,6 +213,29 @@ class Logger(object):
         except queues.QueueFull:
             self._log_to_fallback(msg)
 
+    def _emit_threadsafe(self, msg):
+        pending = self._pending
+        if len(pending) >= self.queue.maxsize:
+            self._log_to_fallback(msg)
+            return
+
+        pending.append(msg)
+        if not self._drain_scheduled:
+            self._drain_scheduled = True
+            self.io_loop.add_callback(self._drain)
+
+    def _drain(self):
+        # the flag is reset before draining, so a message appended
+        # after the check of any thread is picked up either now or by the next drain
+        self._drain_scheduled = False
+        pending = self._pending
+        while pending:
+            msg = pending.popleft()
+            try:
+                self.queue.put_nowait(msg)
+            except queues.QueueFull:
+                self._log_to_fallback(msg)
+
     @coroutine
     def _send(self):
         """ Send a message lazy formatted with args.
@@ -154,36 +247,83 @@ class Logger(object):
             * The key field in an attr is converted to string.
             * The value is sent as is if isinstance of (str, unicode, int, float, long, bool),
               otherwise we convert the value to string.
+
+        Messages are packed into a batch until it reaches `max_batch_bytes` or
+        `max_batch_delay` passes since the first one. The next batch isn't written
+        until the previous one is flushed, the queue takes messages meanwhile.
         """
-        buff = BytesIO()
-        while True:
+        buff = bytearray()
+        while not self._closed:
             msgs = list()
             try:
                 msg = yield self.queue.get()
+                # woken up by close
+                if self._closed:
+                    break
 
                 # we need to connect first, as we issue verbosity request just after connection
                 # and channels should strictly go in ascending order
                 if not self._connected:
                     yield self.connect()
 
-                try:
-                    while True:
-                        msgs.append(msg)
-                        counter = next(self.counter)
-                        msgpack_pack([counter, EMIT, msg], buff)
-                        msg = self.queue.get_nowait()
-                except queues.QueueEmpty:
-                    pass
+                deadline = self.io_loop.time() + self.max_batch_delay
+                while True:
+                    msgs.append(msg)
+                    buff += msgpack_packb([next(self.counter), EMIT, msg])
+                    if len(buff) >= self.max_batch_bytes:
+                        break
 
-                try:
-                    yield self.pipe.write(buff.getvalue())
-                except Exception:
-                    pass
-                # clean the buffer or we will end up without memory
-                buff.truncate(0)
+                    try:
+                        msg = self.queue.get_nowait()
+                    except queues.QueueEmpty:
+                        if self.io_loop.time() >= deadline:
+                            break
+                        try:
+                            msg = yield self.queue.get(timeout=deadline)
+                        except gen.TimeoutError:
+                            break
+                    if self._closed:
+                        break
+
+                yield self.pipe.write(bytes(buff))
+                self._account(len(msgs), len(buff))
             except Exception:
+                self._stats["failed_batches"] += 1
                 for message in msgs:
                     self._log_to_fallback(message)
+            finally:
+                # the buffer is reused by the next batch
+                del buff[:]
+
+    def close(self):
+        """Stops sending and closes the connection.
+
+        Messages which are not sent yet and the ones emitted later go to the fallback logger.
+        """
+        if self._closed:
+            return
+
+        self._closed = True
+        self._drain()
+        while self.queue.qsize():
+            self._log_to_fallback(self.queue.get_nowait())
+        # wake up _send waiting for a message
+        self.queue.put_nowait(None)
+        self.disconnect()
+
+    def _account(self, messages, size):
+        stats = self._stats
+        stats["batches"] += 1
+        stats["messages"] += messages
+        stats["bytes"] += size
+        stats["max_batch_messages"] = max(stats["max_batch_messages"], messages)
+        stats["max_batch_bytes"] = max(stats["max_batch_bytes"], size)
+
+    def stats(self):
+        """Returns counters of the written batches, messages and bytes"""
+        stats = dict(self._stats)
+        stats["queued"] = self.queue.qsize() + len(self._pending or ())
+        return stats
 
     def _log_to_fallback(self, message):
         level, target, text, attrs = message
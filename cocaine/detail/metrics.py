@@ -0,0 +1,270 @@
+#
+#    Copyright (c) 2012+ Anton Tyurin <noxiouz@yandex.ru>
+#    Copyright (c) 2013+ Evgeny Safronov <division494@gmail.com>
+#    Copyright (c) 2011-2014 Other contributors as noted in the AUTHORS file.
+#
+#    This file is part of Cocaine.
+#
+#    Cocaine is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Cocaine is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import bisect
+import collections
+import threading
+
+import six
+
+
+# upper bounds of latency buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60, float("inf"))
+
+
+class Histogram(object):
+    """Counts observed values in buckets with fixed upper bounds.
+
+    The last bound must be infinite, so every value has a bucket. Memory usage doesn't
+    depend on the number of observations.
+    """
+
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        if not bounds or bounds[-1] != float("inf"):
+            raise ValueError("the last bucket bound must be infinite")
+
+        self.bounds = tuple(bounds)
+        self.counts = [0] * len(self.bounds)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        """Returns buckets as a list of `[upper bound, count]` pairs with the total count and sum"""
+        return {
+            "buckets": [[bound, count] for bound, count in zip(self.bounds, self.counts)],
+            "count": self.count,
+            "sum": self.sum,
+        }
+
+
+class EventMetrics(object):
+    """Latency and throughput of handlers of a single worker event.
+
+    `latency` is measured from the invoke to the close or error of the response,
+    `first_chunk` from the invoke to the first response chunk sent.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.invokes = 0
+        self.inflight = 0
+        self.latency = Histogram(buckets)
+        self.first_chunk = Histogram(buckets)
+        # number of responses finished with an error by CocaineErrno
+        self.errors = collections.Counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def snapshot(self):
+        return {
+            "invokes": self.invokes,
+            "inflight": self.inflight,
+            "latency": self.latency.snapshot(),
+            "first_chunk": self.first_chunk.snapshot(),
+            "errors": dict(self.errors),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+        }
+
+
+class MethodMetrics(object):
+    """Calls of a single service method made by this process.
+
+    `first_response` is measured from the call to the first received message, `latency`
+    to the last message of the session. `bytes_sent` counts frames written for the session,
+    `bytes_received` counts binary and string arguments of the received messages.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.calls = 0
+        self.inflight = 0
+        self.first_response = Histogram(buckets)
+        self.latency = Histogram(buckets)
+        # number of sessions finished with an error by error code
+        self.errors = collections.Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def snapshot(self):
+        return {
+            "calls": self.calls,
+            "inflight": self.inflight,
+            "first_response": self.first_response.snapshot(),
+            "latency": self.latency.snapshot(),
+            "errors": dict(self.errors),
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+        }
+
+
+class ServiceMetrics(object):
+    """Connections to a service and calls of its methods, shared by all its clients"""
+
+    def __init__(self, name):
+        self.name = name
+        self.connects = 0
+        self.reconnects = 0
+        self.connect_errors = 0
+        self.bytes_received = 0
+        self._methods = {}
+
+    def method(self, name):
+        metrics = self._methods.get(name)
+        if metrics is None:
+            metrics = self._methods[name] = MethodMetrics()
+        return metrics
+
+    def on_connect(self, reconnect=False):
+        """Counts a connection, `reconnect` tells that the client has been connected before"""
+        self.connects += 1
+        if reconnect:
+            self.reconnects += 1
+
+    def snapshot(self):
+        return {
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "connect_errors": self.connect_errors,
+            "bytes_received": self.bytes_received,
+            "methods": dict((_native(name), metrics.snapshot())
+                            for name, metrics in list(six.iteritems(self._methods))),
+        }
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def service_metrics(name):
+    """Returns metrics of the service with the given name, creating them on demand"""
+    with _services_lock:
+        metrics = _services.get(name)
+        if metrics is None:
+            metrics = _services[name] = ServiceMetrics(name)
+        return metrics
+
+
+def services_snapshot():
+    """Returns metrics of all services this process has used by service name"""
+    with _services_lock:
+        services = list(_services.values())
+    return dict((metrics.name, metrics.snapshot()) for metrics in services)
+
+
+def _native(name):
+    # method and event names are bytes on the wire
+    if isinstance(name, six.binary_type) and not six.PY2:
+        return name.decode("latin-1")
+    return name
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class PrometheusWriter(object):
+    """Renders samples in the Prometheus text exposition format"""
+
+    def __init__(self, prefix="cocaine"):
+        self._prefix = prefix
+        self._families = collections.OrderedDict()
+
+    def sample(self, name, kind, labels, value):
+        name = "%s_%s" % (self._prefix, name)
+        samples = self._families.setdefault(name, (kind, []))[1]
+        samples.append((name, labels, value))
+
+    def histogram(self, name, labels, histogram):
+        family = "%s_%s" % (self._prefix, name)
+        samples = self._families.setdefault(family, ("histogram", []))[1]
+        total = 0
+        for bound, count in zip(histogram.bounds, histogram.counts):
+            total += count
+            samples.append((family + "_bucket", labels + [("le", _format_value(bound))], total))
+        samples.append((family + "_sum", labels, histogram.sum))
+        samples.append((family + "_count", labels, histogram.count))
+
+    def add_service(self, metrics):
+        labels = [("service", metrics.name)]
+        self.sample("service_connects_total", "counter", labels, metrics.connects)
+        self.sample("service_reconnects_total", "counter", labels, metrics.reconnects)
+        self.sample("service_connect_errors_total", "counter", labels, metrics.connect_errors)
+        self.sample("service_received_bytes_total", "counter", labels, metrics.bytes_received)
+        for name, method in sorted(six.iteritems(metrics._methods)):
+            labels = [("service", metrics.name), ("method", _native(name))]
+            self.sample("service_calls_total", "counter", labels, method.calls)
+            self.sample("service_inflight", "gauge", labels, method.inflight)
+            self.histogram("service_first_response_seconds", labels, method.first_response)
+            self.histogram("service_latency_seconds", labels, method.latency)
+            for code, count in sorted(six.iteritems(method.errors)):
+                self.sample("service_errors_total", "counter", labels + [("code", code)], count)
+            self.sample("service_method_sent_bytes_total", "counter", labels, method.bytes_sent)
+            self.sample("service_method_received_bytes_total", "counter", labels, method.bytes_received)
+
+    def add_event(self, name, metrics):
+        labels = [("event", _native(name))]
+        self.sample("worker_invokes_total", "counter", labels, metrics.invokes)
+        self.sample("worker_inflight", "gauge", labels, metrics.inflight)
+        self.histogram("worker_latency_seconds", labels, metrics.latency)
+        self.histogram("worker_first_chunk_seconds", labels, metrics.first_chunk)
+        for code, count in sorted(six.iteritems(metrics.errors)):
+            self.sample("worker_errors_total", "counter", labels + [("code", code)], count)
+        self.sample("worker_received_bytes_total", "counter", labels, metrics.bytes_in)
+        self.sample("worker_sent_bytes_total", "counter", labels, metrics.bytes_out)
+
+    def text(self):
+        lines = []
+        for family, (kind, samples) in six.iteritems(self._families):
+            lines.append("# TYPE %s %s" % (family, kind))
+            for name, labels, value in samples:
+                if labels:
+                    name += "{%s}" % ",".join('%s="%s"' % (k, _escape(v)) for k, v in labels)
+                lines.append("%s %s" % (name, _format_value(value)))
+        lines.append("")
+        return "\n".join(lines)
+
+
+def prometheus_text(events=None):
+    """Returns metrics of all services in the Prometheus text format.
+
+    `events` is a dict of worker `EventMetrics` by event name to be exported as well.
+    """
+    writer = PrometheusWriter()
+    with _services_lock:
+        services = sorted(_services.values(), key=lambda metrics: metrics.name)
+    for metrics in services:
+        writer.add_service(metrics)
+    for name, metrics in sorted(six.iteritems(events or {})):
+        writer.add_event(name, metrics)
+    return writer.text()
@@ -0,0 +1,109 @@
+#
+#    Copyright (c) 2012+ Anton Tyurin <noxiouz@yandex.ru>
+#    Copyright (c) 2013+ Evgeny Safronov <division494@gmail.com>
+#    Copyright (c) 2011-2014 Other contributors as noted in the AUTHORS file.
+#
+#    This file is part of Cocaine.
+#
+#    Cocaine is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Cocaine is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import logging
+import time
+
+from .iotimer import Timer
+
+
+# upper bounds of session age buckets in seconds
+AGE_BUCKETS = (1, 10, 60, 300, 3600, float("inf"))
+
+log = logging.getLogger("cocaine.reaper")
+
+
+def last_activity(_, session):
+    return session.last_activity
+
+
+class SessionReaper(object):
+    """Periodically drops sessions which have been idle for more than `idle_timeout` seconds.
+
+    `sessions` is a dict of session objects having `created` and `last_activity` timestamps,
+    `activity` can override how the latter is obtained. `on_reap` is called with the id and
+    the session after it has been removed from the dict. Without `idle_timeout` nothing is
+    reaped, but the statistics is still available.
+    """
+
+    def __init__(self, sessions, on_reap, idle_timeout=None, interval=None, activity=last_activity,
+                 io_loop=None):
+        self.sessions = sessions
+        self.idle_timeout = idle_timeout
+        self.reaped = 0
+        self._on_reap = on_reap
+        self._activity = activity
+        self._timer = None
+        if idle_timeout:
+            self._timer = Timer(self.sweep, interval or max(idle_timeout / 4.0, 0.1), io_loop)
+
+    def start(self):
+        if self._timer is not None:
+            self._timer.start()
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.stop()
+
+    def sweep(self, now=None):
+        """Removes idle sessions and returns their number"""
+        if not self.idle_timeout:
+            return 0
+
+        now = now or time.time()
+        deadline = now - self.idle_timeout
+        stale = [(session_id, session) for session_id, session in list(self.sessions.items())
+                 if self._activity(session_id, session) < deadline]
+
+        reaped = 0
+        for session_id, session in stale:
+            if self.sessions.pop(session_id, None) is None:
+                continue
+            reaped += 1
+            log.warning("session %s has been idle for %.3fs, reap it",
+                        session_id, now - self._activity(session_id, session))
+            try:
+                self._on_reap(session_id, session)
+            except Exception as err:
+                log.error("failed to reap session %s: %s", session_id, err)
+
+        self.reaped += reaped
+        return reaped
+
+    def stats(self, now=None):
+        """Returns the number of sessions, their age distribution and the number of reaped ones.
+
+        Ages are given as a list of `[upper bound in seconds, count]` pairs.
+        """
+        now = now or time.time()
+        ages = [0] * len(AGE_BUCKETS)
+        for session in list(self.sessions.values()):
+            age = now - session.created
+            for i, bound in enumerate(AGE_BUCKETS):
+                if age <= bound:
+                    ages[i] += 1
+                    break
+
+        return {
+            "sessions": len(self.sessions),
+            "ages": [[bound, count] for bound, count in zip(AGE_BUCKETS, ages)],
+            "reaped": self.reaped,
+        }
@@ -24,6 +24,7 @@ from .baseservice import BaseService
 from .defaults import Defaults
 from .locator import Locator
 from .trace import get_trace_adapter
+from .util import DEFAULT_MAX_BUFFER_SIZE
 from ..decorators import coroutine
 from ..exceptions import InvalidApiVersion
 
@@ -34,10 +35,15 @@ SYNC_CONNECTION_TIMEOUT = 5
 
 class Service(BaseService):
     def __init__(self, name, endpoints=LOCATOR_DEFAULT_ENDPOINT,
-                 seed=None, version=0, locator=None, io_loop=None, timeout=0):
+                 seed=None, version=0, locator=None, io_loop=None, timeout=0,
+                 max_buffer_size=DEFAULT_MAX_BUFFER_SIZE, zero_copy_threshold=0,
+                 session_idle_timeout=None):
         if io_loop:
             warnings.warn('io_loop argument is deprecated.', DeprecationWarning)
-        super(Service, self).__init__(name=name, endpoints=LOCATOR_DEFAULT_ENDPOINT, io_loop=io_loop)
+        super(Service, self).__init__(name=name, endpoints=LOCATOR_DEFAULT_ENDPOINT, io_loop=io_loop,
+                                      max_buffer_size=max_buffer_size,
+                                      zero_copy_threshold=zero_copy_threshold,
+                                      session_idle_timeout=session_idle_timeout)
         self.locator_endpoints = endpoints
         self.locator = locator
         self.timeout = timeout  # time for the resolve operation
@@ -20,11 +20,14 @@
 #
 from __future__ import unicode_literals
 
+import collections
 import hashlib
+import struct
 import time
 from functools import partial
 
 import msgpack
+from msgpack.exceptions import BufferFull  # noqa: F401 re-exported
 
 import six
 
@@ -33,6 +36,312 @@ msgpack_packb = msgpack.packb
 msgpack_unpackb = msgpack.unpackb
 msgpack_unpacker = partial(msgpack.Unpacker, use_list=True)
 
+# binary payloads starting from this size are not copied into a packed frame
+DEFAULT_SCATTER_THRESHOLD = 64 * 1024
+
+BUFFER_TYPES = (six.binary_type, bytearray, memoryview)
+
+# depending on the msgpack version bytes are packed either as bin or as raw
+_PACKS_BIN = msgpack_packb(b"")[:1] == b"\xc4"
+
+
+def _array_header(size):
+    if size < 16:
+        return six.int2byte(0x90 | size)
+    elif size < 0x10000:
+        return struct.pack(">BH", 0xdc, size)
+    return struct.pack(">BI", 0xdd, size)
+
+
+def _buffer_header(size):
+    if _PACKS_BIN:
+        if size < 0x100:
+            return struct.pack(">BB", 0xc4, size)
+        elif size < 0x10000:
+            return struct.pack(">BH", 0xc5, size)
+        return struct.pack(">BI", 0xc6, size)
+
+    if size < 32:
+        return six.int2byte(0xa0 | size)
+    elif size < 0x10000:
+        return struct.pack(">BH", 0xda, size)
+    return struct.pack(">BI", 0xdb, size)
+
+
+def _buffer_size(value):
+    if isinstance(value, memoryview):
+        return value.nbytes if hasattr(value, "nbytes") else len(value) * value.itemsize
+    return len(value)
+
+
+def _has_large_buffer(obj, threshold):
+    for item in obj:
+        if isinstance(item, BUFFER_TYPES):
+            if _buffer_size(item) >= threshold:
+                return True
+        elif isinstance(item, (list, tuple)) and _has_large_buffer(item, threshold):
+            return True
+    return False
+
+
+def msgpack_packv(obj, threshold=DEFAULT_SCATTER_THRESHOLD):
+    """Packs a list or a tuple into a list of buffers which concatenated give `msgpack_packb(obj)`.
+
+    Binary payloads not smaller than `threshold` bytes found in nested lists and tuples are
+    not copied, they're returned as is right after their msgpack header.
+    """
+    if not _has_large_buffer(obj, threshold):
+        return [msgpack_packb(obj)]
+
+    buffers = []
+    pending = []
+
+    def walk(value):
+        if isinstance(value, (list, tuple)):
+            pending.append(_array_header(len(value)))
+            for item in value:
+                walk(item)
+        elif isinstance(value, BUFFER_TYPES) and _buffer_size(value) >= threshold:
+            pending.append(_buffer_header(_buffer_size(value)))
+            buffers.append(b"".join(pending))
+            buffers.append(value)
+            del pending[:]
+        else:
+            pending.append(msgpack_packb(value))
+
+    walk(obj)
+    if pending:
+        buffers.append(b"".join(pending))
+    return buffers
+
+
+def write_buffers(pipe, buffers):
+    """Writes buffers into the stream one by one and returns the future of the last write"""
+    future = None
+    for buff in buffers:
+        future = pipe.write(buff)
+    return future
+
+
+# incoming data a connection may buffer before a frame is complete, 0 lifts the limit
+DEFAULT_MAX_BUFFER_SIZE = 100 * 1024 * 1024
+# raised by unpackers on frames exceeding the limit or malformed ones
+UNPACK_ERRORS = (BufferFull, ValueError)
+
+# the longest prefix of a frame enough to find out if its payload is big:
+# array header, session, message type, arguments array header, payload header
+_FRAME_PREFIX_SIZE = 1 + 9 + 9 + 5 + 5
+_INCOMPLETE = object()
+_FEED_SIZE = 64 * 1024
+
+_UINT_FORMATS = {0xcc: ">B", 0xcd: ">H", 0xce: ">I", 0xcf: ">Q"}
+_ARRAY_FORMATS = {0xdc: ">H", 0xdd: ">I"}
+_BUFFER_FORMATS = {0xc5: ">H", 0xc6: ">I", 0xda: ">H", 0xdb: ">I"}
+
+
+def _parse_uint(buff, pos, formats):
+    if pos >= len(buff):
+        raise IndexError(pos)
+    fmt = formats.get(buff[pos])
+    if fmt is None:
+        raise ValueError(buff[pos])
+    end = pos + 1 + struct.calcsize(fmt)
+    if end > len(buff):
+        raise IndexError(end)
+    return struct.unpack(fmt, bytes(buff[pos + 1:end]))[0], end
+
+
+def _parse_big_frame_prefix(buff, threshold):
+    """Looks for a frame `[session, type, [payload, ...](, headers)]` with a big binary payload.
+
+    Returns `_INCOMPLETE` if there are not enough bytes to decide, None if it's not such
+    a frame or a tuple of the prefix length, the frame length, session, message type,
+    the number of arguments and the payload size.
+    """
+    buff = bytearray(buff[:_FRAME_PREFIX_SIZE])
+    try:
+        if buff[0] not in (0x93, 0x94):
+            return None
+        frame_size = buff[0] & 0x0f
+
+        pos = 1
+        fields = []
+        for _ in range(2):
+            if pos >= len(buff):
+                return _INCOMPLETE
+            if buff[pos] < 0x80:
+                fields.append(buff[pos])
+                pos += 1
+            else:
+                value, pos = _parse_uint(buff, pos, _UINT_FORMATS)
+                fields.append(value)
+
+        if pos >= len(buff):
+            return _INCOMPLETE
+        if 0x90 <= buff[pos] <= 0x9f:
+            args_count = buff[pos] & 0x0f
+            pos += 1
+        else:
+            args_count, pos = _parse_uint(buff, pos, _ARRAY_FORMATS)
+        if args_count == 0:
+            return None
+
+        size, pos = _parse_uint(buff, pos, _BUFFER_FORMATS)
+    except IndexError:
+        return _INCOMPLETE
+    except ValueError:
+        return None
+
+    if size < threshold:
+        return None
+    return pos, frame_size, fields[0], fields[1], args_count, size
+
+
+class _BigFrame(object):
+    def __init__(self, frame_size, session, message_type, args_count, size):
+        self.frame_size = frame_size
+        self.session = session
+        self.message_type = message_type
+        self.tail = []
+        self.tail_size = args_count - 1 + frame_size - 3
+        self.payload = bytearray(size)
+        self.filled = 0
+
+    @property
+    def missing(self):
+        return len(self.payload) - self.filled
+
+    def frame(self):
+        args = [memoryview(self.payload)]
+        args.extend(self.tail[:self.tail_size - self.frame_size + 3])
+        frame = [self.session, self.message_type, args]
+        if self.frame_size > 3:
+            frame.append(self.tail[-1])
+        return frame
+
+
+class FrameUnpacker(object):
+    """Unpacks protocol frames from a byte stream, a drop-in replacement of `msgpack_unpacker`.
+
+    The data buffered for an incomplete frame is limited by `max_buffer_size`, one of
+    `UNPACK_ERRORS` is raised otherwise. 0 or None turn the limit off, then a frame header
+    alone makes the zero-copy path allocate as much as it declares.
+
+    With a non zero `zero_copy_threshold` a frame whose first argument is a binary payload
+    of at least that many bytes bypasses the msgpack unpacker: the payload is copied once
+    into a buffer allocated by its declared size and is handed out as a memoryview over it.
+    Thresholds below the size of a frame prefix are raised to it.
+    """
+
+    def __init__(self, max_buffer_size=DEFAULT_MAX_BUFFER_SIZE, zero_copy_threshold=0):
+        self._max_buffer_size = max_buffer_size
+        # a big frame must be longer than the prefix read ahead of its payload,
+        # otherwise the prefix could take bytes of the next frame
+        self._threshold = max(zero_copy_threshold, _FRAME_PREFIX_SIZE) if zero_copy_threshold else 0
+        self._frames = collections.deque()
+        self._head = None
+        self._big = None
+        self._tail = None
+        self._reset_unpacker()
+
+    def feed(self, data):
+        if not self._threshold:
+            self._unpacker.feed(data)
+            return
+
+        self._process(memoryview(data))
+
+    def __iter__(self):
+        if not self._threshold:
+            return iter(self._unpacker)
+        return self._iter_frames()
+
+    def _iter_frames(self):
+        while self._frames:
+            yield self._frames.popleft()
+
+    def _reset_unpacker(self):
+        # msgpack takes 0 for no limit
+        self._unpacker = msgpack_unpacker(max_buffer_size=self._max_buffer_size or 0)
+        self._fed = 0
+
+    def _process(self, view):
+        while len(view):
+            if self._big is not None:
+                view = self._feed_big(view)
+            elif self._head is not None:
+                view = self._feed_head(view)
+            else:
+                view = self._feed_unpacker(view)
+
+    def _feed_unpacker(self, view):
+        # the data is fed by pieces, so the unpacker never copies much of a big frame
+        piece = view[:_FEED_SIZE]
+        start = self._fed
+        self._unpacker.feed(piece)
+        self._fed += len(piece)
+
+        while True:
+            position = self._unpacker.tell()
+            if self._tail is None and start <= position < self._fed:
+                # a new frame starts within the piece
+                rest = view[position - start:]
+                if _parse_big_frame_prefix(rest, self._threshold) is not None:
+                    self._reset_unpacker()
+                    self._head = bytearray()
+                    return rest
+
+            try:
+                obj = next(self._unpacker)
+            except StopIteration:
+                return view[len(piece):]
+
+            if self._tail is None:
+                self._frames.append(obj)
+                continue
+
+            self._tail.tail.append(obj)
+            if len(self._tail.tail) == self._tail.tail_size:
+                self._frames.append(self._tail.frame())
+                self._tail = None
+
+    def _feed_head(self, view):
+        taken = _FRAME_PREFIX_SIZE - len(self._head)
+        self._head += view[:taken]
+        view = view[taken:]
+
+        prefix = _parse_big_frame_prefix(self._head, self._threshold)
+        if prefix is _INCOMPLETE:
+            return view
+
+        head, self._head = self._head, None
+        if prefix is None:
+            self._process(memoryview(head))
+            return view
+
+        prefix_size, frame_size, session, message_type, args_count, size = prefix
+        if self._max_buffer_size and size > self._max_buffer_size:
+            raise BufferFull("payload of %d bytes exceeds the buffer limit" % size)
+
+        self._big = _BigFrame(frame_size, session, message_type, args_count, size)
+        # the payload is never shorter than what is left of the prefix
+        self._feed_big(memoryview(head)[prefix_size:])
+        return view
+
+    def _feed_big(self, view):
+        big = self._big
+        size = min(len(view), big.missing)
+        big.payload[big.filled:big.filled + size] = view[:size]
+        big.filled += size
+        if big.missing == 0:
+            self._big = None
+            if big.tail_size == 0:
+                self._frames.append(big.frame())
+            else:
+                # the rest arguments and headers are regular objects following the payload
+                self._tail = big
+        return view[size:]
+
 
 def valid_chunk(chunk):
     return isinstance(chunk, six.string_types + (six.binary_type,))
@@ -60,6 +60,11 @@ class ChokeEvent(CocaineError):
     pass
 
 
+class CancelledError(CocaineError):
+    def __str__(self):
+        return "the call has been cancelled"
+
+
 class ServiceConnectionError(CocaineError):
     def __init__(self, message):
         super(ServiceConnectionError, self).__init__(message)
@@ -19,42 +19,58 @@
 #    along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
-import threading
 import warnings
 
-from tornado.concurrent import Future
 from tornado.ioloop import IOLoop
 
+from .processpool import ProcessPoolExecutor
+from .processpool import get_default_process_executor
+from .processpool import register
+from .processpool import set_default_process_executor
+from .threadpool import ThreadPoolExecutor
+from .threadpool import get_default_executor
+from .threadpool import set_default_executor
 
-__all__ = ["ConcurrentWorker", "threaded"]
+
+__all__ = ["ConcurrentWorker", "ThreadPoolExecutor", "threaded",
+           "get_default_executor", "set_default_executor",
+           "ProcessPoolExecutor", "processed",
+           "get_default_process_executor", "set_default_process_executor"]
 
 
 class ConcurrentWorker(object):
-    def __init__(self, func, io_loop=None, args=(), kwargs=None):
+    def __init__(self, func, io_loop=None, args=(), kwargs=None, executor=None):
         self._func = func
         if io_loop:
             warnings.warn('io_loop argument is deprecated.', DeprecationWarning)
         self._io_loop = io_loop or IOLoop.current()
         self._args = args
         self._kwargs = kwargs or {}
-        self._future = Future()
-
-        self._worker = threading.Thread(target=self._run)
-        self._worker.setDaemon(True)
-
-    def _run(self):
-        try:
-            result = self._func(*self._args, **self._kwargs)
-            self._io_loop.add_callback(self._future.set_result, result)
-        except Exception as err:
-            self._io_loop.add_callback(self._future.set_exception, err)
+        self._executor = executor or get_default_executor()
 
     def execute(self):
-        self._worker.start()
-        return self._future
+        return self._executor._submit(self._io_loop, self._func, self._args, self._kwargs)
 
 
 def threaded(func):
+    """Runs the decorated blocking function in the shared thread pool.
+
+    The call returns a tornado future. The pool is bounded, see `set_default_executor`
+    to change its size.
+    """
     def wrapper(*args, **kwargs):
         return ConcurrentWorker(func, args=args, kwargs=kwargs).execute()
     return wrapper
+
+
+def processed(func):
+    """Runs the decorated CPU bound function in the shared process pool.
+
+    The call returns a tornado future. The function must be defined at the module level,
+    its arguments and result must be picklable.
+    """
+    ref = register(func)
+
+    def wrapper(*args, **kwargs):
+        return get_default_process_executor().submit(ref, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,266 @@
+#
+#    Copyright (c) 2012+ Anton Tyurin <noxiouz@yandex.ru>
+#    Copyright (c) 2013+ Evgeny Safronov <division494@gmail.com>
+#    Copyright (c) 2011-2014 Other contributors as noted in the AUTHORS file.
+#
+#    This file is part of Cocaine.
+#
+#    Cocaine is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Cocaine is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import importlib
+import mmap
+import multiprocessing
+import os
+import pickle
+import tempfile
+import threading
+
+import six
+
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+
+__all__ = ["ProcessPoolExecutor", "get_default_process_executor", "set_default_process_executor"]
+
+# byte payloads starting from this size are passed through shared memory
+# instead of being pickled into the pool pipe
+DEFAULT_SHM_THRESHOLD = 1024 * 1024
+
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# functions decorated with `processed` by "module:name".
+# Pool processes are forked after decoration, so the registry is inherited by them.
+_registry = {}
+
+
+class SharedBuffer(object):
+    """Byte payload stored in a shared memory file which is passed between processes by name"""
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+    @classmethod
+    def dump(cls, data):
+        fd, path = tempfile.mkstemp(prefix="cocaine-", dir=SHM_DIR)
+        try:
+            if data:
+                os.ftruncate(fd, len(data))
+                mm = mmap.mmap(fd, len(data))
+                try:
+                    mm[:] = data
+                finally:
+                    mm.close()
+        except Exception:
+            os.unlink(path)
+            raise
+        finally:
+            os.close(fd)
+        return cls(path, len(data))
+
+    def load(self):
+        try:
+            if self.size == 0:
+                return b""
+            with open(self.path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), self.size, access=mmap.ACCESS_READ)
+                try:
+                    return mm[:]
+                finally:
+                    mm.close()
+        finally:
+            self.discard()
+
+    def discard(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class FunctionRef(object):
+    def __init__(self, module, name):
+        self.module = module
+        self.name = name
+
+    @property
+    def key(self):
+        return "%s:%s" % (self.module, self.name)
+
+    def resolve(self):
+        if self.key not in _registry:
+            importlib.import_module(self.module)
+        return _registry[self.key]
+
+
+def register(func):
+    ref = FunctionRef(func.__module__, func.__name__)
+    _registry[ref.key] = func
+    return ref
+
+
+def _share(value, threshold):
+    if isinstance(value, (six.binary_type, bytearray)) and len(value) >= threshold:
+        return SharedBuffer.dump(value)
+    return value
+
+
+def _unshare(value):
+    if isinstance(value, SharedBuffer):
+        return value.load()
+    return value
+
+
+def _discard(values):
+    for value in values:
+        if isinstance(value, SharedBuffer):
+            value.discard()
+
+
+def _call(func, args, kwargs, threshold):
+    # it's executed inside the pool process
+    try:
+        if isinstance(func, FunctionRef):
+            func = func.resolve()
+        args = [_unshare(arg) for arg in args]
+        kwargs = dict((k, _unshare(v)) for k, v in six.iteritems(kwargs))
+        return True, _share(func(*args, **kwargs), threshold)
+    except Exception as err:
+        try:
+            pickle.dumps(err)
+        except Exception:
+            err = RuntimeError("%s: %s" % (type(err).__name__, err))
+        return False, err
+
+
+class ProcessPoolExecutor(object):
+    """Pool of processes for CPU bound calls which would otherwise block the IOLoop.
+
+    Processes are forked on the first submit. Arguments and results are pickled, byte
+    payloads not smaller than `shm_threshold` go through shared memory files. Results are
+    delivered as tornado futures resolved on the IOLoop which was current at the submit time.
+    """
+
+    def __init__(self, max_workers=None, shm_threshold=DEFAULT_SHM_THRESHOLD):
+        if max_workers is not None and max_workers <= 0:
+            raise ValueError("max_workers must be greater than 0")
+
+        self._max_workers = max_workers or multiprocessing.cpu_count()
+        self._shm_threshold = shm_threshold
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pending = 0
+
+    def submit(self, func, *args, **kwargs):
+        io_loop = IOLoop.current()
+        future = Future()
+
+        threshold = self._shm_threshold
+        args = [_share(arg, threshold) for arg in args]
+        kwargs = dict((k, _share(v, threshold)) for k, v in six.iteritems(kwargs))
+
+        def on_result(result):
+            with self._lock:
+                self._pending -= 1
+            ok, value = result
+            if ok:
+                try:
+                    value = _unshare(value)
+                except Exception as err:
+                    io_loop.add_callback(future.set_exception, err)
+                    return
+                io_loop.add_callback(future.set_result, value)
+            else:
+                io_loop.add_callback(future.set_exception, value)
+
+        def on_error(err):
+            # the call has failed outside of _call: the arguments or the result
+            # can't be pickled or the pool process has crashed
+            with self._lock:
+                self._pending -= 1
+            _discard(args)
+            _discard(six.itervalues(kwargs))
+            io_loop.add_callback(future.set_exception, err)
+
+        options = {"callback": on_result}
+        if not six.PY2:
+            # Python 2 pools have no error callbacks
+            options["error_callback"] = on_error
+
+        try:
+            with self._lock:
+                pool = self._get_pool()
+                self._pending += 1
+            pool.apply_async(_call, (func, args, kwargs, threshold), **options)
+        except Exception:
+            _discard(args)
+            _discard(six.itervalues(kwargs))
+            raise
+        return future
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            pool, self._pool = self._pool, None
+
+        if pool is None:
+            return
+
+        if wait:
+            pool.close()
+            pool.join()
+        else:
+            pool.terminate()
+
+    @property
+    def max_workers(self):
+        return self._max_workers
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_workers": self._max_workers,
+                "running": self._pool is not None,
+                "pending": self._pending,
+            }
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self._max_workers)
+        return self._pool
+
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+
+def get_default_process_executor():
+    """Returns the shared executor used by `processed`, creating it on demand"""
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = ProcessPoolExecutor()
+        return _default_executor
+
+
+def set_default_process_executor(executor):
+    """Replaces the shared executor, e.g. to change its size.
+
+    The previous executor is returned, it's up to the caller to shut it down.
+    """
+    global _default_executor
+    with _default_executor_lock:
+        previous, _default_executor = _default_executor, executor
+    return previous
@@ -0,0 +1,200 @@
+#
+#    Copyright (c) 2012+ Anton Tyurin <noxiouz@yandex.ru>
+#    Copyright (c) 2013+ Evgeny Safronov <division494@gmail.com>
+#    Copyright (c) 2011-2014 Other contributors as noted in the AUTHORS file.
+#
+#    This file is part of Cocaine.
+#
+#    Cocaine is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Cocaine is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import collections
+import logging
+import threading
+
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+from ..exceptions import CancelledError
+
+
+__all__ = ["ThreadPoolExecutor", "get_default_executor", "set_default_executor"]
+
+DEFAULT_MAX_WORKERS = 16
+
+log = logging.getLogger("cocaine.futures")
+
+
+class _WorkItem(object):
+    __slots__ = ("future", "io_loop", "func", "args", "kwargs")
+
+    def __init__(self, future, io_loop, func, args, kwargs):
+        self.future = future
+        self.io_loop = io_loop
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        try:
+            result = self.func(*self.args, **self.kwargs)
+            self.io_loop.add_callback(self.future.set_result, result)
+        except Exception as err:
+            self.io_loop.add_callback(self.future.set_exception, err)
+
+
+class ThreadPoolExecutor(object):
+    """Bounded pool of daemon threads which runs blocking calls.
+
+    Threads are spawned lazily up to `max_workers` and are reused afterwards, the rest
+    of the calls wait in the FIFO queue. Results are delivered as tornado futures resolved
+    on the IOLoop which was current at the submit time.
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, name="cocaine-pool"):
+        if max_workers <= 0:
+            raise ValueError("max_workers must be greater than 0")
+
+        self._max_workers = max_workers
+        self._name = name
+        self._cv = threading.Condition()
+        self._queue = collections.deque()
+        self._pending = {}
+        self._threads = []
+        self._idle = 0
+        self._active = 0
+        self._shutdown = False
+
+    def submit(self, func, *args, **kwargs):
+        return self._submit(IOLoop.current(), func, args, kwargs)
+
+    def _submit(self, io_loop, func, args, kwargs):
+        future = Future()
+        item = _WorkItem(future, io_loop, func, args, kwargs)
+        with self._cv:
+            if self._shutdown:
+                raise RuntimeError("cannot submit after shutdown")
+
+            self._queue.append(item)
+            self._pending[future] = item
+            if len(self._queue) > self._idle and len(self._threads) < self._max_workers:
+                self._spawn()
+            self._cv.notify()
+        return future
+
+    def cancel(self, future):
+        """Removes a not yet started call from the queue.
+
+        The future is resolved with `CancelledError`. Returns False if the call is
+        already running or has finished.
+        """
+        with self._cv:
+            item = self._pending.pop(future, None)
+            if item is None:
+                return False
+            self._queue.remove(item)
+
+        item.io_loop.add_callback(item.future.set_exception, CancelledError())
+        return True
+
+    def shutdown(self, wait=True):
+        with self._cv:
+            self._shutdown = True
+            self._cv.notify_all()
+            threads = list(self._threads)
+
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    @property
+    def max_workers(self):
+        return self._max_workers
+
+    @property
+    def queue_size(self):
+        return len(self._queue)
+
+    @property
+    def active_workers(self):
+        return self._active
+
+    @property
+    def workers(self):
+        return len(self._threads)
+
+    def stats(self):
+        with self._cv:
+            return {
+                "max_workers": self._max_workers,
+                "workers": len(self._threads),
+                "active": self._active,
+                "queued": len(self._queue),
+            }
+
+    def _spawn(self):
+        thread = threading.Thread(target=self._run,
+                                  name="%s-%d" % (self._name, len(self._threads)))
+        thread.daemon = True
+        self._threads.append(thread)
+        thread.start()
+
+    def _run(self):
+        while True:
+            with self._cv:
+                self._idle += 1
+                while not self._queue and not self._shutdown:
+                    self._cv.wait()
+                self._idle -= 1
+
+                if not self._queue:
+                    # shutdown has been requested and there is nothing to do
+                    self._threads.remove(threading.current_thread())
+                    return
+
+                item = self._queue.popleft()
+                del self._pending[item.future]
+                self._active += 1
+
+            try:
+                item.run()
+            except Exception as err:  # pragma: no cover
+                log.error("unexpected error in %s: %s", self._name, err)
+            finally:
+                with self._cv:
+                    self._active -= 1
+
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+
+def get_default_executor():
+    """Returns the shared executor used by `threaded`, creating it on demand"""
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = ThreadPoolExecutor()
+        return _default_executor
+
+
+def set_default_executor(executor):
+    """Replaces the shared executor, e.g. to change its size.
+
+    The previous executor is returned and keeps serving the calls it has already accepted.
+    """
+    global _default_executor
+    with _default_executor_lock:
+        previous, _default_executor = _default_executor, executor
+    return previous
@@ -19,6 +19,7 @@
 #
 
 from cocaine.detail.util import msgpack_packb
+from cocaine.detail.util import msgpack_packv
 
 
 class RPC(object):
@@ -85,6 +86,11 @@ def packv1(msg_id, session, *args):
     return msgpack_packb([msg_id, session, args])
 
 
+def packv1_buffers(msg_id, session, *args):
+    """The same as `packv1`, but big binary arguments are not copied into the frame"""
+    return msgpack_packv([msg_id, session, args])
+
+
 def _make_packable(m_id, m_session, args):
     def wrapper():
         return msgpack_packb([m_session, m_id, args])
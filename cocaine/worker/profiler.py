@@ -0,0 +1,97 @@
+#
+#    Copyright (c) 2012+ Anton Tyurin <noxiouz@yandex.ru>
+#    Copyright (c) 2013+ Evgeny Safronov <division494@gmail.com>
+#    Copyright (c) 2011-2014 Other contributors as noted in the AUTHORS file.
+#
+#    This file is part of Cocaine.
+#
+#    Cocaine is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Cocaine is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import collections
+import signal
+
+from .watchdog import no_context
+
+
+DEFAULT_SAMPLE_INTERVAL = 0.005
+# deeper stacks are truncated, the innermost frames are kept
+MAX_STACK_DEPTH = 128
+
+
+def format_frame(frame):
+    code = frame.f_code
+    return "%s (%s:%d)" % (code.co_name, code.co_filename, frame.f_lineno)
+
+
+class SamplingProfiler(object):
+    """Statistical profiler which samples the stack of the main thread on SIGPROF.
+
+    The timer counts the CPU time of the process, so a thread waiting for IO gets no samples.
+    Each stack is prefixed with whatever `context` returns, e.g. the name of the running event.
+    `collapsed` returns the samples in the collapsed stack format consumed by flame graph tools:
+    a line per unique stack, frames are separated by semicolons and followed by the count.
+
+    Signal handlers can be set only in the main thread, so the profiler must be started there.
+    """
+
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL, context=no_context):
+        self.interval = interval
+        self._context = context
+        self._stacks = collections.Counter()
+        self._previous_handler = None
+        self._running = False
+        self.samples = 0
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self):
+        if self._running:
+            return
+
+        self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        self._running = True
+
+    def stop(self):
+        if not self._running:
+            return
+
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler or signal.SIG_DFL)
+        self._previous_handler = None
+        self._running = False
+
+    def reset(self):
+        self._stacks.clear()
+        self.samples = 0
+
+    def collapsed(self):
+        return "".join("%s %d\n" % (stack, count) for stack, count in self._stacks.most_common())
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None and len(stack) < MAX_STACK_DEPTH:
+            stack.append(format_frame(frame))
+            frame = frame.f_back
+        stack.reverse()
+
+        context = self._context()
+        if context is not None:
+            stack.insert(0, str(context))
+        self._stacks[";".join(stack)] += 1
+        self.samples += 1
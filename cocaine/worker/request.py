@@ -20,6 +20,7 @@
 #
 
 import datetime
+import time
 
 from tornado import gen
 from tornado.queues import Queue
@@ -39,6 +40,7 @@ class Stream(object):
         self._queue = Queue()
         self._header_table = header_table
         self._current_headers = self._header_table.merge(raw_headers)
+        self.created = self.last_activity = time.time()
 
     @gen.coroutine
     def get(self, timeout=0):
@@ -56,6 +58,7 @@ class Stream(object):
 
     def push(self, item, raw_headers):
         headers = self._header_table.merge(raw_headers)
+        self.last_activity = time.time()
         self._queue.put_nowait((item, headers))
 
     def done(self, raw_headers):
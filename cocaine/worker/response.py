@@ -19,13 +19,24 @@
 #    along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
+import collections
+import mmap
+import os
+import time
 import traceback
 
+import six
+
 from ..common import CocaineErrno
 from ..common import ErrorCategory
+from ..decorators import coroutine
 from ..detail.util import valid_chunk
 from ..exceptions import InvalidChunk
 
+DEFAULT_FILE_CHUNK_SIZE = 1024 * 1024
+# how many chunks of a file may wait in the pipe write buffer
+MAX_PENDING_FILE_CHUNKS = 2
+
 
 def try_and_close(func):
     def wrapper(self, *args, **kwargs):
@@ -39,12 +50,35 @@ def try_and_close(func):
 
 
 class ResponseStream(object):
-    def __init__(self, session, worker, event_name=""):
+    """Outgoing stream of an invoke session.
+
+    With a non zero `buffer_size` small chunks are coalesced and sent as a single `write`
+    frame once `buffer_size` bytes are collected, `flush_timeout` seconds have passed since
+    the first buffered chunk, or the stream is flushed, closed or errored. Text chunks are
+    encoded to UTF-8 when they are coalesced.
+
+    Latency, sent bytes and errors are recorded into `metrics`, if it's given.
+    """
+
+    def __init__(self, session, worker, event_name="", buffer_size=0, flush_timeout=0, metrics=None):
         self._closed = False
         self.worker = worker
         self.session = session
         self.event = event_name
 
+        self._buffer_size = buffer_size
+        self._flush_timeout = flush_timeout
+        self._buffer = []
+        self._buffered = 0
+        self._flush_handle = None
+        self.created = self.last_activity = time.time()
+
+        self._metrics = metrics
+        self._first_chunk = True
+        if metrics is not None:
+            metrics.invokes += 1
+            metrics.inflight += 1
+
     def __enter__(self):
         return self
 
@@ -55,22 +89,163 @@ class ResponseStream(object):
             self.close()
 
     def write(self, chunk):
+        """Sends the chunk or buffers it.
+
+        Returns the future of the pipe write if the chunk has been sent right away, it's
+        resolved when the chunk is flushed to the socket.
+        """
         if not valid_chunk(chunk):
             raise InvalidChunk()
 
         if not self._closed:
-            self.worker.send_chunk(self.session, chunk)
-            return
+            self.last_activity = time.time()
+            if self._buffer_size > 0:
+                return self._buffer_chunk(chunk)
+            return self._send(chunk)
 
         traceback.print_stack()  # pragma: no cover
 
+    @coroutine
+    def write_file(self, path_or_fd, offset=0, length=None, chunk_size=DEFAULT_FILE_CHUNK_SIZE):
+        """Streams a file region as a sequence of `write` chunks.
+
+        The file is memory mapped, so it's never read into memory as a whole. The returned
+        future is resolved when all chunks are handed to the pipe. The next chunk isn't
+        produced until the pipe write buffer holds less than `MAX_PENDING_FILE_CHUNKS`
+        chunks, so peak memory usage doesn't depend on the file size.
+
+        :param path_or_fd: Path to a file or an open file descriptor. The descriptor is not closed.
+        :param offset: Offset of the region in bytes.
+        :param length: Length of the region in bytes, up to the end of the file by default.
+        :param chunk_size: Size of a single `write` chunk.
+        """
+        if self._closed:
+            traceback.print_stack()  # pragma: no cover
+            return
+
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be greater than 0")
+
+        self.flush()
+        owned = not isinstance(path_or_fd, six.integer_types)
+        fd = os.open(path_or_fd, os.O_RDONLY) if owned else path_or_fd
+
+        try:
+            size = os.fstat(fd).st_size
+            if length is None:
+                length = size - offset
+            if offset < 0 or length < 0 or offset + length > size:
+                raise ValueError("region %d:%d is out of the file of size %d" % (offset, length, size))
+            if length == 0:
+                return
+
+            # mmap offset must be a multiple of the allocation granularity
+            start = offset - offset % mmap.ALLOCATIONGRANULARITY
+            mapped = mmap.mmap(fd, offset - start + length, access=mmap.ACCESS_READ, offset=start)
+            view = None
+            try:
+                try:
+                    view = memoryview(mapped)
+                except TypeError:  # pragma: no cover
+                    # python 2 mmap doesn't support the new buffer protocol
+                    view = mapped
+
+                pending = collections.deque()
+                position, end = offset - start, offset - start + length
+                while position < end and not self._closed:
+                    future = self._send(view[position:min(position + chunk_size, end)])
+                    self.last_activity = time.time()
+                    position += chunk_size
+                    if future is not None:
+                        pending.append(future)
+                    if len(pending) >= MAX_PENDING_FILE_CHUNKS:
+                        yield pending.popleft()
+
+                # the pipe refers to the slices of the mapping until they are written
+                while pending:
+                    yield pending.popleft()
+            finally:
+                view = None
+                try:
+                    mapped.close()
+                except BufferError:
+                    # a failed write has left slices in the pipe,
+                    # the mapping is released along with them
+                    pass
+        finally:
+            if owned:
+                os.close(fd)
+
+    def flush(self):
+        """Sends buffered chunks right away"""
+        if self._flush_handle is not None:
+            self.worker.io_loop.remove_timeout(self._flush_handle)
+            self._flush_handle = None
+
+        if not self._buffer:
+            return
+
+        if len(self._buffer) == 1:
+            data = self._buffer[0]
+        else:
+            data = b"".join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        self._send(data)
+
+    def _buffer_chunk(self, chunk):
+        if isinstance(chunk, six.text_type):
+            chunk = chunk.encode("utf-8")
+
+        if len(chunk) >= self._buffer_size:
+            # there is no point in copying big chunks
+            self.flush()
+            return self._send(chunk)
+
+        self._buffer.append(chunk)
+        self._buffered += len(chunk)
+        if self._buffered >= self._buffer_size:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = self.worker.io_loop.call_later(self._flush_timeout, self._on_flush_timeout)
+
+    def _send(self, data):
+        if self._metrics is not None:
+            if self._first_chunk:
+                self._first_chunk = False
+                self._metrics.first_chunk.observe(time.time() - self.created)
+            self._metrics.bytes_out += len(data)
+        return self.worker.send_chunk(self.session, data)
+
+    def _finish(self, code=None):
+        if self._metrics is None:
+            return
+
+        self._metrics.inflight -= 1
+        self._metrics.latency.observe(time.time() - self.created)
+        if code is not None:
+            self._metrics.errors[code] += 1
+
+    def _on_flush_timeout(self):
+        self._flush_handle = None
+        if not self._closed:
+            self.flush()
+
     @try_and_close
     def close(self):
-        self.worker.send_choke(self.session)
+        try:
+            self.flush()
+            self.worker.send_choke(self.session)
+        finally:
+            self._finish()
 
     @try_and_close
     def error(self, code, message):
-        self.worker.send_error(self.session, ErrorCategory.CFRAMEWORKCATEGORY, code, message)
+        try:
+            self.flush()
+            self.worker.send_error(self.session, ErrorCategory.CFRAMEWORKCATEGORY, code, message)
+        finally:
+            self._finish(code)
 
     @property
     def closed(self):
@@ -0,0 +1,113 @@
+#
+#    Copyright (c) 2012+ Anton Tyurin <noxiouz@yandex.ru>
+#    Copyright (c) 2013+ Evgeny Safronov <division494@gmail.com>
+#    Copyright (c) 2011-2014 Other contributors as noted in the AUTHORS file.
+#
+#    This file is part of Cocaine.
+#
+#    Cocaine is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Cocaine is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from ..detail.iotimer import Timer
+
+
+DEFAULT_LAG_INTERVAL = 0.1
+
+log = logging.getLogger("cocaine.worker")
+
+
+def no_context():
+    return None
+
+
+class LagMonitor(object):
+    """Measures the IOLoop scheduling lag and reports handlers blocking the loop.
+
+    A periodic callback on the loop notes the time it has been run at, a helper thread checks
+    that note every `interval` seconds. If the loop hasn't run the callback for more than
+    `threshold` seconds, the helper thread logs the stack of the loop thread together with
+    whatever `context` returns, e.g. the event name and session of the running handler.
+    """
+
+    def __init__(self, threshold, interval=DEFAULT_LAG_INTERVAL, context=no_context, io_loop=None):
+        self.threshold = threshold
+        self.interval = interval
+        self._context = context
+        self._timer = Timer(self._tick, interval, io_loop)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._watch, name="lagmonitor")
+        self._thread.daemon = True
+
+        self._loop_thread = None
+        self._last_tick = None
+        self._blocked_since = None
+
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.blocked = 0
+
+    def start(self):
+        self._last_tick = time.time()
+        self._timer.start()
+        self._thread.start()
+
+    def stop(self):
+        self._timer.stop()
+        self._stopped.set()
+
+    def stats(self):
+        return {
+            "lag": self.lag,
+            "max_lag": self.max_lag,
+            "blocked": self.blocked,
+        }
+
+    def _tick(self):
+        now = time.time()
+        if self._loop_thread is None:
+            self._loop_thread = threading.current_thread().ident
+
+        if self._last_tick is not None:
+            self.lag = max(now - self._last_tick - self.interval, 0.0)
+            self.max_lag = max(self.max_lag, self.lag)
+        self._last_tick = now
+
+        if self._blocked_since is not None:
+            log.warning("event loop has been unblocked after %.3fs", now - self._blocked_since)
+            self._blocked_since = None
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            last_tick = self._last_tick
+            if last_tick is None or self._blocked_since is not None:
+                continue
+
+            now = time.time()
+            if now - last_tick - self.interval > self.threshold:
+                self._blocked_since = last_tick
+                self.blocked += 1
+                self._report(now - last_tick)
+
+    def _report(self, blocked_for):
+        frame = sys._current_frames().get(self._loop_thread)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else "unavailable"
+        log.warning("event loop has been blocked for %.3fs, running handler: %s\n%s",
+                    blocked_for, self._context(), stack)
@@ -18,35 +18,61 @@
 #    You should have received a copy of the GNU Lesser General Public License
 #    along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
+import collections
+import contextlib
+import datetime
+import functools
 import logging
+import os
+import signal
 import socket
+import tempfile
 import warnings
 
 import six
 
 from tornado import gen
+from tornado.concurrent import is_future
 from tornado.ioloop import IOLoop
 from tornado.iostream import IOStream
+from tornado.locks import Event
+from tornado.stack_context import StackContext
 
 from .disowntimer import DisownTimer
 from .message import Message
 from .message import RPC
 from .message import RPCv1
 from .message import packv1
+from .message import packv1_buffers
+from .profiler import DEFAULT_SAMPLE_INTERVAL
+from .profiler import SamplingProfiler
 from .request import RequestStream
 from .response import ResponseStream
+from .watchdog import DEFAULT_LAG_INTERVAL
+from .watchdog import LagMonitor
 from ..common import CocaineErrno
+from ..common import ErrorCategory
 from ..decorators import coroutine
 from ..detail.defaults import Defaults
 from ..detail.headers import CocaineHeaders
 from ..detail.iotimer import Timer
 from ..detail.log import workerlog
-from ..detail.util import msgpack_unpacker
-from ..services import Service
+from ..detail.metrics import EventMetrics
+from ..detail.metrics import prometheus_text
+from ..detail.metrics import services_snapshot
+from ..detail.reaper import SessionReaper
+from ..detail.util import DEFAULT_MAX_BUFFER_SIZE
+from ..detail.util import FrameUnpacker
+from ..detail.util import UNPACK_ERRORS
+from ..detail.util import msgpack_packb
+from ..detail.util import write_buffers
 
 
 DEFAULT_HEARTBEAT_TIMEOUT = 20
 DEFAULT_DISOWN_TIMEOUT = 5
+DEFAULT_RESPONSE_FLUSH_TIMEOUT = 0.05
+# it must be less than the startup timeout of the runtime
+DEFAULT_WARMUP_TIMEOUT = 5
 
 
 log = logging.getLogger('cocaine')
@@ -76,6 +102,9 @@ class TicketVendingMachineTokenManager(TokenManager):
         if loop:
             warnings.warn('loop argument is deprecated.', DeprecationWarning)
         loop = loop or IOLoop.current()
+        # services are imported on demand, most of apps don't use TVM
+        from ..services import Service
+
         self._name = name
         self._ticket = ticket
         self._service = Service('tvm')
@@ -117,7 +146,13 @@ def make_token_manager(name, token, loop=None):
 class BasicWorker(object):
     def __init__(self, disown_timeout=DEFAULT_DISOWN_TIMEOUT,
                  heartbeat_timeout=DEFAULT_HEARTBEAT_TIMEOUT,
-                 io_loop=None, app=None, uuid=None, endpoint=None):
+                 io_loop=None, app=None, uuid=None, endpoint=None,
+                 response_buffer_size=0, response_flush_timeout=DEFAULT_RESPONSE_FLUSH_TIMEOUT,
+                 max_buffer_size=DEFAULT_MAX_BUFFER_SIZE, zero_copy_threshold=0,
+                 drain_timeout=0, handler_timeout=None, session_idle_timeout=None,
+                 lag_threshold=None, lag_interval=DEFAULT_LAG_INTERVAL, metrics_event=None,
+                 prometheus_event=None, profiler_event=None, profiler_signal=None,
+                 profiler_interval=DEFAULT_SAMPLE_INTERVAL):
         if heartbeat_timeout < disown_timeout:
             raise ValueError("heartbeat timeout must be greater than disown")
 
@@ -135,7 +170,8 @@ class BasicWorker(object):
         )
 
         self.pipe = None
-        self.buffer = msgpack_unpacker()
+        # chunks not smaller than zero_copy_threshold are passed to handlers as memoryview
+        self.buffer = FrameUnpacker(max_buffer_size, zero_copy_threshold)
 
         self.disown_timer = Timer(self.on_disown, disown_timeout, self.io_loop)
 
@@ -149,8 +185,46 @@ class BasicWorker(object):
 
         # storehouse for sessions
         self.sessions = {}
+        # responses of handlers which are still running
+        self._inflight = {}
+        # on terminate running handlers are given up to drain_timeout seconds to finish
+        self.drain_timeout = drain_timeout
+        self._draining = False
+        # lifespan startup error of an asgi handler, run raises it
+        self._startup_error = None
+        self._drained = Event()
+        # default time limit for handlers in seconds, None disables it
+        self.handler_timeout = handler_timeout
+        self._timeouts = collections.Counter()
+        # sessions idle for session_idle_timeout seconds are dropped
+        self._reaper = SessionReaper(self.sessions, self._on_session_reaped,
+                                     idle_timeout=session_idle_timeout,
+                                     activity=self._session_activity,
+                                     io_loop=self.io_loop)
+
+        # (event, session) of the handler which is being run by the loop right now,
+        # it's tracked for the lag monitor and the profiler only
+        self._active = None
+        # reports handlers which block the loop for more than lag_threshold seconds
+        self.lag_monitor = None
+        if lag_threshold:
+            self.lag_monitor = LagMonitor(lag_threshold, lag_interval,
+                                          context=lambda: self._active, io_loop=self.io_loop)
+        # samples stacks of handlers, toggled by profiler_event or profiler_signal
+        self.profiler = None
+        self.profiler_signal = profiler_signal
+        if profiler_event or profiler_signal:
+            self.profiler = SamplingProfiler(profiler_interval, context=self._active_event)
         # handlers for events
         self._events = {}
+        # per event settings passed to `on`
+        self._event_options = {}
+        # latency and throughput of handlers by event name
+        self._metrics = {}
+
+        # coalescing of small response chunks, 0 disables it
+        self.response_buffer_size = response_buffer_size
+        self.response_flush_timeout = response_flush_timeout
 
         # avoid unnecessary dublicate packing of message
         self._heartbeat_msg = Message(RPC.HEARTBEAT, 1).pack()
@@ -160,6 +234,14 @@ class BasicWorker(object):
             'rx': CocaineHeaders(),
         }
 
+        # reserved events which reply with the worker and service statistics
+        if metrics_event:
+            self.on(metrics_event, self._send_metrics, buffered=False)
+        if prometheus_event:
+            self.on(prometheus_event, self._send_prometheus_metrics, buffered=False)
+        if profiler_event:
+            self.on(profiler_event, self._toggle_profiler, buffered=False)
+
     @coroutine
     def async_connect(self):
         sock = socket.socket(socket.AF_UNIX)
@@ -181,6 +263,9 @@ class BasicWorker(object):
         self.do_heartbeat()
         # start heartbeat timer
         self.heartbeat_timer.start()
+        self._reaper.start()
+        if self.lag_monitor is not None:
+            self.lag_monitor.start()
         workerlog.debug("start threaded_disown_timer")
         self.threaded_disown_timer.start()
 
@@ -188,22 +273,110 @@ class BasicWorker(object):
     def token(self):
         return self._token_manager.token()
 
-    def run(self, binds=None):
+    def run(self, binds=None, services=None, warmup=None, warmup_timeout=DEFAULT_WARMUP_TIMEOUT):
+        """Attaches handlers, connects to the runtime and runs the IOLoop.
+
+        :param binds: Dict of handlers by event name.
+        :param services: Services to be resolved and connected before the handshake.
+        :param warmup: Callables to be called before the handshake, e.g. to fill caches.
+          Coroutines are run concurrently with each other and with services connection.
+          Lifespan startups of the `asgi` handlers are added to them. If one of them fails,
+          the worker stops without the handshake and the error is raised.
+        :param warmup_timeout: Time limit of the services connection and warmup in seconds.
+          The handshake is sent when it expires, even if the warmup hasn't finished.
+        """
         if binds is None:
             binds = {}
         # attach handlers
+        warmup = list(warmup or ())
+        lifespans = list()
         for event, handler in six.iteritems(binds):
             self.on(event, handler)
+            lifespan = getattr(handler, "lifespan", None)
+            if lifespan is not None and lifespan not in lifespans:
+                lifespans.append(lifespan)
+                warmup.append(lifespan.startup)
+
+        if self.profiler_signal:
+            signal.signal(self.profiler_signal, self._on_profiler_signal)
 
         # schedule connection establishment
-        self.async_connect()
+        if services or warmup:
+            self.io_loop.add_future(self.warmup(services or (), warmup, warmup_timeout),
+                                    lambda _: self._on_warmed_up(lifespans))
+        else:
+            self.async_connect()
 
         self.io_loop.start()
+        if self._startup_error is not None:
+            raise self._startup_error
+
+    def _on_warmed_up(self, lifespans):
+        for lifespan in lifespans:
+            if lifespan.startup_error is not None:
+                workerlog.error("application startup has failed: %s", lifespan.startup_error)
+                self._startup_error = lifespan.startup_error
+                self._stop()
+                return
+        self.async_connect()
 
-    def on(self, event_name, event_handler):
+    @coroutine
+    def warmup(self, services=(), callables=(), timeout=DEFAULT_WARMUP_TIMEOUT):
+        """Connects services and calls warmup callables, waiting for them up to `timeout` seconds.
+
+        Failures are logged and don't stop the rest. Returns the number of items which
+        have succeeded in time.
+        """
+        started = self.io_loop.time()
+        futures = [self._warmup_step("connect to %s" % service.name, service.connect)
+                   for service in services]
+        futures.extend(self._warmup_step("warmup %s" % getattr(func, "__name__", func), func)
+                       for func in callables)
+        if not futures:
+            raise gen.Return(0)
+
+        workerlog.info("warming up %d services and %d callables", len(services), len(callables))
+        try:
+            results = yield gen.with_timeout(datetime.timedelta(seconds=timeout), gen.multi(futures))
+        except gen.TimeoutError:
+            results = [future.result() if future.done() else None for future in futures]
+            workerlog.warning("warmup has not finished in %.3fs, %d of %d items are pending",
+                              timeout, results.count(None), len(results))
+
+        succeeded = results.count(True)
+        workerlog.info("warmup has taken %.3fs, %d of %d items have succeeded",
+                       self.io_loop.time() - started, succeeded, len(futures))
+        raise gen.Return(succeeded)
+
+    @coroutine
+    def _warmup_step(self, name, func):
+        try:
+            result = yield coroutine(func)()
+            if is_future(result):
+                # func is a coroutine itself
+                yield result
+        except Exception as err:
+            workerlog.error("failed to %s: %s", name, err)
+            raise gen.Return(False)
+        raise gen.Return(True)
+
+    def on(self, event_name, event_handler, buffered=True, timeout=None):
+        """Attaches the handler to the event.
+
+        Pass `buffered=False` to send every response chunk as soon as it's written, even if
+        the worker coalesces them by default. It's useful for latency sensitive events.
+
+        `timeout` limits the handler run time in seconds, the worker `handler_timeout` is
+        used by default and 0 turns it off. A timed out session is closed with ETIMEOUT error.
+        """
         event_name = six.b(event_name)
         workerlog.info("registering handler for event %s", event_name)
         self._events[event_name] = coroutine(event_handler)
+        self._event_options[event_name] = {
+            'buffered': buffered,
+            'timeout': timeout,
+        }
+        self._metrics.setdefault(event_name, EventMetrics())
         workerlog.info("handler for event %s has been attached", event_name)
 
     # Events
@@ -220,8 +393,15 @@ class BasicWorker(object):
     # General dispatch method
     def on_message(self, data):
         workerlog.debug("on_message %.300s", data)
-        self.buffer.feed(data)
-        for i in self.buffer:
+        try:
+            self.buffer.feed(data)
+            messages = list(self.buffer)
+        except UNPACK_ERRORS as err:
+            workerlog.error("unable to unpack incoming frame: %s", err)
+            self.on_failure()
+            return
+
+        for i in messages:
             workerlog.debug("unpacked %.300s", i)
             try:
                 self.feed_message(i)
@@ -237,38 +417,198 @@ class BasicWorker(object):
         workerlog.info("terminate has been received %s %s", msg.errno, msg.reason)
         self.terminate(msg.errno, msg.reason)
 
+    def _make_response(self, session, event):
+        options = self._event_options.get(event, {})
+        metrics = self._metrics.get(event)
+        if options.get('buffered', True):
+            return ResponseStream(session, self, event,
+                                  buffer_size=self.response_buffer_size,
+                                  flush_timeout=self.response_flush_timeout,
+                                  metrics=metrics)
+        return ResponseStream(session, self, event, metrics=metrics)
+
     def _dispatch_invoke(self, msg, headers):
-        response = ResponseStream(msg.session, self, msg.event)
+        response = self._make_response(msg.session, msg.event)
+        if self._draining:
+            workerlog.warning("reject invoke of %s, the worker is draining", msg.event)
+            response.error(CocaineErrno.ESHUTDOWN, "worker is shutting down")
+            return
+
         try:
             workerlog.debug("invoke has been received %s", msg)
             request = RequestStream(headers, self._header_table['rx'])
             event_handler = self._events.get(msg.event)
             self.sessions[msg.session] = request
 
+            timeout = self._event_options.get(msg.event, {}).get('timeout')
+            if timeout is None:
+                timeout = self.handler_timeout
+
             @coroutine
             def start():
-                if event_handler is not None:
-                    future = event_handler(request, response)
-                else:
-                    future = self.fallback_handler(msg.event, request, response)
-
+                self._inflight[msg.session] = response
+                timeout_handle = None
+                if timeout:
+                    timeout_handle = self.io_loop.call_later(
+                        timeout, self._on_handler_timeout, msg.event, msg.session, timeout)
                 try:
-                    yield future
-                    if not response.closed:
-                        response.close()
-                except Exception as err:
-                    response.error(CocaineErrno.EUNCAUGHTEXCEPTION, str(err))
-
-            start()
+                    if event_handler is not None:
+                        future = event_handler(request, response)
+                    else:
+                        future = self.fallback_handler(msg.event, request, response)
+
+                    try:
+                        yield future
+                        if not response.closed:
+                            response.close()
+                    except Exception as err:
+                        response.error(CocaineErrno.EUNCAUGHTEXCEPTION, str(err))
+                finally:
+                    if timeout_handle is not None:
+                        self.io_loop.remove_timeout(timeout_handle)
+                    self._finish_session(msg.session)
+
+            if self.lag_monitor is None and self.profiler is None:
+                start()
+            else:
+                # the context is entered every time the loop runs the handler
+                with StackContext(functools.partial(self._activate, msg.event, msg.session)):
+                    start()
         except Exception as err:
             workerlog.exception("failed to invoke %s %s %s", msg.event, err, type(err))
             response.error(CocaineErrno.EINVFAILED, "failed to invoke %s" % err)
 
+    def _on_handler_timeout(self, event, session, timeout):
+        response = self._inflight.get(session)
+        if response is None:
+            return
+
+        workerlog.warning("handler of %s has timed out after %.3fs, session %d",
+                          event, timeout, session)
+        self._timeouts[event] += 1
+        reason = "handler has timed out after %.3fs" % timeout
+        response.error(CocaineErrno.ETIMEOUT, reason)
+        # wake up the handler if it's waiting for the next chunk
+        request = self.sessions.pop(session, None)
+        if request is not None:
+            request.error((ErrorCategory.CFRAMEWORKCATEGORY, CocaineErrno.ETIMEOUT), reason, None)
+        self._finish_session(session)
+
+    @property
+    def timeouts(self):
+        """Number of timed out sessions by event name"""
+        return dict(self._timeouts)
+
+    @contextlib.contextmanager
+    def _activate(self, event, session):
+        previous, self._active = self._active, (event, session)
+        try:
+            yield
+        finally:
+            self._active = previous
+
+    @property
+    def active(self):
+        """Returns a tuple of the event name and session of the running handler or None.
+
+        It's tracked only if the lag monitor or the profiler is enabled.
+        """
+        return self._active
+
+    def _active_event(self):
+        if self._active is None:
+            return None
+        event = self._active[0]
+        return "event:%s" % (event if six.PY2 else event.decode("latin-1"))
+
+    def _toggle_profiler(self, request, response):
+        """Starts the profiler or stops it and replies with the collapsed stacks"""
+        if not self.profiler.running:
+            self.profiler.reset()
+            self.profiler.start()
+            response.write("profiler has been started")
+        else:
+            self.profiler.stop()
+            response.write(self.profiler.collapsed())
+
+    def _on_profiler_signal(self, signum, frame):
+        self.io_loop.add_callback_from_signal(self._toggle_profiler_by_signal)
+
+    def _toggle_profiler_by_signal(self):
+        if not self.profiler.running:
+            self.profiler.reset()
+            self.profiler.start()
+            workerlog.info("profiler has been started")
+            return
+
+        self.profiler.stop()
+        path = os.path.join(tempfile.gettempdir(), "cocaine-profile-%s-%d.txt" % (self.appname, os.getpid()))
+        try:
+            with open(path, "w") as output:
+                output.write(self.profiler.collapsed())
+        except (IOError, OSError) as err:
+            workerlog.error("unable to save profile to %s: %s", path, err)
+            return
+        workerlog.info("profiler has been stopped, %d samples are saved to %s", self.profiler.samples, path)
+
+    def event_stats(self):
+        """Returns latency histograms, in-flight sessions, errors and traffic by event name.
+
+        Histogram buckets are given as a list of `[upper bound in seconds, count]` pairs,
+        errors are counted by CocaineErrno.
+        """
+        return dict((event if six.PY2 else event.decode("latin-1"), metrics.snapshot())
+                    for event, metrics in six.iteritems(self._metrics))
+
+    def stats(self):
+        """Returns all statistics of the worker, `metrics_event` replies with it packed by msgpack"""
+        stats = {
+            "events": self.event_stats(),
+            "sessions": self.session_stats(),
+            "inflight": self.inflight,
+            "services": services_snapshot(),
+        }
+        if self.lag_monitor is not None:
+            stats["lag"] = self.lag_monitor.stats()
+        return stats
+
+    def _send_metrics(self, request, response):
+        response.write(msgpack_packb(self.stats()))
+
+    def _send_prometheus_metrics(self, request, response):
+        response.write(prometheus_text(self._metrics))
+
+    def _session_activity(self, session, request):
+        response = self._inflight.get(session)
+        if response is None:
+            return request.last_activity
+        return max(request.last_activity, response.last_activity)
+
+    def _on_session_reaped(self, session, request):
+        reason = "session has been idle for more than %.3fs" % self._reaper.idle_timeout
+        request.error((ErrorCategory.CFRAMEWORKCATEGORY, CocaineErrno.ETIMEOUT), reason, None)
+        response = self._inflight.get(session)
+        if response is not None:
+            response.error(CocaineErrno.ETIMEOUT, reason)
+        self._finish_session(session)
+
+    def session_stats(self):
+        """Returns the number of sessions, their age distribution and the number of reaped ones"""
+        return self._reaper.stats()
+
+    def _finish_session(self, session):
+        self._inflight.pop(session, None)
+        if self._draining and not self._inflight:
+            self._drained.set()
+
     def _dispatch_chunk(self, msg, headers):
         workerlog.debug("chunk has been received %d", msg.session)
         try:
             session = self.sessions[msg.session]
             session.push(msg.data, headers)
+            response = self._inflight.get(msg.session)
+            if response is not None and response.event in self._metrics:
+                self._metrics[response.event].bytes_in += len(msg.data)
         except KeyError as err:
             workerlog.warning("no session %s", err)
 
@@ -312,15 +652,59 @@ class BasicWorker(object):
         raise NotImplementedError  # pragma: no cover
 
     def terminate(self, code, reason):
+        if self._draining:
+            return
+
+        if self.drain_timeout <= 0 or not self._inflight:
+            self._terminate(code, reason)
+            return
+
+        self.io_loop.add_future(self.drain(self.drain_timeout),
+                                lambda _: self._terminate(code, reason))
+
+    def _terminate(self, code, reason):
         self.send_terminate(code, reason)
         self._stop()
 
+    @coroutine
+    def drain(self, timeout):
+        """Stops accepting invokes and waits up to `timeout` seconds for running handlers.
+
+        Sessions of handlers which haven't finished in time are aborted with an error.
+        Returns a tuple of the completed and aborted sessions count.
+        """
+        self._draining = True
+        running = len(self._inflight)
+        workerlog.info("draining %d running sessions for %.3fs", running, timeout)
+        if self._inflight:
+            try:
+                yield self._drained.wait(datetime.timedelta(seconds=timeout))
+            except gen.TimeoutError:
+                pass
+
+        aborted = len(self._inflight)
+        while self._inflight:
+            _, response = self._inflight.popitem()
+            response.error(CocaineErrno.ESHUTDOWN, "worker has been terminated")
+        workerlog.info("sessions have been drained: %d completed, %d aborted",
+                       running - aborted, aborted)
+        raise gen.Return((running - aborted, aborted))
+
+    @property
+    def inflight(self):
+        return len(self._inflight)
+
     def do_heartbeat(self):
         self.disown_timer.start()
         workerlog.debug("heartbeat has been sent. Start disown timer")
         self.send_heartbeat()
 
     def _stop(self):
+        self._reaper.stop()
+        if self.profiler is not None:
+            self.profiler.stop()
+        if self.lag_monitor is not None:
+            self.lag_monitor.stop()
         self.threaded_disown_timer.stop()
         self.io_loop.stop()
 
@@ -344,7 +728,7 @@ class WorkerV1(BasicWorker):
         self.pipe.write(packv1(session, RPCv1.CLOSE))
 
     def send_chunk(self, session, data):
-        self.pipe.write(packv1(session, RPCv1.WRITE, data))
+        return write_buffers(self.pipe, packv1_buffers(session, RPCv1.WRITE, data))
 
     def send_error(self, session, category, code, msg):
         self.pipe.write(packv1(session, RPCv1.ERROR, (category, code), msg))
@@ -19,11 +19,39 @@
 #    along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
+import os
+import subprocess
+import sys
+import threading
+import zlib
+
+import msgpack
+from nose import tools
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+from cocaine.decorators import Router
+from cocaine.decorators import asgi
+from cocaine.decorators import http
+from cocaine.decorators import http_cache
+from cocaine.decorators import wsgi
+from cocaine.decorators.cache import ResponseCache
+from cocaine.decorators.cache import _Entry
 
 from cocaine.decorators.http_dec import (
+    choose_encoding,
     format_http_version,
-    _HTTPRequest
+    HTTPPatchedRequest,
+    StreamingHTTPRequest,
+    _HTTPRequest,
+    _HTTPResponse
 )
+from cocaine.decorators.multipart import MultipartParser
+from cocaine.decorators.wsgi import _ThreadedResponse, _run_application, wsgi_environ
+from cocaine.detail.headers import CocaineHeaders
+from cocaine.futures.threadpool import ThreadPoolExecutor
+from cocaine.worker.request import RequestStream
 
 
 def test_format_http_version():
@@ -31,3 +59,501 @@ def test_format_http_version():
     tornado_style = "HTTP/1.1"
     assert format_http_version(the_void_style)\
         == format_http_version(tornado_style) == "HTTP/1.1"
+
+
+def test_http_decorators_are_imported_lazily():
+    if sys.version_info < (3, 7):
+        return
+
+    code = ("import sys, cocaine.worker; "
+            "assert 'cocaine.decorators.http_dec' not in sys.modules; "
+            "assert 'tornado.wsgi' not in sys.modules; "
+            "from cocaine.decorators import http; "
+            "assert 'cocaine.decorators.http_dec' in sys.modules")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.check_call([sys.executable, "-c", code], cwd=root)
+
+
+def test_http_request_is_parsed_lazily():
+    headers = [("Host", "example.com"),
+               ("Cookie", "session=abc"),
+               ("Content-Type", "application/x-www-form-urlencoded")]
+    data = msgpack.packb(["POST", "/path/to?arg=1", "1.1", headers, b"form=2"])
+    req = _HTTPRequest(None, data)
+    assert req._headers is None and req._meta is None and req._request is None
+
+    assert req.path == "/path/to", req.path
+    assert req._headers is None and req._meta is None
+
+    assert req.request == {"arg": "1", "form": b"2"}, req.request
+    assert req.files == {}
+    assert req._meta is None
+
+    assert req.meta["method"] == "POST"
+    assert req.meta["host"] == "example.com"
+    assert req.meta["query_string"] == "arg=1"
+    assert req.meta["parsed_cookies"] == {"session": "abc"}, req.meta
+    assert req.meta is req.meta
+
+
+MULTIPART_BODY = (b"preamble\r\n"
+                  b"--XyZ\r\n"
+                  b"Content-Disposition: form-data; name=\"title\"\r\n"
+                  b"\r\n"
+                  b"hello\r\n"
+                  b"--XyZ\r\n"
+                  b"Content-Disposition: form-data; name=\"upload\"; filename=\"a.bin\"\r\n"
+                  b"Content-Type: application/octet-stream\r\n"
+                  b"\r\n" +
+                  b"\r\n--XY" * 1000 +
+                  b"\r\n--XyZ--\r\n"
+                  b"epilogue")
+
+
+def test_multipart_parser_by_chunks():
+    for size in (1, 7, 1024, len(MULTIPART_BODY)):
+        parser = MultipartParser(b"XyZ", spool_threshold=1024)
+        for i in range(0, len(MULTIPART_BODY), size):
+            parser.feed(MULTIPART_BODY[i:i + size])
+        parser.close()
+
+        assert parser.arguments == {"title": [b"hello"]}, parser.arguments
+        upload = parser.files["upload"][0]
+        assert upload.filename == "a.bin" and upload.content_type == "application/octet-stream"
+        assert upload.size == 6000, upload
+        # it's been spooled to disk
+        assert upload.file._rolled
+        assert upload.read() == b"\r\n--XY" * 1000
+
+
+@tools.raises(ValueError)
+def test_multipart_parser_incomplete():
+    parser = MultipartParser(b"XyZ")
+    parser.feed(MULTIPART_BODY[:100])
+    parser.close()
+
+
+def test_streaming_http_request():
+    headers = [("Content-Type", "multipart/form-data; boundary=XyZ")]
+    stream = RequestStream(None, CocaineHeaders())
+    stream.push(msgpack.packb(["POST", "/upload?arg=1", "1.1", headers, MULTIPART_BODY[:50]]), None)
+    for i in range(50, len(MULTIPART_BODY), 1000):
+        stream.push(MULTIPART_BODY[i:i + 1000], None)
+    stream.close(None)
+
+    request = StreamingHTTPRequest(stream, spool_threshold=1024)
+    head = IOLoop.current().run_sync(request.read)
+    assert head.path == "/upload" and head.body == b""
+    args, files = IOLoop.current().run_sync(request.read_form)
+    assert args == {"arg": "1", "title": b"hello"}, args
+    assert files["upload"][0].size == 6000
+
+
+def test_choose_encoding():
+    assert choose_encoding("") is None
+    assert choose_encoding("br") is None
+    assert choose_encoding("deflate, gzip") == "gzip"
+    assert choose_encoding("gzip;q=0.5, deflate") == "deflate"
+    assert choose_encoding("gzip;q=0, *") == "deflate"
+    assert choose_encoding("*;q=0") is None
+
+
+class FakeStream(object):
+    event = "http"
+
+    def __init__(self):
+        self.written = list()
+        self.closed = False
+
+    def write(self, data):
+        self.written.append(data)
+
+    def close(self):
+        self.closed = True
+
+
+def make_compressed_response(accept_encoding, **kwargs):
+    request = HTTPPatchedRequest(None)
+    data = msgpack.packb(["GET", "/", "1.1", [("Accept-Encoding", accept_encoding)], b""])
+    request.head = _HTTPRequest(None, data)
+    stream = FakeStream()
+    return _HTTPResponse(stream, request, compress=True, **kwargs), stream
+
+
+def test_http_response_compression():
+    response, stream = make_compressed_response("gzip", compress_min_size=100)
+    response.write_head(200, {"Content-Type": "text/plain"})
+    assert stream.written == []
+    response.write("a" * 60)
+    response.write(b"b" * 60)
+    response.write(b"c" * 60)
+    response.close()
+
+    code, headers = msgpack.unpackb(stream.written[0], raw=False)
+    headers = dict(headers)
+    assert headers["Content-Encoding"] == "gzip" and headers["Vary"] == "Accept-Encoding", headers
+    # pending and the last chunk are flushed separately
+    assert len(stream.written) == 4, stream.written
+    body = zlib.decompress(b"".join(stream.written[1:]), 16 + zlib.MAX_WBITS)
+    assert body == b"a" * 60 + b"b" * 60 + b"c" * 60, body
+
+
+def test_http_closes_compressed_response():
+    def handler(request, response):
+        yield request.read()
+        response.write_head(200, [("Content-Type", "text/plain")])
+        response.write(b"x" * 10)
+        # no close, the decorator has to flush the head and the compressor
+
+    def call(body, method="GET"):
+        stream = RequestStream(None, CocaineHeaders())
+        stream.push(msgpack.packb([method, "/", "1.1", [("Accept-Encoding", "gzip")], b""]), None)
+        stream.close(None)
+        response = FakeStream()
+        IOLoop.current().run_sync(lambda: gen.coroutine(http(compress=True)(body))(stream, response), timeout=5)
+        assert response.closed
+        code, headers = msgpack.unpackb(response.written[0], raw=False)
+        return dict(headers), b"".join(response.written[1:])
+
+    headers, body = call(handler)
+    assert "Content-Encoding" not in headers and body == b"x" * 10, (headers, body)
+
+    def big(request, response):
+        yield request.read()
+        response.write_head(200, [])
+        response.write(b"y" * 5000)
+
+    headers, body = call(big)
+    assert headers["Content-Encoding"] == "gzip", headers
+    assert zlib.decompress(body, 16 + zlib.MAX_WBITS) == b"y" * 5000
+
+    def head(request, response):
+        yield request.read()
+        response.write_head(200, [("Content-Length", "5000")])
+
+    # HEAD responses keep Content-Length and get no body
+    headers, body = call(head, "HEAD")
+    assert headers == {"Content-Length": "5000"} and body == b"", (headers, body)
+
+
+def test_http_response_compression_thresholds():
+    response, stream = make_compressed_response("deflate", compress_min_size=100)
+    response.write_head(200, [("Content-Type", "text/plain")])
+    response.write(b"tiny")
+    response.close()
+    code, headers = msgpack.unpackb(stream.written[0], raw=False)
+    assert dict(headers) == {"Content-Type": "text/plain", "Vary": "Accept-Encoding"}, headers
+    assert stream.written[1:] == [b"tiny"]
+
+    response, stream = make_compressed_response("deflate", compress_min_size=100)
+    response.write_head(200, [("Content-Length", "1000")])
+    response.write(b"x" * 1000)
+    response.close()
+    code, headers = msgpack.unpackb(stream.written[0], raw=False)
+    assert dict(headers) == {"Vary": "Accept-Encoding", "Content-Encoding": "deflate"}, headers
+    assert zlib.decompress(b"".join(stream.written[1:])) == b"x" * 1000
+
+    response, stream = make_compressed_response("identity")
+    response.write_head(200, [("Content-Type", "text/plain")])
+    response.write(b"x" * 10000)
+    code, headers = msgpack.unpackb(stream.written[0], raw=False)
+    assert dict(headers) == {"Content-Type": "text/plain", "Vary": "Accept-Encoding"}, headers
+    assert stream.written[1] == b"x" * 10000
+
+
+def test_response_cache_lru():
+    cache = ResponseCache(max_entries=2, max_bytes=10)
+    entry = lambda size: _Entry(200, [], [b"x" * size], size, '"tag"', float("inf"))  # noqa: E731
+    cache.put("a", entry(4))
+    cache.put("b", entry(4))
+    assert cache.get("a") is not None
+    cache.put("c", entry(4))
+    # "b" is the least recently used one, the limits allow two entries
+    assert cache.get("b") is None
+    assert sorted(cache._entries) == ["a", "c"]
+    assert not cache.put("d", entry(11))
+    cache.put("d", entry(8))
+    assert list(cache._entries) == ["d"] and cache.size == 8
+    assert cache.stats()["hits"] == 1
+
+
+def test_http_cache():
+    calls = list()
+
+    @http_cache(ttl=0)
+    def cached(request, response):
+        req = yield request.read()
+        calls.append(req.path)
+        headers = [("Content-Type", "text/plain"), ("Cache-Control", "max-age=60")]
+        if req.path == "/login":
+            headers.append(("Set-Cookie", "session=user1"))
+        response.write_head(200, headers)
+        response.write(("body of %s" % req.path).encode())
+        # the response is closed by the decorator
+
+    handler = http(cached)
+
+    def call(method, url, headers=()):
+        stream = RequestStream(None, CocaineHeaders())
+        stream.push(msgpack.packb([method, url, "1.1", list(headers), b""]), None)
+        stream.close(None)
+        response = FakeStream()
+        IOLoop.current().run_sync(lambda: gen.coroutine(handler)(stream, response))
+        assert response.closed
+        code, headers = msgpack.unpackb(response.written[0], raw=False)
+        return code, dict(headers), b"".join(response.written[1:])
+
+    code, _, body = call("GET", "/a?x=1")
+    assert (code, body) == (200, b"body of /a"), body
+    code, headers, body = call("GET", "/a?x=1")
+    assert (code, body) == (200, b"body of /a"), body
+    assert calls == ["/a"], calls
+
+    code, _, body = call("GET", "/a?x=1", [("If-None-Match", headers["ETag"])])
+    assert (code, body) == (304, b""), body
+    code, _, body = call("GET", "/a?x=1", [("Cache-Control", "no-cache")])
+    assert calls == ["/a", "/a"], calls
+
+    call("GET", "/a?x=2")
+    call("POST", "/a?x=1")
+    call("POST", "/a?x=1")
+    assert calls == ["/a", "/a", "/a", "/a", "/a"], calls
+    assert cached.cache.stats()["entries"] == 2
+
+    # requests with credentials neither get nor fill the cache
+    call("GET", "/a?x=1", [("Authorization", "Basic dXNlcjpwYXNz")])
+    call("GET", "/b", [("Cookie", "session=1")])
+    assert calls == ["/a", "/a", "/a", "/a", "/a", "/a", "/b"], calls
+    assert cached.cache.stats()["entries"] == 2
+
+    # a cookie of one client isn't replayed to another one
+    _, headers, _ = call("GET", "/login")
+    assert headers["Set-Cookie"] == "session=user1"
+    call("GET", "/login")
+    assert calls[-2:] == ["/login", "/login"], calls
+    assert cached.cache.stats()["entries"] == 2
+
+
+class FlushedStream(FakeStream):
+    def __init__(self):
+        super(FlushedStream, self).__init__()
+        self.pending = list()
+        self.heads = list()
+
+    def write_head(self, code, headers):
+        self.heads.append((code, headers))
+
+    def write(self, data):
+        super(FlushedStream, self).write(data)
+        future = Future()
+        self.pending.append(future)
+        return future
+
+
+def test_wsgi_application_runs_in_thread_with_backpressure():
+    threads = list()
+    produced = list()
+
+    def application(environ, start_response):
+        threads.append(threading.current_thread())
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        for chunk in (b"a", b"b", b"c"):
+            produced.append(chunk)
+            yield chunk
+
+    stream = FlushedStream()
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    @gen.coroutine
+    def main():
+        response = _ThreadedResponse(IOLoop.current(), stream, max_pending=2)
+        future = executor.submit(_run_application, application, {}, response)
+        while len(stream.written) < 2:
+            yield gen.sleep(0.01)
+        # neither chunk is flushed, so the application waits for a free slot
+        yield gen.sleep(0.05)
+        assert stream.written == [b"a", b"b"] and produced == [b"a", b"b", b"c"], produced
+        assert not future.done()
+        stream.pending[0].set_result(None)
+        yield future
+        assert stream.written == [b"a", b"b", b"c"], stream.written
+
+    IOLoop.current().run_sync(main, timeout=5)
+    executor.shutdown()
+    assert stream.heads == [(200, [("Content-Type", "text/plain")])]
+    assert threads and threads[0] is not threading.current_thread()
+
+
+def test_wsgi_environ():
+    headers = [(b"Host", b"example.com:8080"), (b"Content-Type", b"text/plain"),
+               (b"Content-Length", b"4"), (b"X-Real-IP", b"192.0.2.1"),
+               (b"Accept", b"text/html"), (b"Accept", b"*/*")]
+    body = b"body"
+    environ = wsgi_environ(b"POST", b"/a%20b/c?x=1&y=2", b"1.1", headers, body)
+    assert environ["REQUEST_METHOD"] == "POST"
+    assert environ["PATH_INFO"] == "/a b/c" and environ["QUERY_STRING"] == "x=1&y=2", environ
+    assert environ["SERVER_PROTOCOL"] == "HTTP/1.1"
+    assert (environ["SERVER_NAME"], environ["SERVER_PORT"]) == ("example.com", "8080")
+    assert environ["REMOTE_ADDR"] == "192.0.2.1"
+    assert environ["CONTENT_TYPE"] == "text/plain" and environ["CONTENT_LENGTH"] == "4"
+    assert "HTTP_CONTENT_TYPE" not in environ
+    assert environ["HTTP_ACCEPT"] == "text/html,*/*"
+    assert environ["wsgi.input"].read() == body
+
+    environ = wsgi_environ(u"GET", u"/", u"HTTP/1.0", [], b"")
+    assert environ["PATH_INFO"] == "/" and environ["QUERY_STRING"] == ""
+    assert environ["SERVER_PROTOCOL"] == "HTTP/1.0" and environ["SERVER_PORT"] == "80"
+
+
+def test_wsgi():
+    def application(environ, start_response):
+        start_response("201 Created", [("Content-Type", "text/plain")])
+        return [environ["PATH_INFO"].encode(), environ["wsgi.input"].read()]
+
+    stream = RequestStream(None, CocaineHeaders())
+    stream.push(msgpack.packb(["PUT", "/item", "1.1", [("Content-Length", "3")], b"abc"]), None)
+    stream.close(None)
+    response = FakeStream()
+    IOLoop.current().run_sync(lambda: gen.coroutine(wsgi(application))(stream, response), timeout=5)
+
+    assert response.closed
+    code, headers = msgpack.unpackb(response.written[0], raw=False)
+    assert (code, headers) == (201, [["Content-Type", "text/plain"]]), (code, headers)
+    assert response.written[1:] == [b"/item", b"abc"], response.written
+
+
+def test_asgi():
+    received = list()
+
+    @gen.coroutine
+    def application(scope, receive, send):
+        if scope["type"] == "lifespan":
+            message = yield receive()
+            assert message["type"] == "lifespan.startup"
+            scope["state"]["db"] = "connected"
+            yield send({"type": "lifespan.startup.complete"})
+            message = yield receive()
+            assert message["type"] == "lifespan.shutdown"
+            yield send({"type": "lifespan.shutdown.complete"})
+            return
+
+        received.append(scope)
+        body = b""
+        while True:
+            message = yield receive()
+            body += message["body"]
+            if not message["more_body"]:
+                break
+        yield send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/plain")]})
+        yield send({"type": "http.response.body", "body": body, "more_body": True})
+        yield send({"type": "http.response.body", "body": scope["state"]["db"].encode()})
+
+    handler = asgi(application)
+    IOLoop.current().run_sync(handler.lifespan.startup, timeout=5)
+    assert handler.lifespan.supported
+
+    stream = RequestStream(None, CocaineHeaders())
+    headers = [("Host", "example.com"), ("X-Real-IP", "192.0.2.1")]
+    stream.push(msgpack.packb(["POST", "/a%20b?x=1", "1.1", headers, b"abc"]), None)
+    stream.push(b"def", None)
+    stream.close(None)
+    response = FakeStream()
+    IOLoop.current().run_sync(lambda: gen.coroutine(handler)(stream, response), timeout=5)
+
+    scope = received[0]
+    assert (scope["method"], scope["path"], scope["raw_path"]) == ("POST", "/a b", b"/a%20b")
+    assert scope["query_string"] == b"x=1" and scope["http_version"] == "1.1"
+    assert scope["headers"] == [(b"host", b"example.com"), (b"x-real-ip", b"192.0.2.1")], scope["headers"]
+    assert scope["client"] == ("192.0.2.1", 0)
+    assert response.closed
+    code, headers = msgpack.unpackb(response.written[0], raw=False)
+    assert (code, headers) == (200, [["content-type", "text/plain"]]), (code, headers)
+    assert response.written[1:] == [b"abcdef", b"connected"], response.written
+
+    IOLoop.current().run_sync(handler.lifespan.shutdown, timeout=5)
+
+
+def test_asgi_lifespan_is_optional():
+    @gen.coroutine
+    def application(scope, receive, send):
+        if scope["type"] != "http":
+            raise ValueError("unsupported scope %s" % scope["type"])
+        yield send({"type": "http.response.start", "status": 204})
+        yield send({"type": "http.response.body"})
+
+    handler = asgi(application)
+    IOLoop.current().run_sync(handler.lifespan.startup, timeout=5)
+    assert not handler.lifespan.supported
+    IOLoop.current().run_sync(handler.lifespan.shutdown, timeout=5)
+    assert asgi(lifespan=False)(application).lifespan is None
+
+
+@tools.raises(RuntimeError)
+def test_asgi_lifespan_startup_failed():
+    def application(scope, receive, send):
+        return send({"type": "lifespan.startup.failed", "message": "no database"})
+
+    IOLoop.current().run_sync(asgi(application).lifespan.startup, timeout=5)
+
+
+def test_router_match():
+    router = Router()
+    handler = lambda request, response: None  # noqa: E731
+    router.add("/users/me", handler)
+    router.add("/users/{id:int}", handler, methods=("GET", "put"))
+    router.add("/users/{name}/posts", handler)
+    router.add("/static/{file:path}", handler)
+    router.add("/", handler)
+    assert len(router) == 5
+
+    handlers, params = router.match("/users/42")
+    assert sorted(handlers) == ["GET", "PUT"] and params == {"id": 42}, params
+    assert router.match("/users/me")[1] == {}
+    assert router.match("/users/me/posts")[1] == {"name": "me"}
+    assert router.match("/users/j%20doe/posts")[1] == {"name": "j doe"}
+    assert router.match("/static/css/main.css")[1] == {"file": "css/main.css"}
+    assert router.match("/")[1] == {}
+    assert router.match("/users/42/comments") == (None, None)
+    assert router.match("/users") == (None, None)
+
+
+@tools.raises(ValueError)
+def test_router_conflicting_parameters():
+    router = Router()
+    router.add("/users/{id}", lambda request, response: None)
+    router.add("/users/{name}/posts", lambda request, response: None)
+
+
+@tools.raises(ValueError)
+def test_router_path_is_last():
+    Router().add("/static/{file:path}/edit", lambda request, response: None)
+
+
+def test_router_dispatch():
+    router = Router()
+
+    @router.route("/users/{id:int}", methods=["GET"])
+    def user(request, response):
+        req = yield request.read()
+        response.write_head(200, [])
+        response.write(("user %d" % req.path_params["id"]).encode())
+        response.close()
+
+    handler = http(router.dispatch)
+
+    def call(method, url):
+        stream = RequestStream(None, CocaineHeaders())
+        stream.push(msgpack.packb([method, url, "1.1", [], b""]), None)
+        stream.close(None)
+        response = FakeStream()
+        IOLoop.current().run_sync(lambda: gen.coroutine(handler)(stream, response), timeout=5)
+        assert response.closed
+        code, headers = msgpack.unpackb(response.written[0], raw=False)
+        return code, dict(headers), b"".join(response.written[1:])
+
+    assert call("GET", "/users/7?x=1") == (200, {}, b"user 7")
+    assert call("GET", "/users/x")[0] == 404
+    assert call("HEAD", "/users/7") == (200, {}, b"user 7")
+    code, headers, _ = call("POST", "/users/7")
+    assert code == 405 and headers["Allow"] == "GET, HEAD", headers
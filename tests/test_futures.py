@@ -20,12 +20,23 @@
 #
 
 
+import os
+import sys
+import threading
 import time
 
+from tornado import gen
 from tornado.ioloop import IOLoop
 
+from cocaine.exceptions import CancelledError
+from cocaine.futures import ProcessPoolExecutor
+from cocaine.futures import ThreadPoolExecutor
+from cocaine.futures import processed
+from cocaine.futures import set_default_executor
+from cocaine.futures import set_default_process_executor
 from cocaine.futures import threaded
 
+from nose import SkipTest
 from nose import tools
 
 
@@ -55,3 +66,125 @@ def test_threaded_result():
 def test_threaded_exception():
     io = IOLoop.current()
     io.run_sync(blocking_func_exception, timeout=2)
+
+
+def test_thread_pool_is_bounded():
+    pool = ThreadPoolExecutor(max_workers=2)
+    lock = threading.Event()
+
+    @gen.coroutine
+    def main():
+        futures = [pool.submit(lock.wait, 2) for _ in range(5)]
+        yield gen.sleep(0.1)
+        assert pool.workers == 2, pool.stats()
+        assert pool.active_workers == 2, pool.stats()
+        assert pool.queue_size == 3, pool.stats()
+        lock.set()
+        yield futures
+        raise gen.Return(pool.stats())
+
+    stats = IOLoop.current().run_sync(main, timeout=5)
+    assert stats["workers"] == 2, stats
+    assert stats["queued"] == 0, stats
+    pool.shutdown()
+    assert pool.workers == 0
+
+
+def test_thread_pool_cancel():
+    pool = ThreadPoolExecutor(max_workers=1)
+    lock = threading.Event()
+
+    @gen.coroutine
+    def main():
+        running = pool.submit(lock.wait, 2)
+        queued = pool.submit(lambda: "NEVER")
+        yield gen.sleep(0.1)
+        assert not pool.cancel(running)
+        assert pool.cancel(queued)
+        assert not pool.cancel(queued)
+        lock.set()
+        yield running
+        try:
+            yield queued
+        except CancelledError:
+            raise gen.Return(True)
+
+    assert IOLoop.current().run_sync(main, timeout=5)
+    pool.shutdown()
+
+
+def test_threaded_uses_default_executor():
+    pool = ThreadPoolExecutor(max_workers=1)
+    previous = set_default_executor(pool)
+    try:
+        r = IOLoop.current().run_sync(blocking_func, timeout=2)
+        assert r == "DONE"
+        assert pool.workers == 1
+    finally:
+        set_default_executor(previous)
+        pool.shutdown()
+
+
+@processed
+def cpu_bound_func(data, repeat=1):
+    return os.getpid(), data * repeat
+
+
+@processed
+def cpu_bound_func_exception():
+    raise TestException("DONE")
+
+
+def test_processed_result():
+    pool = ProcessPoolExecutor(max_workers=1, shm_threshold=1024)
+    previous = set_default_process_executor(pool)
+    try:
+        io = IOLoop.current()
+        pid, r = io.run_sync(lambda: cpu_bound_func(b"ab", repeat=2), timeout=5)
+        assert pid != os.getpid()
+        assert r == b"abab", r
+
+        # both arguments and result are passed through shared memory
+        data = os.urandom(4096)
+        _, r = io.run_sync(lambda: cpu_bound_func(data, repeat=2), timeout=5)
+        assert r == data * 2
+    finally:
+        set_default_process_executor(previous)
+        pool.shutdown()
+
+
+@tools.raises(TestException)
+def test_processed_exception():
+    pool = ProcessPoolExecutor(max_workers=1)
+    previous = set_default_process_executor(pool)
+    try:
+        IOLoop.current().run_sync(cpu_bound_func_exception, timeout=5)
+    finally:
+        set_default_process_executor(previous)
+        pool.shutdown()
+
+
+@processed
+def cpu_bound_func_unpicklable():
+    return lambda: None
+
+
+def test_processed_unpicklable_result():
+    if sys.version_info[0] == 2:
+        raise SkipTest("Python 2 pools have no error callbacks")
+
+    pool = ProcessPoolExecutor(max_workers=1)
+    previous = set_default_process_executor(pool)
+    try:
+        try:
+            IOLoop.current().run_sync(cpu_bound_func_unpicklable, timeout=5)
+        except gen.TimeoutError:
+            raise AssertionError("the future has not been resolved")
+        except Exception:
+            pass
+        else:
+            raise AssertionError("the call must fail")
+        assert pool.stats()["pending"] == 0
+    finally:
+        set_default_process_executor(previous)
+        pool.shutdown()
@@ -20,8 +20,12 @@
 #
 
 import logging
+import threading
 import time
 
+import msgpack
+from tornado import gen
+from tornado.concurrent import Future
 from tornado.ioloop import IOLoop
 from tornado.test.util import unittest
 
@@ -63,6 +67,128 @@ def test_logger():
     ioloop.start()
 
 
+class FakePipe(object):
+    def __init__(self):
+        self.writes = list()
+
+    def closed(self):
+        return False
+
+    def close(self):
+        pass
+
+    def write(self, data):
+        self.writes.append(data)
+        future = Future()
+        IOLoop.current().call_later(0.01, future.set_result, None)
+        return future
+
+
+def in_thread(func):
+    # Logger is a per-thread singleton, a fresh thread gets a fresh one
+    result = list()
+
+    def run():
+        io_loop = IOLoop()
+        io_loop.make_current()
+        try:
+            result.append(io_loop.run_sync(func, timeout=5))
+        finally:
+            io_loop.close()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def test_logger_batches():
+    @gen.coroutine
+    def main():
+        logger = Logger(max_batch_bytes=100, max_batch_delay=0.05)
+        logger.pipe = FakePipe()
+        for i in range(10):
+            logger.info("message %d", i)
+        yield gen.sleep(0.2)
+        raise gen.Return((logger.pipe.writes, logger.stats()))
+
+    writes, stats = in_thread(main)
+    unpacker = msgpack.Unpacker(raw=False)
+    for data in writes:
+        assert 100 <= len(data) < 150 or data is writes[-1], len(data)
+        unpacker.feed(data)
+    messages = [msg[2][2] for msg in unpacker]
+    assert messages == ["message %d" % i for i in range(10)], messages
+    assert len(writes) > 1 and stats["batches"] == len(writes), stats
+    assert stats["messages"] == 10 and stats["bytes"] == sum(len(data) for data in writes), stats
+    assert stats["failed_batches"] == 0 and stats["queued"] == 0
+
+
+def test_logger_waits_for_batch():
+    @gen.coroutine
+    def main():
+        logger = Logger(max_batch_delay=0.05)
+        logger.pipe = FakePipe()
+        logger.info("first")
+        yield gen.sleep(0.02)
+        logger.info("second")
+        yield gen.sleep(0.1)
+        raise gen.Return(logger.stats())
+
+    stats = in_thread(main)
+    assert stats["batches"] == 1 and stats["max_batch_messages"] == 2, stats
+
+
+def test_logger_process_wide():
+    @gen.coroutine
+    def main():
+        logger = Logger.enable_process_wide(max_batch_delay=0.01)
+        logger.pipe = FakePipe()
+        assert Logger() is logger
+
+        # the IOLoop thread bypasses the deque
+        logger.info("loop")
+        assert not logger._pending
+
+        instances = list()
+
+        def produce(name):
+            instances.append(Logger())
+            for i in range(25):
+                Logger().info("%s %d", name, i)
+
+        threads = [threading.Thread(target=produce, args=("thread%d" % n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        yield gen.sleep(0.2)
+
+        pipe = logger.pipe
+        assert Logger.disable_process_wide() is logger
+        yield gen.sleep(0.01)
+        logger.info("after close")
+        raise gen.Return((logger, instances, pipe))
+
+    try:
+        logger, instances, pipe = in_thread(main)
+    finally:
+        Logger.disable_process_wide()
+
+    assert all(instance is logger for instance in instances)
+    unpacker = msgpack.Unpacker(raw=False)
+    for data in pipe.writes:
+        unpacker.feed(data)
+    messages = [msg[2][2] for msg in unpacker]
+    assert len(messages) == 101 and messages[0] == "loop", messages
+    for n in range(4):
+        own = [message for message in messages if message.startswith("thread%d " % n)]
+        assert own == ["thread%d %d" % (n, i) for i in range(25)], own
+    assert logger.stats()["messages"] == 101 and logger.stats()["queued"] == 0
+    assert logger.pipe is None
+    assert Logger() is not logger
+
+
 class LogFormatterTest(unittest.TestCase):
     def setUp(self):
         self.logger = Logger()
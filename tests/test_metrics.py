@@ -0,0 +1,102 @@
+#
+#    Copyright (c) 2012+ Anton Tyurin <noxiouz@yandex.ru>
+#    Copyright (c) 2013+ Evgeny Safronov <division494@gmail.com>
+#    Copyright (c) 2011-2014 Other contributors as noted in the AUTHORS file.
+#
+#    This file is part of Cocaine.
+#
+#    Cocaine is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Cocaine is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from nose import tools
+
+from cocaine.common import CocaineErrno
+from cocaine.detail.channel import Rx
+from cocaine.detail.metrics import EventMetrics
+from cocaine.detail.metrics import Histogram
+from cocaine.detail.metrics import prometheus_text
+from cocaine.detail.metrics import service_metrics
+from cocaine.detail.metrics import services_snapshot
+from cocaine.exceptions import DisconnectionError
+
+
+def test_histogram_buckets():
+    h = Histogram((0.1, 1, float("inf")))
+    for value in (0.05, 0.1, 0.5, 2, 100):
+        h.observe(value)
+
+    snapshot = h.snapshot()
+    assert snapshot["buckets"] == [[0.1, 2], [1, 1], [float("inf"), 2]], snapshot
+    assert snapshot["count"] == 5
+    assert abs(snapshot["sum"] - 102.65) < 1e-9, snapshot
+
+
+@tools.raises(ValueError)
+def test_histogram_requires_infinite_bound():
+    Histogram((0.1, 1))
+
+
+def test_service_metrics_track_sessions():
+    metrics = service_metrics("test_metrics_storage")
+    method = metrics.method(b"read")
+    rx_tree = {0: [b'write', None],
+               1: [b'error', {}],
+               2: [b'close', {}]}
+
+    rx = Rx(rx_tree, 1, metrics=method)
+    assert method.inflight == 1
+    rx.push(0, [b"abcd"], None)
+    rx.push(0, [b"ef"], None)
+    rx.push(2, [], None)
+
+    failed = Rx(rx_tree, 2, metrics=method)
+    failed.push(1, [(42, CocaineErrno.ETIMEOUT), "timeout"], None)
+    disconnected = Rx(rx_tree, 3, metrics=method)
+    disconnected.error(DisconnectionError("test_metrics_storage"))
+
+    # first connects of two clients and a reconnect of one of them
+    metrics.on_connect()
+    metrics.on_connect()
+    metrics.on_connect(reconnect=True)
+    snapshot = services_snapshot()["test_metrics_storage"]
+    assert snapshot["connects"] == 3 and snapshot["reconnects"] == 1, snapshot
+    read = snapshot["methods"]["read"]
+    assert read["inflight"] == 0, read
+    assert read["bytes_received"] == len(b"abcdef" b"timeout"), read
+    assert read["first_response"]["count"] == 2, read
+    assert read["latency"]["count"] == 3, read
+    assert read["errors"] == {CocaineErrno.ETIMEOUT: 1, CocaineErrno.ESRVDISCON: 1}, read
+
+
+def test_prometheus_text():
+    metrics = service_metrics("test_metrics_prometheus")
+    method = metrics.method(b"get")
+    method.calls += 1
+    method.latency.observe(0.02)
+    method.errors[CocaineErrno.ETIMEOUT] += 1
+    event = EventMetrics()
+    event.invokes += 1
+    event.latency.observe(2)
+
+    text = prometheus_text({b"ping": event})
+    labels = 'service="test_metrics_prometheus",method="get"'
+    assert "# TYPE cocaine_service_latency_seconds histogram" in text, text
+    assert 'cocaine_service_calls_total{%s} 1' % labels in text, text
+    assert 'cocaine_service_latency_seconds_bucket{%s,le="0.01"} 0' % labels in text, text
+    assert 'cocaine_service_latency_seconds_bucket{%s,le="0.05"} 1' % labels in text, text
+    assert 'cocaine_service_latency_seconds_bucket{%s,le="+Inf"} 1' % labels in text, text
+    assert 'cocaine_service_errors_total{%s,code="260"} 1' % labels in text, text
+    assert 'cocaine_worker_invokes_total{event="ping"} 1' in text, text
+    assert 'cocaine_worker_latency_seconds_bucket{event="ping",le="1"} 0' in text, text
+    assert text.count("# TYPE cocaine_service_latency_seconds ") == 1, text
@@ -0,0 +1,181 @@
+#
+#    Copyright (c) 2012+ Anton Tyurin <noxiouz@yandex.ru>
+#    Copyright (c) 2013+ Evgeny Safronov <division494@gmail.com>
+#    Copyright (c) 2011-2014 Other contributors as noted in the AUTHORS file.
+#
+#    This file is part of Cocaine.
+#
+#    Cocaine is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Cocaine is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+from nose import tools
+from tornado.ioloop import IOLoop
+
+from cocaine.detail.baseservice import BaseService
+from cocaine.detail.reaper import SessionReaper
+from cocaine.detail.util import BufferFull
+from cocaine.detail.util import FrameUnpacker
+from cocaine.detail.util import msgpack_packb
+from cocaine.detail.util import msgpack_packv
+from cocaine.worker.message import packv1
+from cocaine.worker.message import packv1_buffers
+
+
+def test_packv_small_frame_is_packed_at_once():
+    frame = [10, 0, [b"data"], {"a": 1}]
+    assert msgpack_packv(frame) == [msgpack_packb(frame)]
+
+
+def test_packv_does_not_copy_big_buffers():
+    for size in (0, 31, 32, 255, 256, 70000):
+        for payload in (b"x" * size, bytearray(b"x" * size), memoryview(b"x" * size)):
+            frame = [10, 0, [payload, 1], [[payload]]]
+            buffers = msgpack_packv(frame, threshold=0)
+            assert any(buff is payload for buff in buffers), size
+            assert b"".join(bytes(buff) for buff in buffers) == msgpack_packb(frame), size
+
+
+def test_packv1_buffers():
+    payload = b"x" * 100000
+    buffers = packv1_buffers(5, 0, payload)
+    assert len(buffers) == 2
+    assert buffers[1] is payload
+    assert b"".join(buffers) == packv1(5, 0, payload)
+
+
+def feed_by(unpacker, data, step):
+    frames = []
+    for pos in range(0, len(data), step):
+        unpacker.feed(data[pos:pos + step])
+        frames.extend(unpacker)
+    return frames
+
+
+def test_frame_unpacker_zero_copy():
+    big = b"x" * 100000
+    messages = [
+        [1, 0, []],
+        [2, 0, [big], [[False, 80, b"trace"]]],
+        [3, 0, [b"small"]],
+        [4, 0, [big, 7, b"tail"]],
+        [1, 0, []],
+        [5, 2, []],
+    ]
+    stream = b"".join(msgpack_packb(msg) for msg in messages)
+    for step in (1, 7, 30, 4096, len(stream)):
+        unpacker = FrameUnpacker(zero_copy_threshold=1024)
+        frames = feed_by(unpacker, stream, step)
+        assert len(frames) == len(messages), (step, len(frames))
+        assert isinstance(frames[1][2][0], memoryview)
+        assert frames[1][2][0].tobytes() == big
+        assert frames[1][3] == [[False, 80, b"trace"]], frames[1]
+        assert frames[2] == [3, 0, [b"small"]], frames[2]
+        assert frames[3][2][0].tobytes() == big
+        assert frames[3][2][1:] == [7, b"tail"], frames[3]
+        assert frames[5] == [5, 2, []]
+
+
+def test_frame_unpacker_without_zero_copy():
+    messages = [[1, 0, []], [2, 0, [b"x" * 100000]]]
+    stream = b"".join(msgpack_packb(msg) for msg in messages)
+    frames = feed_by(FrameUnpacker(), stream, 1000)
+    assert frames == messages
+
+
+def test_frame_unpacker_small_threshold():
+    # [1, 0, [b"de"]] with the payload length packed as 16 bit, the frame is shorter than a prefix
+    frame = b"\x93\x01\x00\x91\xc5\x00\x02de"
+    stream = frame + msgpack_packb([2, 0, [b"fgh"]]) + msgpack_packb([3, 0, []])
+    for size in (1, 7, len(stream)):
+        frames = feed_by(FrameUnpacker(zero_copy_threshold=2), stream, size)
+        assert len(frames) == 3, frames
+        assert bytes(frames[0][2][0]) == b"de" and frames[1] == [2, 0, [b"fgh"]], frames
+
+
+@tools.raises(BufferFull, ValueError)
+def test_frame_unpacker_limits_buffer():
+    data = msgpack_packb([2, 0, [b"x" * 100000]])
+    feed_by(FrameUnpacker(max_buffer_size=1024), data, 512)
+
+
+@tools.raises(BufferFull)
+def test_frame_unpacker_limits_zero_copy_payload():
+    data = msgpack_packb([2, 0, [b"x" * 100000]])
+    feed_by(FrameUnpacker(max_buffer_size=1024, zero_copy_threshold=512), data, 512)
+
+
+@tools.raises(BufferFull)
+def test_frame_unpacker_limits_declared_payload_by_default():
+    # a 2GB payload is declared, the buffer mustn't be allocated for it
+    data = b"\x93\x02\x00\x91\xdb\x7f\xff\xff\xff" + b"x" * 10
+    FrameUnpacker(zero_copy_threshold=65536).feed(data)
+
+
+def test_frame_unpacker_unlimited_buffer():
+    data = msgpack_packb([2, 0, [b"x" * 100000]])
+    frames = feed_by(FrameUnpacker(max_buffer_size=0, zero_copy_threshold=512), data, 512)
+    assert bytes(frames[0][2][0]) == b"x" * 100000
+
+
+class Session(object):
+    def __init__(self, created):
+        self.created = self.last_activity = created
+
+
+def test_session_reaper():
+    reaped = []
+    sessions = {1: Session(100), 2: Session(95), 3: Session(40)}
+    reaper = SessionReaper(sessions, lambda *args: reaped.append(args), idle_timeout=30)
+    stats = reaper.stats(now=101)
+    assert stats["sessions"] == 3
+    assert stats["ages"] == [[1, 1], [10, 1], [60, 0], [300, 1], [3600, 0], [float("inf"), 0]], stats
+
+    sessions[2].last_activity = 100
+    assert reaper.sweep(now=101) == 1
+    assert [session_id for session_id, _ in reaped] == [3]
+    assert sorted(sessions) == [1, 2]
+    assert reaper.stats(now=101)["reaped"] == 1
+
+
+def test_session_reaper_disabled():
+    sessions = {1: Session(0)}
+    reaper = SessionReaper(sessions, None)
+    assert reaper.sweep(now=10 ** 6) == 0
+    assert sessions
+
+
+class OpenPipe(object):
+    def closed(self):
+        return False
+
+    def write(self, data):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_service_session_kept_alive_by_tx():
+    service = BaseService("upload", [], session_idle_timeout=30)
+    service.pipe = OpenPipe()
+    service.api = {0: (b"upload", {0: (b"write", None), 1: (b"close", {})}, {0: (b"value", {})})}
+    channel = IOLoop.current().run_sync(service.upload)
+    rx = service.sessions[1]
+    rx.last_activity -= 60
+
+    # only the request is streamed, no response has been received yet
+    IOLoop.current().run_sync(lambda: channel.tx.write(b"chunk"))
+    assert service._reaper.sweep() == 0 and service.sessions == {1: rx}
+    assert service._reaper.sweep(now=rx.last_activity + 31) == 1
@@ -20,15 +20,26 @@
 #
 
 import logging
+import os
 import sys
+import tempfile
+import time
 
+import msgpack
 from nose import tools
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
 
 from runtime import main_v1, HEADERS, BODY, HTTP_VERSION
 from cocaine.worker import Worker
 from cocaine.worker.worker import WorkerV1
+from cocaine.common import CocaineErrno
+from cocaine.worker.message import Message, RPC
 from cocaine.worker.request import RequestError
+from cocaine.worker.response import ResponseStream
 
+from cocaine.decorators import asgi
 from cocaine.decorators import wsgi
 from cocaine.decorators import http
 
@@ -163,3 +174,446 @@ def test_worker_unable_to_connect():
                   heartbeat_timeout=2)
     w = Worker(**kwargs)
     w.run()
+
+
+class FakeWorker(object):
+    def __init__(self):
+        self.io_loop = IOLoop.current()
+        self.sent = list()
+
+    def send_chunk(self, session, data):
+        self.sent.append(("write", session, bytes(data)))
+
+    def send_choke(self, session):
+        self.sent.append(("close", session))
+
+    def send_error(self, session, category, code, msg):
+        self.sent.append(("error", session, code, msg))
+
+
+def test_response_buffered_coalesces_by_size():
+    worker = FakeWorker()
+    response = ResponseStream(1, worker, buffer_size=8, flush_timeout=10)
+    response.write(b"abc")
+    response.write(u"def")
+    assert worker.sent == []
+    response.write(b"gh")
+    assert worker.sent == [("write", 1, b"abcdefgh")], worker.sent
+    response.write(b"i")
+    response.write(b"0123456789")
+    response.close()
+    assert worker.sent[1:] == [("write", 1, b"i"),
+                               ("write", 1, b"0123456789"),
+                               ("close", 1)], worker.sent
+
+
+def test_response_buffered_flushes_by_timeout():
+    worker = FakeWorker()
+    response = ResponseStream(1, worker, buffer_size=1024, flush_timeout=0.01)
+
+    @gen.coroutine
+    def main():
+        response.write(b"a")
+        response.write(b"b")
+        yield gen.sleep(0.05)
+        assert worker.sent == [("write", 1, b"ab")], worker.sent
+        response.write(b"c")
+        response.error(100, "failed")
+
+    IOLoop.current().run_sync(main, timeout=1)
+    assert worker.sent[1:] == [("write", 1, b"c"), ("error", 1, 100, "failed")], worker.sent
+
+
+def test_response_unbuffered():
+    worker = FakeWorker()
+    response = ResponseStream(1, worker)
+    response.write(b"a")
+    response.write(b"b")
+    assert worker.sent == [("write", 1, b"a"), ("write", 1, b"b")], worker.sent
+
+
+def test_response_write_file():
+    worker = FakeWorker()
+    response = ResponseStream(1, worker)
+    content = os.urandom(100000)
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(content)
+        f.flush()
+
+        IOLoop.current().run_sync(lambda: response.write_file(f.name, chunk_size=30000))
+        chunks = [data for _, _, data in worker.sent]
+        assert [len(chunk) for chunk in chunks] == [30000, 30000, 30000, 10000]
+        assert b"".join(chunks) == content
+
+        del worker.sent[:]
+        with open(f.name, "rb") as fd:
+            IOLoop.current().run_sync(lambda: response.write_file(fd.fileno(), offset=70000, length=100))
+        assert [data for _, _, data in worker.sent] == [content[70000:70100]]
+
+
+class HoldingWorker(FakeWorker):
+    # keeps the slices like a backed up IOStream until they are written one by one
+    def __init__(self):
+        super(HoldingWorker, self).__init__()
+        self.written_at = 0
+
+    def send_chunk(self, session, data):
+        future = Future()
+        item = ("write", session, data)
+        self.sent.append(item)
+
+        def done():
+            self.sent.remove(item)
+            future.set_result(None)
+        self.written_at = max(self.written_at, self.io_loop.time()) + 0.01
+        self.io_loop.call_at(self.written_at, done)
+        return future
+
+
+def test_response_write_file_waits_for_writes():
+    worker = HoldingWorker()
+    response = ResponseStream(1, worker)
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(os.urandom(10000))
+        f.flush()
+        IOLoop.current().run_sync(lambda: response.write_file(f.name, chunk_size=3000), timeout=5)
+    assert worker.sent == []
+
+
+@tools.raises(ValueError)
+def test_response_write_file_out_of_range():
+    response = ResponseStream(1, FakeWorker())
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(b"abc")
+        f.flush()
+        IOLoop.current().run_sync(lambda: response.write_file(f.name, offset=2, length=2))
+
+
+class FakePipe(object):
+    def __init__(self):
+        self.written = list()
+
+    def write(self, data):
+        self.written.append(data)
+
+
+def make_offline_worker(**kwargs):
+    w = WorkerV1(app="testapp", endpoint="tests/enp2", uuid="randomuuid",
+                 disown_timeout=1, heartbeat_timeout=2, **kwargs)
+    w.pipe = FakePipe()
+    return w
+
+
+def unpack_written(pipe):
+    unpacker = msgpack.Unpacker()
+    for data in pipe.written:
+        unpacker.feed(bytes(data))
+    return list(unpacker)
+
+
+def test_worker_drain_on_terminate():
+    w = make_offline_worker(drain_timeout=0.3)
+    stopped = list()
+    w._stop = lambda: stopped.append(True)
+
+    def fast(request, response):
+        yield gen.sleep(0.05)
+        response.write("done")
+
+    def hung(request, response):
+        yield gen.sleep(10)
+
+    w.on("fast", fast)
+    w.on("hung", hung)
+
+    @gen.coroutine
+    def main():
+        w._dispatch_invoke(Message(RPC.INVOKE, 2, b"fast"), None)
+        w._dispatch_invoke(Message(RPC.INVOKE, 3, b"hung"), None)
+        assert w.inflight == 2
+        w.terminate(1, "bye")
+        # new invokes are rejected while draining
+        w._dispatch_invoke(Message(RPC.INVOKE, 4, b"fast"), None)
+        while not stopped:
+            yield gen.sleep(0.01)
+
+    IOLoop.current().run_sync(main, timeout=2)
+    assert w.inflight == 0
+
+    sessions = dict()
+    for session, type_id, args in unpack_written(w.pipe):
+        sessions.setdefault(session, []).append((type_id, args))
+    assert sessions[2] == [(0, [b"done"]), (2, [])], sessions[2]
+    assert sessions[3][0][0] == 1 and sessions[3][0][1][0][1] == CocaineErrno.ESHUTDOWN, sessions[3]
+    assert sessions[4][0][0] == 1 and sessions[4][0][1][0][1] == CocaineErrno.ESHUTDOWN, sessions[4]
+    assert sessions[1][0][0] == 1, sessions[1]
+
+
+def test_worker_drain_reports_sessions():
+    w = make_offline_worker()
+
+    def fast(request, response):
+        yield gen.sleep(0.05)
+
+    def hung(request, response):
+        yield gen.sleep(10)
+
+    w.on("fast", fast)
+    w.on("hung", hung)
+
+    @gen.coroutine
+    def main():
+        w._dispatch_invoke(Message(RPC.INVOKE, 2, b"fast"), None)
+        w._dispatch_invoke(Message(RPC.INVOKE, 3, b"hung"), None)
+        result = yield w.drain(0.2)
+        raise gen.Return(result)
+
+    assert IOLoop.current().run_sync(main, timeout=2) == (1, 1)
+
+
+def test_worker_handler_timeout():
+    w = make_offline_worker(handler_timeout=0.05)
+    errors = list()
+
+    def waiting(request, response):
+        try:
+            yield request.read()
+        except RequestError as err:
+            errors.append(err)
+
+    def hung(request, response):
+        yield gen.sleep(10)
+
+    w.on("waiting", waiting, timeout=0.05)
+    w.on("hung", hung)
+    w.on("unlimited", hung, timeout=0)
+
+    @gen.coroutine
+    def main():
+        w._dispatch_invoke(Message(RPC.INVOKE, 2, b"waiting"), None)
+        w._dispatch_invoke(Message(RPC.INVOKE, 3, b"hung"), None)
+        w._dispatch_invoke(Message(RPC.INVOKE, 4, b"unlimited"), None)
+        yield gen.sleep(0.2)
+
+    IOLoop.current().run_sync(main, timeout=2)
+    assert w.timeouts == {b"waiting": 1, b"hung": 1}, w.timeouts
+    assert len(errors) == 1 and errors[0].code == CocaineErrno.ETIMEOUT, errors
+    assert sorted(w.sessions) == [4], w.sessions
+    assert w.inflight == 1
+
+    frames = unpack_written(w.pipe)
+    assert sorted(session for session, _, _ in frames) == [2, 3], frames
+    for _, type_id, args in frames:
+        assert type_id == 1 and args[0][1] == CocaineErrno.ETIMEOUT, args
+
+
+def test_worker_reaps_idle_sessions():
+    w = make_offline_worker(session_idle_timeout=5)
+    errors = list()
+
+    def done(request, response):
+        response.write("A")
+
+    def streaming(request, response):
+        try:
+            yield request.read()
+        except RequestError as err:
+            errors.append(err)
+
+    w.on("done", done)
+    w.on("streaming", streaming)
+
+    @gen.coroutine
+    def main():
+        # the peer never sends choke for these sessions
+        w._dispatch_invoke(Message(RPC.INVOKE, 2, b"done"), None)
+        w._dispatch_invoke(Message(RPC.INVOKE, 3, b"streaming"), None)
+        yield gen.moment
+        stats = w.session_stats()
+        assert stats["sessions"] == 2, stats
+        assert stats["ages"][0] == [1, 2], stats
+
+        assert w._reaper.sweep() == 0
+        assert w._reaper.sweep(time.time() + 10) == 2
+        yield gen.moment
+
+    IOLoop.current().run_sync(main, timeout=2)
+    assert w.sessions == {}
+    assert w.inflight == 0
+    assert w.session_stats()["reaped"] == 2
+    assert len(errors) == 1 and errors[0].code == CocaineErrno.ETIMEOUT, errors
+
+
+def test_worker_lag_monitor_reports_blocking_handler():
+    # timers left by the previous tests on the current loop could stop it
+    io_loop = IOLoop()
+    io_loop.make_current()
+    w = make_offline_worker(lag_threshold=0.1, lag_interval=0.02)
+    reports = list()
+    w.lag_monitor._report = lambda blocked_for: reports.append((blocked_for, w.active))
+    active = list()
+
+    def blocking(request, response):
+        active.append(w.active)
+        yield gen.sleep(0.05)
+        active.append(w.active)
+        time.sleep(0.3)
+
+    w.on("blocking", blocking)
+
+    @gen.coroutine
+    def main():
+        w.lag_monitor.start()
+        yield gen.sleep(0.05)
+        w._dispatch_invoke(Message(RPC.INVOKE, 2, b"blocking"), None)
+        assert w.active is None
+        yield gen.sleep(0.5)
+        w.lag_monitor.stop()
+
+    io_loop.run_sync(main, timeout=2)
+    assert active == [(b"blocking", 2), (b"blocking", 2)], active
+    assert len(reports) == 1, reports
+    assert reports[0][1] == (b"blocking", 2), reports
+    assert w.lag_monitor.stats()["blocked"] == 1
+    assert w.lag_monitor.stats()["max_lag"] >= 0.2, w.lag_monitor.stats()
+
+
+def test_worker_tracks_active_handler_only_when_needed():
+    w = make_offline_worker()
+    active = list()
+
+    def handler(request, response):
+        active.append(w.active)
+        yield gen.moment
+
+    w.on("handler", handler)
+    w._dispatch_invoke(Message(RPC.INVOKE, 2, b"handler"), None)
+    assert active == [None], active
+
+
+@tools.raises(RuntimeError)
+def test_worker_stops_on_failed_asgi_startup():
+    io_loop = IOLoop()
+    io_loop.make_current()
+    w = make_offline_worker()
+    w.async_connect = lambda: w.pipe.write(b"handshake")
+
+    def application(scope, receive, send):
+        return send({"type": "lifespan.startup.failed", "message": "no database"})
+
+    try:
+        w.run({"http": asgi(application)})
+    finally:
+        assert w.pipe.written == []
+
+
+def test_worker_event_metrics():
+    io_loop = IOLoop()
+    io_loop.make_current()
+    w = make_offline_worker(metrics_event="metrics")
+
+    def echo(request, response):
+        data = yield request.read()
+        response.write(data)
+        response.write(data)
+
+    def failing(request, response):
+        raise Exception("boom")
+
+    w.on("echo", echo)
+    w.on("failing", failing)
+
+    @gen.coroutine
+    def main():
+        w._dispatch_invoke(Message(RPC.INVOKE, 2, b"echo"), None)
+        assert w.event_stats()["echo"]["inflight"] == 1
+        w._dispatch_chunk(Message(RPC.CHUNK, 2, b"ping"), None)
+        w._dispatch_invoke(Message(RPC.INVOKE, 3, b"failing"), None)
+        yield gen.sleep(0.01)
+        w._dispatch_invoke(Message(RPC.INVOKE, 4, b"metrics"), None)
+        yield gen.moment
+
+    io_loop.run_sync(main, timeout=2)
+    stats = w.event_stats()
+    echo = stats["echo"]
+    assert echo["invokes"] == 1 and echo["inflight"] == 0, echo
+    assert echo["bytes_in"] == 4 and echo["bytes_out"] == 8, echo
+    assert echo["latency"]["count"] == 1 and echo["first_chunk"]["count"] == 1, echo
+    assert echo["errors"] == {}, echo
+    assert stats["failing"]["errors"] == {CocaineErrno.EUNCAUGHTEXCEPTION: 1}, stats["failing"]
+    assert stats["failing"]["first_chunk"]["count"] == 0, stats["failing"]
+
+    frames = [args for session, type_id, args in unpack_written(w.pipe) if session == 4]
+    reply = msgpack.unpackb(frames[0][0], raw=False)
+    assert reply["events"]["echo"]["invokes"] == 1, reply
+    assert reply["inflight"] == 1, reply
+
+
+def test_worker_profiler_event():
+    io_loop = IOLoop()
+    io_loop.make_current()
+    w = make_offline_worker(profiler_event="profile", profiler_interval=0.001)
+
+    def busy(request, response):
+        deadline = time.time() + 0.2
+        while time.time() < deadline:
+            pass
+        response.write("done")
+
+    w.on("busy", busy)
+
+    @gen.coroutine
+    def main():
+        w._dispatch_invoke(Message(RPC.INVOKE, 2, b"profile"), None)
+        yield gen.moment
+        assert w.profiler.running
+        w._dispatch_invoke(Message(RPC.INVOKE, 3, b"busy"), None)
+        yield gen.moment
+        w._dispatch_invoke(Message(RPC.INVOKE, 4, b"profile"), None)
+        yield gen.moment
+
+    io_loop.run_sync(main, timeout=2)
+    assert not w.profiler.running
+    assert w.profiler.samples > 0
+
+    frames = [args for session, type_id, args in unpack_written(w.pipe) if session == 4 and type_id == 0]
+    stacks = frames[0][0].decode("utf-8").splitlines()
+    busy_stacks = [line for line in stacks if line.startswith("event:busy;")]
+    assert busy_stacks, stacks
+    assert all(" (%s:" % __file__.replace(".pyc", ".py") in line for line in busy_stacks), busy_stacks
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in stacks) == w.profiler.samples
+
+
+def test_worker_warmup_before_handshake():
+    io_loop = IOLoop()
+    io_loop.make_current()
+    w = make_offline_worker()
+    order = list()
+
+    class FakeService(object):
+        name = "storage"
+
+        @gen.coroutine
+        def connect(self):
+            yield gen.sleep(0.01)
+            order.append("service")
+
+    def fill_cache():
+        order.append("cache")
+
+    def failing():
+        raise Exception("boom")
+
+    @gen.coroutine
+    def hung():
+        yield gen.sleep(10)
+
+    def connect():
+        order.append("handshake")
+        w._stop()
+
+    w.async_connect = connect
+    w.run(services=[FakeService()], warmup=[fill_cache, failing, hung], warmup_timeout=0.1)
+    assert order == ["cache", "service", "handshake"], order
+
+    assert io_loop.run_sync(lambda: w.warmup([FakeService()], [fill_cache]), timeout=2) == 2